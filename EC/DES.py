@@ -1,7 +1,12 @@
-from bitstring import BitArray
-import numpy as np
 import EC.DES_VALS as vals
 import itertools as iter
+from functools import lru_cache
+from common.lazy import lazy_import, lazy_attribute
+from common.permutation import compile_permutation
+from common.trace import Recorder, tee
+
+BitArray = lazy_attribute('bitstring', 'BitArray')
+np = lazy_import('numpy')
 
 def flatten_list(list: list):
     """
@@ -30,12 +35,13 @@ def split_bitarray(tosplit: BitArray, n: int):
         output.append(ba_temp)
     return output
 
-def do_f(R: BitArray, K: BitArray, debug = False):
+def do_f(R: BitArray, K: BitArray, debug = False, tracer=None):
     """
     'f' function used in the DES encryption process
     :param R: a 32-bit block of data 
     :param K: a 48-bit block of data (typically a subkey)
     :param debug: set to true if debugging print statements are needed
+    :param tracer: callable receiving (round, stage, value) events, see do_f_traced
     :return: the 32-bit output of f
     """
     # initial checks
@@ -43,30 +49,19 @@ def do_f(R: BitArray, K: BitArray, debug = False):
         raise ValueError('R does not have a length of 32')
     if(len(K) != 48):
         raise ValueError('K does not have a length of 48')
-    # Expand R
-    R_expanded = BitArray(flatten_list(do_permutation(R, vals.E)))
-    if debug: print('E(R): %s' % R_expanded.bin)
-    # XOR E(R) with subkey
-    RK_Sum = R_expanded ^ K
-    if debug: print('E(R) + K: %s' % RK_Sum.bin)
-    # split the sum in to portions of length 6 and perform S-boxes on each
-    RK_Sum_Split =  split_bitarray(RK_Sum, 6)
-    for i in range(0,len(RK_Sum_Split)):
-        box = vals.sbox_array[i]
-        sum_element = RK_Sum_Split[i][:]
-        col = sum_element[1:5].uint
-        del sum_element[1:5]
-        row = sum_element.uint
-        box_result = box[row][col]
-        RK_Sum_Split[i] = BitArray(uint=box_result, length=4)
-    boxed_sum = BitArray()
-    for sum_element in RK_Sum_Split:
-        boxed_sum.append(sum_element)
-    if debug: print('S-Box result: %s' % boxed_sum.bin)
-    # perform the final permutatin
-    output = BitArray(flatten_list(do_permutation(boxed_sum, vals.P)))
-    if debug: print('output of f: %s' % output.bin)
-    return output
+    if not debug and tracer is None:
+        return BitArray(uint=do_f_int(R.uint, K.uint), length=32)
+    recorder = Recorder() if debug else None
+    tracer = tee(recorder, tracer)
+    tracer(0, 'input', R.uint)
+    output = do_f_traced(R.uint, K.uint, tracer)
+    if debug:
+        values = dict((stage, value) for _, stage, value in recorder.events)
+        print('E(R): %s' % BitArray(uint=values['E'], length=48).bin)
+        print('E(R) + K: %s' % BitArray(uint=values['xor'], length=48).bin)
+        print('S-Box result: %s' % BitArray(uint=values['S'], length=32).bin)
+        print('output of f: %s' % BitArray(uint=values['f'], length=32).bin)
+    return BitArray(uint=output, length=32)
 
 # The below can be used to validate the functionality of do_f as described in
 # http://page.math.tu-berlin.de/~kant/teaching/hess/krypto-ws2006/des.htm
@@ -81,11 +76,9 @@ def do_permutation(data_in: BitArray, permutation_mat: list):
     :return: 
     """
     shape   = (len(permutation_mat), len(permutation_mat[0]))
-    output  = [[False]*shape[1] for i in range(0,shape[0])]
-    for row,col in iter.product(range(0, shape[0]), range(0, shape[1])):
-        index = permutation_mat[row][col]
-        output[row][col] = data_in[index-1]
-    return output
+    permuted = compile_permutation(permutation_mat, len(data_in))(data_in.uint)
+    bits = [bool((permuted >> (shape[0] * shape[1] - 1 - i)) & 1) for i in range(0, shape[0] * shape[1])]
+    return [bits[row * shape[1]:(row + 1) * shape[1]] for row in range(0, shape[0])]
 
 # The below can be used to validate the functionality of do_permutation as described in
 # http://page.math.tu-berlin.de/~kant/teaching/hess/krypto-ws2006/des.htm
@@ -93,100 +86,356 @@ def do_permutation(data_in: BitArray, permutation_mat: list):
 # for item in do_permutation(M, vals.ip):
 #     print(BitArray(item).bin)
 
-def get_subkeys(seed: BitArray, debug = False):
+def get_subkeys(seed: BitArray, debug = False, tracer=None):
     """
     Get the set of 16 48-bit subkeys needed for the DES algorithm
      seed determines the value of these keys
     :param seed: seed key
     :param debug: set to true if debugging print statements are needed
+    :param tracer: callable receiving (round, stage, value) events, see get_subkeys_int
     :return: an array of the 16 subkeys
     """
-    # initialize C and D arrays to all zeros
-    C = [[False]*28 for i in range(0,17)]
-    D = [[False]*28 for i in range(0,17)]
-    # first, get initial values for C and D
-    key_permuted = do_permutation(seed, vals.pc_1)
-    if debug:
-        print('Permuted key value: %s'
-              % str(key_permuted))
-    C[0] = BitArray(flatten_list(key_permuted[0:4]))
-    D[0] = BitArray(flatten_list(key_permuted[4:]))
-    shift_amnts = vals.keygen_shift_table
-    for i in range(1,17):
-        C_prev = BitArray(C[i-1])
-        C_prev.rol(shift_amnts[i - 1])
-        C[i] = C_prev
-        D_prev = BitArray(D[i - 1])
-        D_prev.rol(shift_amnts[i - 1])
-        D[i] = D_prev
+    recorder = Recorder() if debug else None
+    K = get_subkeys_int(seed.uint, tee(recorder, tracer))
     # print values of C and D if debug flag is set
     if debug:
-        print('\nC values:')
-        for i in range(0, len(C)):
-            print('C_%s = %s' % (i, C[i].bin))
-        print('\nD values:')
-        for i in range(0, len(D)):
-            print('D_%s = %s' % (i, D[i].bin))
-    # create the subkeys based on the C and D values
-    K = []
-    for i in range(0, 17):
-        k_temp = BitArray(C[i]+D[i])
-        K.append(BitArray(flatten_list(do_permutation(k_temp, vals.pc_2))))
-    if debug:
+        print('Permuted key value: %s'
+              % str(do_permutation(seed, vals.pc_1)))
+        for stage in ('C', 'D'):
+            print('\n%s values:' % stage)
+            for i, value in sorted(recorder.values(stage).items()):
+                print('%s_%s = %s' % (stage, i, BitArray(uint=value, length=28).bin))
         print('\nSubkey values:')
         for i in range(0, len(K)):
-            print('K_%s = %s' % (i, K[i].bin))
-    return K
+            print('K_%s = %s' % (i, BitArray(uint=K[i], length=48).bin))
+    return [BitArray(uint=k, length=48) for k in K]
 
 # The below can be used to validate the functionality of get_subkeys as described in
 # http://page.math.tu-berlin.de/~kant/teaching/hess/krypto-ws2006/des.htm
 # K = BitArray('0b 00010011 00110100 01010111 01111001 10011011 10111100 11011111 11110001')
 # get_subkeys(K, debug=True)
 
-def DES_encrypt(plaintext: BitArray, key_seed: BitArray, debug=False):
+# Integer core
+# The functions below work on plain integers, bit 1 of the DES tables being the most
+# significant bit. Every permutation is compiled once by common.permutation, and each entry of
+# vals.sbox_array is merged with the permutation P, so f costs four lookups for E and eight
+# for the S-boxes.
+
+def sp_tables(permute=True):
+    """
+    Build the combined S-box and P tables used by the integer f function
+    :param permute: set to False to leave P out, for the tables of the S-boxes alone
+    :return: list of 8 tables of 64 entries, table i maps the i-th 6-bit chunk of E(R) ^ K to
+             its contribution to the 32-bit output of f
+    """
+    tables = []
+    for i, box in enumerate(vals.sbox_array):
+        table = []
+        for chunk in range(0, 64):
+            row = ((chunk >> 4) & 2) | (chunk & 1)
+            col = (chunk >> 1) & 0xf
+            value = box[row][col] << (28 - 4 * i)
+            table.append(P_PERM(value) if permute else value)
+        tables.append(table)
+    return tables
+
+IP = compile_permutation(vals.ip, 64)
+IP_INV = compile_permutation(vals.ip_inv, 64)
+E_PERM = compile_permutation(vals.E, 32, method='tables')
+P_PERM = compile_permutation(vals.P, 32)
+PC_1 = compile_permutation(vals.pc_1, 64)
+PC_2 = compile_permutation(vals.pc_2, 56)
+E_TABLES = [table for _, _, table in E_PERM.chunks]
+SP_TABLES = sp_tables()
+S_TABLES = sp_tables(permute=False)
+
+def do_f_int(R: int, K: int):
+    """
+    Integer version of do_f
+    :param R: a 32-bit block of data
+    :param K: a 48-bit subkey
+    :return: the 32-bit output of f
+    """
+    e0, e1, e2, e3 = E_TABLES
+    x = (e0[R >> 24] | e1[(R >> 16) & 0xff] | e2[(R >> 8) & 0xff] | e3[R & 0xff]) ^ K
+    s0, s1, s2, s3, s4, s5, s6, s7 = SP_TABLES
+    return (s0[x >> 42] | s1[(x >> 36) & 0x3f] | s2[(x >> 30) & 0x3f] | s3[(x >> 24) & 0x3f]
+            | s4[(x >> 18) & 0x3f] | s5[(x >> 12) & 0x3f] | s6[(x >> 6) & 0x3f] | s7[x & 0x3f])
+
+def do_f_traced(R: int, K: int, tracer, round_number=0):
+    """
+    Step-by-step version of do_f_int reporting to a tracer (see common.trace) the stages 'E'
+    (expansion), 'xor' (with the subkey), 'S' (S-box output) and 'f' (after P)
+    :param R: a 32-bit block of data
+    :param K: a 48-bit subkey
+    :param tracer: callable receiving (round, stage, value) events
+    :param round_number: round reported with the events
+    :return: the 32-bit output of f
+    """
+    x = E_PERM(R)
+    tracer(round_number, 'E', x)
+    x ^= K
+    tracer(round_number, 'xor', x)
+    s = 0
+    for i, table in enumerate(S_TABLES):
+        s |= table[(x >> (42 - 6 * i)) & 0x3f]
+    tracer(round_number, 'S', s)
+    f = P_PERM(s)
+    tracer(round_number, 'f', f)
+    return f
+
+def get_subkeys_int(seed: int, tracer=None):
+    """
+    Integer version of get_subkeys
+    :param seed: 64-bit seed key
+    :param tracer: callable receiving (round, stage, value) events: 'pc1' (C_0 D_0), then 'C',
+                   'D' and 'key' for rounds 0 to 16
+    :return: a list of 17 48-bit subkeys, index 0 being the permuted C_0 D_0 as in get_subkeys
+    """
+    CD = PC_1(seed)
+    C = CD >> 28
+    D = CD & 0xfffffff
+    K = [PC_2(CD)]
+    if tracer is not None:
+        tracer(0, 'input', seed)
+        tracer(0, 'pc1', CD)
+        tracer(0, 'C', C)
+        tracer(0, 'D', D)
+        tracer(0, 'key', K[0])
+    for i, shift in enumerate(vals.keygen_shift_table, 1):
+        C = ((C << shift) | (C >> (28 - shift))) & 0xfffffff
+        D = ((D << shift) | (D >> (28 - shift))) & 0xfffffff
+        K.append(PC_2((C << 28) | D))
+        if tracer is not None:
+            tracer(i, 'C', C)
+            tracer(i, 'D', D)
+            tracer(i, 'key', K[i])
+    return K
+
+class KeySchedule:
+    """
+    The subkeys of one DES key, computed once. Pass it in place of the key to the encrypt
+    functions to skip the key schedule entirely.
+    """
+    def __init__(self, key_seed: int):
+        """
+        :param key_seed: 64-bit key as an integer
+        """
+        self.key = key_seed
+        self.subkeys = get_subkeys_int(key_seed)
+        # decryption runs the rounds with the subkeys in reverse order
+        self.decrypt_subkeys = [self.subkeys[0]] + self.subkeys[:0:-1]
+        self._key_masks = None
+
+    @property
+    def key_masks(self):
+        """
+        The subkeys as lanes for the bitsliced engine, index 0 is unused
+        """
+        if self._key_masks is None:
+            # the subkey bits are the same for every block, so each is an all-ones or zero lane
+            self._key_masks = [None]
+            for k in self.subkeys[1:]:
+                bits = np.array([(k >> (47 - j)) & 1 for j in range(0, 48)], dtype=bool)
+                self._key_masks.append(np.where(bits, np.uint64(ALL_ONES), np.uint64(0))[:, np.newaxis])
+        return self._key_masks
+
+    @property
+    def decrypt_key_masks(self):
+        """
+        The decryption subkeys as lanes for the bitsliced engine, index 0 is unused
+        """
+        return [None] + self.key_masks[:0:-1]
+
+    def round_subkeys(self, num_rounds=16, encrypt=True):
+        """
+        The subkeys of a reduced-round DES, which only uses the first num_rounds of them
+        :param num_rounds: number of rounds, 1 to 16
+        :param encrypt: set to True for encryption, False otherwise
+        :return: list of num_rounds + 1 subkeys, in encryption or decryption order
+        """
+        if num_rounds == 16:
+            return self.subkeys if encrypt else self.decrypt_subkeys
+        check_rounds(num_rounds)
+        if encrypt:
+            return self.subkeys[:num_rounds + 1]
+        return [self.subkeys[0]] + self.subkeys[num_rounds:0:-1]
+
+    def round_key_masks(self, num_rounds=16, encrypt=True):
+        """
+        Lanes version of round_subkeys, index 0 is unused
+        """
+        if num_rounds == 16:
+            return self.key_masks if encrypt else self.decrypt_key_masks
+        check_rounds(num_rounds)
+        if encrypt:
+            return self.key_masks[:num_rounds + 1]
+        return [None] + self.key_masks[num_rounds:0:-1]
+
+    def __repr__(self):
+        return 'KeySchedule(0x%016x)' % self.key
+
+# number of key schedules kept for callers passing raw keys
+KEY_CACHE_SIZE = 256
+
+_cached_schedule = lru_cache(maxsize=KEY_CACHE_SIZE)(KeySchedule)
+
+def key_schedule(key_seed):
+    """
+    Get the key schedule of a key, from the LRU cache when possible
+    :param key_seed: 64-bit key as an integer, or a KeySchedule which is returned as is
+    :return: KeySchedule for the key
+    """
+    if isinstance(key_seed, KeySchedule):
+        return key_seed
+    return _cached_schedule(key_seed)
+
+def key_cache_info():
+    """
+    Statistics of the key schedule cache
+    :return: named tuple of hits, misses, maxsize and currsize
+    """
+    return _cached_schedule.cache_info()
+
+def set_key_cache_size(maxsize: int):
+    """
+    Resize the key schedule cache, which also empties it and resets its counters
+    :param maxsize: number of key schedules to keep, None for no limit
+    """
+    global _cached_schedule
+    _cached_schedule = lru_cache(maxsize=maxsize)(KeySchedule)
+
+def check_rounds(num_rounds: int):
+    """
+    :param num_rounds: number of rounds of a reduced-round DES
+    """
+    if not 1 <= num_rounds <= 16:
+        raise ValueError('DES has 1 to 16 rounds.')
+
+def DES_process_int(data: int, keylist: list, tracer=None, num_rounds=16):
+    """
+    Run the DES rounds on an integer with the given subkeys
+    :param data: 64-bit block
+    :param keylist: list of 48-bit subkeys, index 0 unused, in encryption or decryption order
+    :param tracer: callable receiving (round, stage, value) events, see DES_trace_int
+    :param num_rounds: number of rounds, fewer than 16 for a reduced-round DES whose last round
+                       is followed by the swap and IP^-1 as usual
+    :return: 64-bit output
+    """
+    if tracer is not None:
+        return DES_trace_int(data, keylist, tracer, num_rounds)
+    block = IP(data)
+    L = block >> 32
+    R = block & 0xffffffff
+    for i in range(1, num_rounds + 1):
+        L, R = R, L ^ do_f_int(R, keylist[i])
+    return IP_INV((R << 32) | L)
+
+def DES_trace_int(data: int, keylist: list, tracer, num_rounds=16):
+    """
+    Step-by-step version of DES_process_int reporting to a tracer (see common.trace) the subkeys
+    as stage 'key' (rounds 0 to 16), the halves 'L' and 'R' after IP (round 0) and after every
+    round along with the stages of f (see do_f_traced), then 'RL' (the swapped halves before
+    IP^-1) and 'output' in the last round
+    :return: 64-bit output
+    """
+    tracer(0, 'input', data)
+    for i in range(0, len(keylist)):
+        tracer(i, 'key', keylist[i])
+    block = IP(data)
+    L = block >> 32
+    R = block & 0xffffffff
+    tracer(0, 'L', L)
+    tracer(0, 'R', R)
+    for i in range(1, num_rounds + 1):
+        L, R = R, L ^ do_f_traced(R, keylist[i], tracer, i)
+        tracer(i, 'L', L)
+        tracer(i, 'R', R)
+    block = (R << 32) | L
+    tracer(num_rounds, 'RL', block)
+    output = IP_INV(block)
+    tracer(num_rounds, 'output', output)
+    return output
+
+def DES_encrypt_int(plaintext: int, key_seed, tracer=None, num_rounds=16):
+    """
+    Integer version of DES_encrypt
+    :param plaintext: 64-bit plaintext
+    :param key_seed: 64-bit key or a KeySchedule
+    :param tracer: callable receiving (round, stage, value) events, see DES_trace_int
+    :param num_rounds: number of rounds, see DES_process_int
+    :return: 64-bit ciphertext
+    """
+    return DES_process_int(plaintext, key_schedule(key_seed).round_subkeys(num_rounds), tracer, num_rounds)
+
+def DES_decrypt_int(ciphertext: int, key_seed, tracer=None, num_rounds=16):
+    """
+    Integer version of DES_decrypt
+    :param ciphertext: 64-bit ciphertext
+    :param key_seed: 64-bit key or a KeySchedule
+    :param tracer: callable receiving (round, stage, value) events, see DES_trace_int
+    :param num_rounds: number of rounds, see DES_process_int
+    :return: 64-bit plaintext
+    """
+    return DES_process_int(ciphertext, key_schedule(key_seed).round_subkeys(num_rounds, encrypt=False), tracer,
+                           num_rounds)
+
+def DES_encrypt(plaintext: BitArray, key_seed, debug=False, tracer=None, num_rounds=16):
     """
     DES-Encrypt plaintext using the given key
     :param plaintext: Plaintext to be encrypted - MUST be 64 bits long
-    :param key_seed: Key used to encrypt - MUST be 64 bits long
+    :param key_seed: Key used to encrypt - MUST be 64 bits long, or a KeySchedule
     :param debug: set to true if debugging print statements are needed
+    :param tracer: callable receiving (round, stage, value) events, see DES_trace_int
+    :param num_rounds: number of rounds, see DES_process_int
     :return: encrypted data of length 64
     """
+    return DES_process(plaintext, key_seed, encrypt=True, debug=debug, tracer=tracer, num_rounds=num_rounds)
+
+def DES_decrypt(ciphertext: BitArray, key_seed, debug=False, tracer=None, num_rounds=16):
+    """
+    DES-Decrypt ciphertext using the given key
+    :param ciphertext: Ciphertext to be decrypted - MUST be 64 bits long
+    :param key_seed: Key used to encrypt - MUST be 64 bits long, or a KeySchedule
+    :param debug: set to true if debugging print statements are needed
+    :param tracer: callable receiving (round, stage, value) events, see DES_trace_int
+    :param num_rounds: number of rounds, see DES_process_int
+    :return: decrypted data of length 64
+    """
+    return DES_process(ciphertext, key_seed, encrypt=False, debug=debug, tracer=tracer, num_rounds=num_rounds)
+
+def DES_process(data: BitArray, key_seed, encrypt=True, debug=False, tracer=None, num_rounds=16):
+    """
+    DES-Encrypt or decrypt data using the given key
+    :param data: Plaintext or ciphertext - MUST be 64 bits long
+    :param key_seed: Key used to encrypt - MUST be 64 bits long, or a KeySchedule
+    :param encrypt: set to True for encryption, False otherwise
+    :param debug: set to true if debugging print statements are needed
+    :param tracer: callable receiving (round, stage, value) events, see DES_trace_int
+    :param num_rounds: number of rounds, see DES_process_int
+    :return: output data of length 64
+    """
     # initial checks
-    if (len(plaintext) != 64):
-        raise ValueError('plaintext does not have a length of 32')
-    if (len(key_seed) != 64):
+    if (len(data) != 64):
+        raise ValueError('%s does not have a length of 64' % ('plaintext' if encrypt else 'ciphertext'))
+    if not isinstance(key_seed, KeySchedule) and (len(key_seed) != 64):
         raise ValueError('key seed does not have a length of 64')
-    # Initalize left and right lists
-    L = [BitArray() for i in range(0, 17)]
-    R = [BitArray() for i in range(0, 17)]
-    keylist = get_subkeys(key_seed, debug=False)
+    schedule = key_schedule(key_seed if isinstance(key_seed, KeySchedule) else key_seed.uint)
+    subkeys = schedule.round_subkeys(num_rounds, encrypt)
+    recorder = Recorder() if debug else None
+    output = DES_process_int(data.uint, subkeys, tee(recorder, tracer), num_rounds)
     if debug:
         print('\nSubkey values:')
-        for i in range(0, len(keylist)):
-            print('K_%s = %s' % (i, keylist[i].bin))
-    IP_plaintext = [BitArray(element) for element in do_permutation(plaintext, vals.ip)]
-    temp_l = BitArray(flatten_list(IP_plaintext[:4]))
-    temp_r = BitArray(flatten_list(IP_plaintext[4:]))
-    [R[0], L[0]] = [temp_r, temp_l]
-    for i in range(1,17):
-        L[i] = R[i-1]
-        R[i] = L[i-1] ^ do_f(R[i-1], keylist[i])
-    if debug:
-        print('\nL values:')
-        for i in range(0, len(L)):
-            print('L_%s = %s' % (i, L[i].bin))
-        print('\nR values:')
-        for i in range(0, len(R)):
-            print('R_%s = %s' % (i, R[i].bin))
-    # R_fin = np.array(R[16])
-    # L_fin = np.array(L[16])
-    output_pre_permutation = np.concatenate((split_bitarray(R[16], 4), split_bitarray(L[16], 4)), axis=0)
-    output = do_permutation(BitArray(flatten_list(output_pre_permutation.tolist())), vals.ip_inv)
-    if debug:
+        for i in range(0, len(subkeys)):
+            print('K_%s = %s' % (i, BitArray(uint=subkeys[i], length=48).bin))
+        for stage in ('L', 'R'):
+            print('\n%s values:' % stage)
+            for i, value in sorted(recorder.values(stage).items()):
+                print('%s_%s = %s' % (stage, i, BitArray(uint=value, length=32).bin))
         print('Ciphertext before inverse permutation: ')
-        for element in output_pre_permutation:
-            print(BitArray(element).bin)
-    return BitArray(flatten_list(output))
+        for element in split_bitarray(BitArray(uint=recorder.values('RL')[num_rounds], length=64), 4):
+            print(element.bin)
+    return BitArray(uint=output, length=64)
 
 # The below can be used to validate the functionality of DES_encrypt() as described in
 # http://page.math.tu-berlin.de/~kant/teaching/hess/krypto-ws2006/des.htm
@@ -195,9 +444,270 @@ def DES_encrypt(plaintext: BitArray, key_seed: BitArray, debug=False):
 # y = DES_encrypt(x, K, debug=True)
 # print('\nCiphertext:' + str(y.hex))
 
-# Initialize given values
-x   = BitArray('0b 00100101 01100111 11001101 10110011 11111101 11001110 01111110 00101010')
-K   = BitArray('0b 11100101 01100111 11001101 10110011 11111101 11001110 01111111 00101010')
-y   = DES_encrypt(x, K)
-print('Ciphertext: %s' % y.hex)
+# Bitsliced batch mode
+# Many blocks are encrypted at once by storing bit j of every block in plane j, an array of
+# uint64 words holding that bit for 64 blocks each. Permutations then just reorder planes,
+# the subkey XOR inverts whole planes, and every S-box becomes a boolean circuit: a tree of
+# multiplexers over its six input planes built from the entries of vals.sbox_array, so each
+# numpy operation processes 64 blocks per word.
+
+ALL_ONES = 0xffffffffffffffff
+
+def sbox_circuit_constants():
+    """
+    Truth tables of every S-box output bit as full or empty lanes, the leaves of the circuits
+    :return: uint64 array of shape (8, 4, 64), element [i, j, v] is all ones if output bit j
+             (most significant first) of S-box i is set for the 6-bit input v
+    """
+    output = np.zeros((8, 4, 64), dtype=np.uint64)
+    for i, box in enumerate(vals.sbox_array):
+        for chunk in range(0, 64):
+            value = box[((chunk >> 4) & 2) | (chunk & 1)][(chunk >> 1) & 0xf]
+            for j in range(0, 4):
+                if (value >> (3 - j)) & 1:
+                    output[i, j, chunk] = ALL_ONES
+    return output
+
+# the circuit constants and the plane orders (IP.indices etc.) are built on first use
+sbox_constants = lru_cache(maxsize=None)(sbox_circuit_constants)
+
+def bitslice(blocks, bits=64):
+    """
+    Transpose an array of blocks into bit planes
+    :param blocks: numpy uint64 array of blocks
+    :param bits: number of bits per block
+    :return: uint64 array of shape (bits, ceil(len(blocks) / 64)), plane 0 holding the most
+             significant bit of every block
+    """
+    blocks = np.asarray(blocks, dtype=np.uint64)
+    words = -(-len(blocks) // 64)
+    padded = np.zeros(words * 64, dtype='>u8')
+    padded[:len(blocks)] = blocks
+    block_bits = np.unpackbits(padded.view(np.uint8).reshape(-1, 8), axis=1)[:, 64 - bits:]
+    return np.ascontiguousarray(np.packbits(block_bits.T, axis=1)).view(np.uint64)
+
+def unbitslice(planes, count: int):
+    """
+    Inverse of bitslice
+    :param planes: uint64 array of bit planes
+    :param count: number of blocks to return
+    :return: numpy uint64 array of blocks
+    """
+    bits = planes.shape[0]
+    block_bits = np.unpackbits(np.ascontiguousarray(planes).view(np.uint8), axis=1)[:, :count].T
+    if bits < 64:
+        block_bits = np.concatenate((np.zeros((count, 64 - bits), dtype=np.uint8), block_bits), axis=1)
+    return np.ascontiguousarray(np.packbits(block_bits, axis=1)).view('>u8')[:, 0].astype(np.uint64)
+
+def sboxes_bitsliced(x):
+    """
+    Apply the eight S-boxes to bitsliced data
+    :param x: uint64 array of shape (48, words), the planes of E(R) ^ K
+    :return: uint64 array of shape (32, words), the planes of the S-box output before P
+    """
+    x = x.reshape(8, 6, -1)
+    circuit = sbox_constants()[:, :, :, np.newaxis]
+    # multiplexer tree: select on the last input bit first, halving the truth tables each time
+    for var in range(5, -1, -1):
+        select = x[:, var][:, np.newaxis, np.newaxis, :]
+        low = circuit[:, :, 0::2]
+        high = circuit[:, :, 1::2]
+        circuit = low ^ ((low ^ high) & select)
+    return circuit[:, :, 0].reshape(32, -1)
+
+def DES_process_bitsliced(planes, key_masks: list, tracer=None, num_rounds=16):
+    """
+    Run the DES rounds over bitsliced blocks
+    :param planes: uint64 array of shape (64, words) from bitslice
+    :param key_masks: subkey lanes from KeySchedule, in encryption or decryption order
+    :param tracer: callable receiving (round, stage, value) events with the bit planes of the
+                   stages of DES_trace_int, except 'E' which is merged into 'xor' here
+    :param num_rounds: number of rounds, see DES_process_int
+    :return: bitsliced output
+    """
+    if tracer is not None:
+        tracer(0, 'input', planes)
+    block = planes[IP.indices]
+    L = block[:32]
+    R = block[32:]
+    if tracer is not None:
+        tracer(0, 'L', L)
+        tracer(0, 'R', R)
+    for i in range(1, num_rounds + 1):
+        if tracer is None:
+            f = sboxes_bitsliced(R[E_PERM.indices] ^ key_masks[i])[P_PERM.indices]
+        else:
+            x = R[E_PERM.indices] ^ key_masks[i]
+            tracer(i, 'xor', x)
+            s = sboxes_bitsliced(x)
+            tracer(i, 'S', s)
+            f = s[P_PERM.indices]
+            tracer(i, 'f', f)
+        L, R = R, L ^ f
+        if tracer is not None:
+            tracer(i, 'L', L)
+            tracer(i, 'R', R)
+    output = np.concatenate((R, L))[IP_INV.indices]
+    if tracer is not None:
+        tracer(num_rounds, 'output', output)
+    return output
+
+def DES_encrypt_batch(blocks, key_seed, chunk_size=2**16, tracer=None, num_rounds=16):
+    """
+    DES-Encrypt many 64-bit blocks under one key using the bitsliced engine
+    :param blocks: array-like of 64-bit plaintext blocks (numpy uint64)
+    :param key_seed: 64-bit key as an integer, or a KeySchedule
+    :param chunk_size: number of blocks transposed and encrypted at a time
+    :param tracer: callable receiving (round, stage, value) events, see DES_process_batch
+    :param num_rounds: number of rounds, see DES_process_int
+    :return: numpy uint64 array of ciphertext blocks
+    """
+    return DES_process_batch(blocks, key_schedule(key_seed).round_key_masks(num_rounds), chunk_size, tracer,
+                             num_rounds)
+
+def DES_decrypt_batch(blocks, key_seed, chunk_size=2**16, tracer=None, num_rounds=16):
+    """
+    DES-Decrypt many 64-bit blocks under one key using the bitsliced engine
+    :param blocks: array-like of 64-bit ciphertext blocks (numpy uint64)
+    :param key_seed: 64-bit key as an integer, or a KeySchedule
+    :param chunk_size: number of blocks transposed and decrypted at a time
+    :param tracer: callable receiving (round, stage, value) events, see DES_process_batch
+    :param num_rounds: number of rounds, see DES_process_int
+    :return: numpy uint64 array of plaintext blocks
+    """
+    return DES_process_batch(blocks, key_schedule(key_seed).round_key_masks(num_rounds, encrypt=False), chunk_size,
+                             tracer, num_rounds)
+
+def DES_process_batch(blocks, key_masks: list, chunk_size=2**16, tracer=None, num_rounds=16):
+    """
+    Run the DES rounds over many blocks, chunk by chunk
+    :param blocks: array-like of 64-bit blocks (numpy uint64)
+    :param key_masks: subkey lanes from KeySchedule, in encryption or decryption order
+    :param chunk_size: number of blocks transposed at a time
+    :param tracer: callable receiving (round, stage, value) events for every chunk: those of
+                   DES_process_bitsliced, plus 'bitslice' and 'unbitslice' in round 0 and the
+                   last round with the transposed input and the output blocks
+    :param num_rounds: number of rounds, see DES_process_int
+    :return: numpy uint64 array of output blocks
+    """
+    blocks = np.asarray(blocks, dtype=np.uint64)
+    output = np.empty(len(blocks), dtype=np.uint64)
+    for start in range(0, len(blocks), chunk_size):
+        chunk = blocks[start:start + chunk_size]
+        if tracer is None:
+            output[start:start + len(chunk)] = unbitslice(DES_process_bitsliced(bitslice(chunk), key_masks,
+                                                                                num_rounds=num_rounds), len(chunk))
+            continue
+        tracer(0, 'input', chunk)
+        planes = bitslice(chunk)
+        tracer(0, 'bitslice', planes)
+        planes = DES_process_bitsliced(planes, key_masks, tracer, num_rounds)
+        output[start:start + len(chunk)] = unbitslice(planes, len(chunk))
+        tracer(num_rounds, 'unbitslice', output[start:start + len(chunk)])
+    return output
+
+# Key-batched mode
+# One block under many keys, e.g. for key searches: every key schedule is computed at once on
+# numpy arrays of packed keys (PC_1, the rotations of C and D, PC_2 through apply_array), then
+# the rounds run in lockstep, element k of every array belonging to key k, with the same E and
+# S-box/P tables as do_f_int used as numpy gathers. Bitslicing does not pay off here since the
+# subkeys differ per lane and would have to be transposed every round.
+
+def sp_table_array():
+    """
+    :return: uint32 array of shape (8, 64), SP_TABLES for numpy gathers
+    """
+    return np.array(SP_TABLES, dtype=np.uint32)
+
+# built on first use, like the circuit constants
+sp_arrays = lru_cache(maxsize=None)(sp_table_array)
+
+def get_subkeys_array(keys, num_rounds=16):
+    """
+    Array version of get_subkeys_int, the key schedules of many keys at once
+    :param keys: array-like of 64-bit keys (numpy uint64)
+    :param num_rounds: number of subkeys to compute after index 0
+    :return: uint64 array of shape (num_rounds + 1, len(keys)), column k holding the subkeys of
+             key k as in get_subkeys_int
+    """
+    check_rounds(num_rounds)
+    keys = np.asarray(keys, dtype=np.uint64)
+    CD = PC_1.apply_array(keys)
+    C = CD >> np.uint64(28)
+    D = CD & np.uint64(0xfffffff)
+    output = np.empty((num_rounds + 1, len(keys)), dtype=np.uint64)
+    output[0] = PC_2.apply_array(CD)
+    for i, shift in enumerate(vals.keygen_shift_table[:num_rounds], 1):
+        left, right = np.uint64(shift), np.uint64(28 - shift)
+        C = ((C << left) | (C >> right)) & np.uint64(0xfffffff)
+        D = ((D << left) | (D >> right)) & np.uint64(0xfffffff)
+        output[i] = PC_2.apply_array((C << np.uint64(28)) | D)
+    return output
+
+def DES_process_keys(data, subkeys, num_rounds=16):
+    """
+    Run the DES rounds on one block under many keys, in lockstep
+    :param data: 64-bit block, or array-like of one block per key
+    :param subkeys: array from get_subkeys_array, rows in encryption or decryption order
+    :param num_rounds: number of rounds, see DES_process_int
+    :return: numpy uint64 array of the output block under every key
+    """
+    count = subkeys.shape[1]
+    if isinstance(data, int):
+        block = IP(data)
+        L = np.full(count, block >> 32, dtype=np.uint32)
+        R = np.full(count, block & 0xffffffff, dtype=np.uint32)
+    else:
+        block = IP.apply_array(np.broadcast_to(np.asarray(data, dtype=np.uint64), (count,)))
+        L = (block >> np.uint64(32)).astype(np.uint32)
+        R = (block & np.uint64(0xffffffff)).astype(np.uint32)
+    sp = sp_arrays()
+    for i in range(1, num_rounds + 1):
+        x = E_PERM.apply_array(R) ^ subkeys[i]
+        f = sp[7][(x & np.uint64(0x3f)).astype(np.intp)]
+        for j in range(0, 7):
+            f |= sp[j][((x >> np.uint64(42 - 6 * j)) & np.uint64(0x3f)).astype(np.intp)]
+        L, R = R, L ^ f
+    return IP_INV.apply_array((R.astype(np.uint64) << np.uint64(32)) | L)
+
+def DES_encrypt_keys(plaintext, keys, chunk_size=2**16, num_rounds=16):
+    """
+    DES-Encrypt one block under many keys
+    :param plaintext: 64-bit block, or array-like of one block per key
+    :param keys: array-like of 64-bit keys (numpy uint64)
+    :param chunk_size: number of keys scheduled and processed at a time
+    :param num_rounds: number of rounds, see DES_process_int
+    :return: numpy uint64 array, element k being the ciphertext under key k
+    """
+    return _process_keys(plaintext, keys, True, chunk_size, num_rounds)
+
+def DES_decrypt_keys(ciphertext, keys, chunk_size=2**16, num_rounds=16):
+    """
+    DES-Decrypt one block under many keys
+    :param ciphertext: 64-bit block, or array-like of one block per key
+    :param keys: array-like of 64-bit keys (numpy uint64)
+    :param chunk_size: number of keys scheduled and processed at a time
+    :param num_rounds: number of rounds, see DES_process_int
+    :return: numpy uint64 array, element k being the plaintext under key k
+    """
+    return _process_keys(ciphertext, keys, False, chunk_size, num_rounds)
+
+def _process_keys(data, keys, encrypt: bool, chunk_size: int, num_rounds: int):
+    keys = np.asarray(keys, dtype=np.uint64)
+    if not isinstance(data, int):
+        data = np.broadcast_to(np.asarray(data, dtype=np.uint64), keys.shape)
+    order = list(range(0, num_rounds + 1)) if encrypt else [0] + list(range(num_rounds, 0, -1))
+    output = np.empty(len(keys), dtype=np.uint64)
+    for start in range(0, len(keys), chunk_size):
+        subkeys = get_subkeys_array(keys[start:start + chunk_size], num_rounds)[order]
+        chunk = data if isinstance(data, int) else data[start:start + chunk_size]
+        output[start:start + subkeys.shape[1]] = DES_process_keys(chunk, subkeys, num_rounds)
+    return output
+
+if __name__ == '__main__':
+    # Initialize given values
+    x   = BitArray('0b 00100101 01100111 11001101 10110011 11111101 11001110 01111110 00101010')
+    K   = BitArray('0b 11100101 01100111 11001101 10110011 11111101 11001110 01111111 00101010')
+    y   = DES_encrypt(x, K)
+    print('Ciphertext: %s' % y.hex)
 
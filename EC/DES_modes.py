@@ -0,0 +1,308 @@
+import mmap
+import numbers
+import os
+from collections.abc import Sequence
+from EC.DES import KeySchedule, key_schedule, DES_encrypt_batch, DES_decrypt_batch, DES_encrypt_int
+from EC.TDES import (TDESKeySchedule, tdes_key_schedule, TDES_encrypt_batch, TDES_decrypt_batch,
+                     TDES_encrypt_int)
+from common.parallel import ParallelExecutor
+from common.lazy import lazy_import
+
+np = lazy_import('numpy')
+
+# Block modes for DES and 3DES over files and streams
+# Data is read in fixed-size chunks, either through mmap or with readinto on preallocated
+# buffers, so a file of any size is never held in memory whole. Each chunk is turned into a
+# numpy array of big-endian 64-bit blocks and sent through the batch engine, except for CBC
+# encryption which has to chain block by block. With workers > 1 the batch work of every chunk
+# (ECB, CTR keystream and CBC decryption) is sharded over a process pool, see common.parallel.
+#
+# ECB and CBC pad the plaintext to whole blocks (PKCS#7); CTR needs no padding. When no IV is
+# given for CBC or CTR a random one is generated and written in front of the ciphertext, and
+# decryption reads it back from there.
+#
+# Keys are single DES keys (an integer or EC.DES.KeySchedule) or 3DES key bundles (a tuple of
+# two or three integers, 16 or 24 bytes, or EC.TDES.TDESKeySchedule).
+
+BLOCK_SIZE = 8
+MODES = ('ECB', 'CBC', 'CTR')
+
+# default chunk size in bytes, a multiple of BLOCK_SIZE
+CHUNK_SIZE = 2**20
+
+def pad(data: bytes):
+    """
+    Add PKCS#7 padding
+    :param data: final bytes of the plaintext, fewer than BLOCK_SIZE * n
+    :return: data padded to a whole number of blocks (a full block is added to aligned data)
+    """
+    count = BLOCK_SIZE - len(data) % BLOCK_SIZE
+    return bytes(data) + bytes([count]) * count
+
+def unpad(data: bytes):
+    """
+    Remove PKCS#7 padding
+    :param data: final bytes of the decrypted data, a whole number of blocks
+    :return: data without the padding
+    """
+    if not data or len(data) % BLOCK_SIZE:
+        raise ValueError('Padded data must be a non-empty multiple of %s bytes.' % BLOCK_SIZE)
+    count = data[-1]
+    if not 1 <= count <= BLOCK_SIZE or data[-count:] != bytes([count]) * count:
+        raise ValueError('Invalid padding.')
+    return data[:-count]
+
+def to_blocks(data):
+    """
+    View bytes as 64-bit blocks
+    :param data: bytes-like object, a whole number of blocks
+    :return: numpy uint64 array
+    """
+    return np.frombuffer(data, dtype='>u8').astype(np.uint64)
+
+def from_blocks(blocks):
+    """
+    Inverse of to_blocks
+    :param blocks: numpy uint64 array
+    :return: bytes
+    """
+    return blocks.astype('>u8').tobytes()
+
+def fill_buffer(stream, buffer: bytearray):
+    """
+    Read from a stream until the buffer is full or the stream ends
+    :param stream: binary file object supporting readinto
+    :param buffer: preallocated buffer
+    :return: number of bytes read
+    """
+    view = memoryview(buffer)
+    length = 0
+    while length < len(buffer):
+        count = stream.readinto(view[length:])
+        if not count:
+            break
+        length += count
+    return length
+
+def read_chunks(stream, chunk_size=CHUNK_SIZE):
+    """
+    Read a binary stream into two preallocated buffers, one chunk ahead
+    :param stream: binary file object supporting readinto
+    :param chunk_size: bytes per chunk
+    :return: generator of (memoryview, is_last); a view is only valid until the next item
+    """
+    buffers = [bytearray(chunk_size), bytearray(chunk_size)]
+    current = 0
+    length = fill_buffer(stream, buffers[current])
+    while True:
+        next_length = fill_buffer(stream, buffers[1 - current]) if length == chunk_size else 0
+        yield memoryview(buffers[current])[:length], not next_length
+        if not next_length:
+            return
+        current = 1 - current
+        length = next_length
+
+def mmap_chunks(path, chunk_size=CHUNK_SIZE, offset=0):
+    """
+    Map a file into memory and hand it out chunk by chunk, only the current chunk being paged in
+    :param path: file to read
+    :param chunk_size: bytes per chunk
+    :param offset: number of bytes to skip at the start
+    :return: generator of (bytes, is_last)
+    """
+    size = os.path.getsize(path)
+    if size <= offset:
+        yield b'', True
+        return
+    with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+        for start in range(offset, size, chunk_size):
+            yield mapped[start:start + chunk_size], start + chunk_size >= size
+
+def ctr_counters(iv: int, first_block: int, count: int):
+    """
+    Counter blocks for part of a CTR stream, which depend on nothing but their position
+    :param iv: initial counter value
+    :param first_block: index of the first block
+    :param count: number of blocks
+    :return: numpy uint64 array of counters, wrapping around at 2**64
+    """
+    return np.uint64(iv) + np.arange(first_block, first_block + count, dtype=np.uint64)
+
+def ctr_chunk(keystream, data):
+    """
+    Encrypt or decrypt one chunk in CTR mode
+    :param keystream: numpy uint64 array of encrypted counters covering the chunk
+    :param data: bytes-like chunk, only the last chunk of a stream may end in a partial block
+    :return: bytes
+    """
+    stream = np.frombuffer(from_blocks(keystream), dtype=np.uint8)
+    return (np.frombuffer(data, dtype=np.uint8) ^ stream[:len(data)]).tobytes()
+
+def block_cipher(key_seed):
+    """
+    Pick DES or 3DES for a key
+    :param key_seed: DES key (an integer or KeySchedule) or 3DES key bundle (a TDESKeySchedule,
+                     16 or 24 bytes, or any sequence of two or three integer keys)
+    :return: (key schedule, batch encrypt function, batch decrypt function, integer encrypt function)
+    """
+    if isinstance(key_seed, (TDESKeySchedule, bytes, bytearray)):
+        return tdes_key_schedule(key_seed), TDES_encrypt_batch, TDES_decrypt_batch, TDES_encrypt_int
+    if isinstance(key_seed, Sequence) and not isinstance(key_seed, str) and len(key_seed) in (2, 3):
+        # lists from JSON or argparse as well as tuples
+        keys = tuple(int(k) for k in key_seed)
+        return tdes_key_schedule(keys), TDES_encrypt_batch, TDES_decrypt_batch, TDES_encrypt_int
+    if isinstance(key_seed, KeySchedule):
+        return key_seed, DES_encrypt_batch, DES_decrypt_batch, DES_encrypt_int
+    if isinstance(key_seed, numbers.Integral):
+        return key_schedule(int(key_seed)), DES_encrypt_batch, DES_decrypt_batch, DES_encrypt_int
+    raise TypeError('Expected a DES key or a bundle of two or three 3DES keys, got %r.' % (key_seed,))
+
+def process_chunks(chunks, out, key_seed, mode: str, encrypt: bool, iv: int, workers=1):
+    """
+    Run a block mode over a sequence of chunks and write the result
+    :param chunks: iterable of (bytes-like, is_last) from read_chunks or mmap_chunks, every chunk
+                   but the last a whole number of blocks
+    :param out: binary file object to write to
+    :param key_seed: DES key or 3DES key bundle
+    :param mode: 'ECB', 'CBC' or 'CTR'
+    :param encrypt: set to True for encryption, False otherwise
+    :param iv: initial vector (CBC) or counter (CTR), ignored for ECB
+    :param workers: number of processes sharing the batch work of each chunk
+    """
+    cipher = block_cipher(key_seed)
+    schedule, encrypt_batch = cipher[:2]
+    with ParallelExecutor(workers, shared=(schedule,)) as executor:
+        if mode == 'CTR':
+            block_index = 0
+            for chunk, is_last in chunks:
+                count = -(-len(chunk) // BLOCK_SIZE)
+                counters = ctr_counters(iv, block_index, count)
+                out.write(ctr_chunk(executor.map_blocks(encrypt_batch, counters, schedule), chunk))
+                block_index += count
+        else:
+            process_block_chunks(chunks, out, cipher, mode, encrypt, iv, executor)
+
+def process_block_chunks(chunks, out, cipher: tuple, mode: str, encrypt: bool, iv: int, executor: ParallelExecutor):
+    """
+    The ECB and CBC part of process_chunks, cipher being the result of block_cipher
+    """
+    schedule, encrypt_batch, decrypt_batch, encrypt_int = cipher
+    previous = iv
+    for chunk, is_last in chunks:
+        if encrypt and is_last:
+            chunk = pad(chunk)
+        if len(chunk) % BLOCK_SIZE:
+            raise ValueError('Ciphertext must be a whole number of blocks.')
+        blocks = to_blocks(chunk)
+        if mode == 'ECB':
+            result = executor.map_blocks(encrypt_batch if encrypt else decrypt_batch, blocks, schedule)
+        elif encrypt:
+            # every CBC block depends on the one before, so this runs block by block
+            result = np.empty(len(blocks), dtype=np.uint64)
+            for i, block in enumerate(blocks.tolist()):
+                previous = encrypt_int(block ^ previous, schedule)
+                result[i] = previous
+        else:
+            # CBC decryption is parallel: P_i = D(C_i) ^ C_(i-1)
+            chained = np.empty(len(blocks), dtype=np.uint64)
+            if len(blocks):
+                chained[0] = previous
+                chained[1:] = blocks[:-1]
+                previous = int(blocks[-1])
+            result = executor.map_blocks(decrypt_batch, blocks, schedule) ^ chained
+        data = from_blocks(result)
+        if not encrypt and is_last:
+            data = unpad(data)
+        out.write(data)
+
+def check_mode(mode: str):
+    """
+    Normalise and validate a mode name
+    :param mode: mode name, any case
+    :return: upper case mode name
+    """
+    mode = mode.upper()
+    if mode not in MODES:
+        raise ValueError('mode must be one of %s' % ', '.join(MODES))
+    return mode
+
+def encrypt_stream(stream_in, stream_out, key_seed, mode='CBC', iv=None, chunk_size=CHUNK_SIZE, workers=1):
+    """
+    DES/3DES-Encrypt a binary stream
+    :param stream_in: binary file object to read plaintext from
+    :param stream_out: binary file object to write ciphertext to
+    :param key_seed: DES key or 3DES key bundle, see block_cipher
+    :param mode: 'ECB', 'CBC' or 'CTR'
+    :param iv: 64-bit IV or initial counter; if None for CBC/CTR a random one is written first
+    :param chunk_size: bytes read at a time, rounded down to whole blocks
+    :param workers: number of processes sharing the batch work of each chunk
+    """
+    mode = check_mode(mode)
+    chunk_size = max(BLOCK_SIZE, chunk_size - chunk_size % BLOCK_SIZE)
+    if mode != 'ECB' and iv is None:
+        iv = int.from_bytes(os.urandom(BLOCK_SIZE), 'big')
+        stream_out.write(iv.to_bytes(BLOCK_SIZE, 'big'))
+    process_chunks(read_chunks(stream_in, chunk_size), stream_out, key_seed, mode, True, iv, workers)
+
+def decrypt_stream(stream_in, stream_out, key_seed, mode='CBC', iv=None, chunk_size=CHUNK_SIZE, workers=1):
+    """
+    DES/3DES-Decrypt a binary stream written by encrypt_stream or encrypt_file
+    :param stream_in: binary file object to read ciphertext from
+    :param stream_out: binary file object to write plaintext to
+    :param key_seed: DES key or 3DES key bundle, see block_cipher
+    :param mode: 'ECB', 'CBC' or 'CTR'
+    :param iv: 64-bit IV or initial counter; if None for CBC/CTR it is read from the stream
+    :param chunk_size: bytes read at a time, rounded down to whole blocks
+    :param workers: number of processes sharing the batch work of each chunk
+    """
+    mode = check_mode(mode)
+    chunk_size = max(BLOCK_SIZE, chunk_size - chunk_size % BLOCK_SIZE)
+    if mode != 'ECB' and iv is None:
+        header = stream_in.read(BLOCK_SIZE)
+        if len(header) != BLOCK_SIZE:
+            raise ValueError('Ciphertext is too short to hold an IV.')
+        iv = int.from_bytes(header, 'big')
+    process_chunks(read_chunks(stream_in, chunk_size), stream_out, key_seed, mode, False, iv, workers)
+
+def encrypt_file(path_in, path_out, key_seed, mode='CBC', iv=None, chunk_size=CHUNK_SIZE, workers=1):
+    """
+    DES/3DES-Encrypt a file, reading it through mmap
+    :param path_in: plaintext file
+    :param path_out: ciphertext file to create
+    :param key_seed: DES key or 3DES key bundle, see block_cipher
+    :param mode: 'ECB', 'CBC' or 'CTR'
+    :param iv: 64-bit IV or initial counter; if None for CBC/CTR a random one is written first
+    :param chunk_size: bytes handled at a time, rounded down to whole blocks
+    :param workers: number of processes sharing the batch work of each chunk
+    """
+    mode = check_mode(mode)
+    chunk_size = max(BLOCK_SIZE, chunk_size - chunk_size % BLOCK_SIZE)
+    with open(path_out, 'wb') as out:
+        if mode != 'ECB' and iv is None:
+            iv = int.from_bytes(os.urandom(BLOCK_SIZE), 'big')
+            out.write(iv.to_bytes(BLOCK_SIZE, 'big'))
+        process_chunks(mmap_chunks(path_in, chunk_size), out, key_seed, mode, True, iv, workers)
+
+def decrypt_file(path_in, path_out, key_seed, mode='CBC', iv=None, chunk_size=CHUNK_SIZE, workers=1):
+    """
+    DES/3DES-Decrypt a file written by encrypt_file, reading it through mmap
+    :param path_in: ciphertext file
+    :param path_out: plaintext file to create
+    :param key_seed: DES key or 3DES key bundle, see block_cipher
+    :param mode: 'ECB', 'CBC' or 'CTR'
+    :param iv: 64-bit IV or initial counter; if None for CBC/CTR it is read from the file
+    :param chunk_size: bytes handled at a time, rounded down to whole blocks
+    :param workers: number of processes sharing the batch work of each chunk
+    """
+    mode = check_mode(mode)
+    chunk_size = max(BLOCK_SIZE, chunk_size - chunk_size % BLOCK_SIZE)
+    offset = 0
+    if mode != 'ECB' and iv is None:
+        with open(path_in, 'rb') as f:
+            header = f.read(BLOCK_SIZE)
+        if len(header) != BLOCK_SIZE:
+            raise ValueError('Ciphertext is too short to hold an IV.')
+        iv = int.from_bytes(header, 'big')
+        offset = BLOCK_SIZE
+    with open(path_out, 'wb') as out:
+        process_chunks(mmap_chunks(path_in, chunk_size, offset), out, key_seed, mode, False, iv, workers)
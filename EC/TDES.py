@@ -0,0 +1,181 @@
+from functools import lru_cache
+from EC.DES import (BitArray, np, key_schedule, do_f_int, IP, IP_INV, E_PERM, P_PERM, sboxes_bitsliced,
+                    bitslice, unbitslice)
+
+# Triple DES (EDE) on top of the DES core
+# Encryption is E_K3(D_K2(E_K1(x))), with K3 = K1 for two-key 3DES. The three key schedules are
+# computed once per key bundle and kept in an LRU cache. Between two DES stages the output
+# permutation IP^-1 of one stage is undone by the IP of the next, so the stages are chained
+# directly on the two halves: 48 rounds between a single IP and a single IP^-1, saving four
+# permutations per block. A stage ending with the usual R16 L16 swap hands (R, L) to the next.
+
+class TDESKeySchedule:
+    """
+    The subkeys of a 3DES key bundle, computed once. Pass it in place of the keys.
+    """
+    def __init__(self, k1: int, k2: int, k3=None):
+        """
+        :param k1: first 64-bit key
+        :param k2: second 64-bit key
+        :param k3: third 64-bit key, None for two-key 3DES (K3 = K1)
+        """
+        self.keys = (k1, k2, k1 if k3 is None else k3)
+        s1, s2, s3 = [key_schedule(k) for k in self.keys]
+        self.schedules = (s1, s2, s3)
+        self.subkeys = [s1.subkeys, s2.decrypt_subkeys, s3.subkeys]
+        self.decrypt_subkeys = [s3.decrypt_subkeys, s2.subkeys, s1.decrypt_subkeys]
+
+    @property
+    def key_masks(self):
+        """
+        Subkey lanes of the three stages for the bitsliced engine
+        """
+        s1, s2, s3 = self.schedules
+        return [s1.key_masks, s2.decrypt_key_masks, s3.key_masks]
+
+    @property
+    def decrypt_key_masks(self):
+        """
+        Subkey lanes of the three decryption stages for the bitsliced engine
+        """
+        s1, s2, s3 = self.schedules
+        return [s3.decrypt_key_masks, s2.key_masks, s1.decrypt_key_masks]
+
+    def __repr__(self):
+        return 'TDESKeySchedule(%s)' % ', '.join('0x%016x' % k for k in self.keys)
+
+# number of key bundles kept for callers passing raw keys
+KEY_CACHE_SIZE = 64
+
+_cached_schedule = lru_cache(maxsize=KEY_CACHE_SIZE)(TDESKeySchedule)
+
+def tdes_key_schedule(keys):
+    """
+    Get the key schedule of a key bundle, from the LRU cache when possible
+    :param keys: tuple of two or three 64-bit keys, a 128 or 192-bit key as bytes, or a
+                 TDESKeySchedule which is returned as is
+    :return: TDESKeySchedule
+    """
+    if isinstance(keys, TDESKeySchedule):
+        return keys
+    if isinstance(keys, (bytes, bytearray)):
+        if len(keys) not in (16, 24):
+            raise ValueError('A 3DES key must be 16 or 24 bytes long.')
+        keys = tuple(int.from_bytes(keys[i:i + 8], 'big') for i in range(0, len(keys), 8))
+    if len(keys) not in (2, 3):
+        raise ValueError('A 3DES key bundle must have two or three keys.')
+    return _cached_schedule(*keys)
+
+def key_cache_info():
+    """
+    Statistics of the key bundle cache
+    :return: named tuple of hits, misses, maxsize and currsize
+    """
+    return _cached_schedule.cache_info()
+
+def TDES_process_int(data: int, stages: list):
+    """
+    Run the three DES stages on an integer with a single IP and IP^-1
+    :param data: 64-bit block
+    :param stages: three lists of 17 subkeys, as in TDESKeySchedule.subkeys
+    :return: 64-bit output
+    """
+    block = IP(data)
+    L = block >> 32
+    R = block & 0xffffffff
+    for keylist in stages:
+        for i in range(1, 17):
+            L, R = R, L ^ do_f_int(R, keylist[i])
+        L, R = R, L
+    return IP_INV((L << 32) | R)
+
+def TDES_encrypt_int(plaintext: int, keys):
+    """
+    3DES-Encrypt a 64-bit integer
+    :param plaintext: 64-bit plaintext
+    :param keys: key bundle accepted by tdes_key_schedule
+    :return: 64-bit ciphertext
+    """
+    return TDES_process_int(plaintext, tdes_key_schedule(keys).subkeys)
+
+def TDES_decrypt_int(ciphertext: int, keys):
+    """
+    3DES-Decrypt a 64-bit integer
+    :param ciphertext: 64-bit ciphertext
+    :param keys: key bundle accepted by tdes_key_schedule
+    :return: 64-bit plaintext
+    """
+    return TDES_process_int(ciphertext, tdes_key_schedule(keys).decrypt_subkeys)
+
+def TDES_encrypt(plaintext: BitArray, keys):
+    """
+    3DES-Encrypt plaintext using the given key bundle
+    :param plaintext: Plaintext to be encrypted - MUST be 64 bits long
+    :param keys: key bundle accepted by tdes_key_schedule
+    :return: encrypted data of length 64
+    """
+    if len(plaintext) != 64:
+        raise ValueError('plaintext does not have a length of 64')
+    return BitArray(uint=TDES_encrypt_int(plaintext.uint, keys), length=64)
+
+def TDES_decrypt(ciphertext: BitArray, keys):
+    """
+    3DES-Decrypt ciphertext using the given key bundle
+    :param ciphertext: Ciphertext to be decrypted - MUST be 64 bits long
+    :param keys: key bundle accepted by tdes_key_schedule
+    :return: decrypted data of length 64
+    """
+    if len(ciphertext) != 64:
+        raise ValueError('ciphertext does not have a length of 64')
+    return BitArray(uint=TDES_decrypt_int(ciphertext.uint, keys), length=64)
+
+def TDES_process_bitsliced(planes, stages: list):
+    """
+    Run the three DES stages over bitsliced blocks with a single IP and IP^-1
+    :param planes: uint64 array of shape (64, words) from bitslice
+    :param stages: three lists of subkey lanes, as in TDESKeySchedule.key_masks
+    :return: bitsliced output
+    """
+    block = planes[IP.indices]
+    L = block[:32]
+    R = block[32:]
+    for key_masks in stages:
+        for i in range(1, 17):
+            L, R = R, L ^ sboxes_bitsliced(R[E_PERM.indices] ^ key_masks[i])[P_PERM.indices]
+        L, R = R, L
+    return np.concatenate((L, R))[IP_INV.indices]
+
+def TDES_process_batch(blocks, stages: list, chunk_size=2**16):
+    """
+    Run 3DES over many blocks, chunk by chunk
+    :param blocks: array-like of 64-bit blocks (numpy uint64)
+    :param stages: three lists of subkey lanes, as in TDESKeySchedule.key_masks
+    :param chunk_size: number of blocks transposed at a time
+    :return: numpy uint64 array of output blocks
+    """
+    blocks = np.asarray(blocks, dtype=np.uint64)
+    output = np.empty(len(blocks), dtype=np.uint64)
+    for start in range(0, len(blocks), chunk_size):
+        chunk = blocks[start:start + chunk_size]
+        output[start:start + len(chunk)] = unbitslice(TDES_process_bitsliced(bitslice(chunk), stages), len(chunk))
+    return output
+
+def TDES_encrypt_batch(blocks, keys, chunk_size=2**16):
+    """
+    3DES-Encrypt many 64-bit blocks under one key bundle using the bitsliced engine
+    :param blocks: array-like of 64-bit plaintext blocks (numpy uint64)
+    :param keys: key bundle accepted by tdes_key_schedule
+    :param chunk_size: number of blocks transposed and encrypted at a time
+    :return: numpy uint64 array of ciphertext blocks
+    """
+    return TDES_process_batch(blocks, tdes_key_schedule(keys).key_masks, chunk_size)
+
+def TDES_decrypt_batch(blocks, keys, chunk_size=2**16):
+    """
+    3DES-Decrypt many 64-bit blocks under one key bundle using the bitsliced engine
+    :param blocks: array-like of 64-bit ciphertext blocks (numpy uint64)
+    :param keys: key bundle accepted by tdes_key_schedule
+    :param chunk_size: number of blocks transposed and decrypted at a time
+    :return: numpy uint64 array of plaintext blocks
+    """
+    return TDES_process_batch(blocks, tdes_key_schedule(keys).decrypt_key_masks, chunk_size)
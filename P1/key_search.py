@@ -0,0 +1,185 @@
+import hashlib
+import json
+import os
+from P1.spn import spn_tables, spn_encrypt_keys
+from P1.prefix_tree import spn_encrypt_key_range
+from common.parallel import ParallelExecutor
+from common.lazy import lazy_import
+
+np = lazy_import('numpy')
+futures = lazy_import('concurrent.futures')
+
+# Exhaustive key search on the SPN
+# Round key i is bits [4i, 4i+16) of the master key, so the SPN with num_rounds rounds has a
+# 4 * num_rounds + 16 bit key: 2^32 keys for the four rounds of Stinson 3.2, few enough to try
+# them all. The keyspace is cut into shards of consecutive keys. A shard is tested in batches:
+# every key of the batch encrypts the first known plaintext at once, each round being computed
+# once per distinct key prefix (spn_encrypt_key_range), and only the keys that give the right
+# ciphertext are tried on the other pairs, so about one key in 2^16 costs more than that.
+#
+# Shards are spread over a process pool. With a checkpoint file, the finished shards and the
+# keys found so far are written to disk as the shards complete, and a search started again with
+# the same file and parameters skips them.
+
+# keys per shard, the unit of work sent to a process and recorded in the checkpoint
+SHARD_SIZE = 2**24
+# keys encrypted at once inside a shard
+BATCH_SIZE = 2**20
+
+def tables_digest(tables=spn_tables):
+    """
+    Fingerprint of the s-box and permutation behind a set of lookup tables
+    :param tables: lookup tables from P1.spn.build_spn_tables
+    :return: hex string
+    """
+    return hashlib.sha256(tables['np']['s8'].tobytes() + tables['np']['sp'].tobytes()).hexdigest()
+
+def search_range(start: int, stop: int, pairs: list, num_rounds=4, key_length=None, tables=spn_tables,
+                 batch_size=BATCH_SIZE):
+    """
+    Test every key in [start, stop) against known plaintext/ciphertext pairs
+    :param start: first key
+    :param stop: key after the last one
+    :param pairs: list of (plaintext, ciphertext) integers
+    :param num_rounds: number of spn rounds
+    :param key_length: length of key in bits, defaults to 4 * num_rounds + 16
+    :param tables: lookup tables from P1.spn.build_spn_tables
+    :param batch_size: number of keys encrypted at once
+    :return: list of the keys consistent with every pair
+    """
+    (plaintext, ciphertext), others = pairs[0], pairs[1:]
+    found = []
+    for batch_start in range(start, stop, batch_size):
+        batch_stop = min(batch_start + batch_size, stop)
+        hits = spn_encrypt_key_range(plaintext, batch_start, batch_stop, num_rounds, key_length, tables) == ciphertext
+        keys = np.flatnonzero(hits).astype(np.uint64) + np.uint64(batch_start)
+        for plaintext_i, ciphertext_i in others:
+            if not len(keys):
+                break
+            keys = keys[spn_encrypt_keys(plaintext_i, keys, num_rounds, key_length, tables) == ciphertext_i]
+        found.extend(int(k) for k in keys)
+    return found
+
+def load_checkpoint(path: str, config: dict):
+    """
+    Read a checkpoint written by search_keys
+    :param path: checkpoint file
+    :param config: parameters of the current search, which must match the saved ones
+    :return: (set of finished shard numbers, list of keys found), empty if there is no file yet
+    """
+    if path is None or not os.path.exists(path):
+        return set(), []
+    with open(path) as f:
+        state = json.load(f)
+    if state['config'] != config:
+        raise ValueError('Checkpoint %s belongs to a different search.' % path)
+    return set(state['done']), state['found']
+
+def save_checkpoint(path: str, config: dict, done: set, found: list):
+    """
+    Write the progress of search_keys, replacing the previous checkpoint in one step
+    :param path: checkpoint file
+    :param config: parameters of the search
+    :param done: finished shard numbers
+    :param found: keys found so far
+    """
+    temp_path = path + '.tmp'
+    with open(temp_path, 'w') as f:
+        json.dump({'config': config, 'done': sorted(done), 'found': sorted(found)}, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_path, path)
+
+def search_keys(pairs: list, num_rounds=4, key_length=None, tables=spn_tables, workers=None,
+                checkpoint=None, shard_size=SHARD_SIZE, batch_size=BATCH_SIZE, key_range=None,
+                stop_after=None, progress=None):
+    """
+    Exhaustive search for the master keys consistent with known plaintext/ciphertext pairs
+    :param pairs: list of (plaintext, ciphertext) integers, 16 bits each; about key_length / 16
+                  pairs are needed to single out the key
+    :param num_rounds: number of spn rounds
+    :param key_length: length of key in bits, defaults to 4 * num_rounds + 16
+    :param tables: lookup tables from P1.spn.build_spn_tables
+    :param workers: number of worker processes, os.cpu_count() by default
+    :param checkpoint: file to save progress to and resume from, None for no checkpoint
+    :param shard_size: keys per shard
+    :param batch_size: keys encrypted at once
+    :param key_range: (first key, key after the last one) to search, the whole keyspace by default
+    :param stop_after: stop once this many keys are found, None to search the whole range
+    :param progress: called as progress(keys done, keys in range, keys found) after each shard
+    :return: sorted list of the keys found
+    """
+    if not pairs:
+        raise ValueError('At least one plaintext/ciphertext pair is needed.')
+    if key_length is None:
+        key_length = 4 * num_rounds + 16
+    if key_length > 64:
+        raise ValueError('Keys are limited to 64 bits.')
+    pairs = [[int(p), int(c)] for p, c in pairs]
+    first, last = (0, 2**key_length) if key_range is None else key_range
+    config = {'pairs': pairs, 'num_rounds': num_rounds, 'key_length': key_length,
+              'tables': tables_digest(tables), 'shard_size': shard_size, 'key_range': [first, last]}
+    done, found = load_checkpoint(checkpoint, config)
+    num_shards = -(-(last - first) // shard_size)
+    todo = (shard for shard in range(num_shards) if shard not in done)
+
+    def bounds(shard):
+        return first + shard * shard_size, min(first + (shard + 1) * shard_size, last)
+
+    def finish(shard, keys):
+        done.add(shard)
+        found.extend(keys)
+        if checkpoint is not None:
+            save_checkpoint(checkpoint, config, done, found)
+        if progress is not None:
+            keys_done = sum(stop - start for start, stop in map(bounds, done))
+            progress(keys_done, last - first, len(found))
+
+    def enough():
+        return stop_after is not None and len(found) >= stop_after
+
+    with ParallelExecutor(workers) as executor:
+        if executor.pool is None:
+            for shard in todo:
+                if enough():
+                    break
+                finish(shard, search_range(*bounds(shard), pairs, num_rounds, key_length, tables, batch_size))
+        else:
+            # keep a couple of shards per worker in flight, so a stop does not wait for the rest
+            running = {}
+            while True:
+                while not enough() and len(running) < 2 * executor.workers:
+                    shard = next(todo, None)
+                    if shard is None:
+                        break
+                    running[executor.pool.submit(search_range, *bounds(shard), pairs, num_rounds,
+                                                 key_length, tables, batch_size)] = shard
+                if not running:
+                    break
+                finished, _ = futures.wait(running, return_when=futures.FIRST_COMPLETED)
+                for future in finished:
+                    finish(running.pop(future), future.result())
+    return sorted(found)
+
+if __name__ == '__main__':
+    import argparse
+    import time
+    parser = argparse.ArgumentParser(description='Exhaustive key search on the SPN of P1/spn.py')
+    parser.add_argument('pairs', nargs='+', help='known pairs as hex plaintext:ciphertext, e.g. 26b7:8c1e')
+    parser.add_argument('--rounds', type=int, default=4, help='number of spn rounds')
+    parser.add_argument('--key-length', type=int, default=None, help='key length in bits')
+    parser.add_argument('--workers', type=int, default=None, help='number of worker processes')
+    parser.add_argument('--checkpoint', default=None, help='file to save progress to and resume from')
+    parser.add_argument('--first', action='store_true', help='stop at the first key found')
+    args = parser.parse_args()
+    known = [tuple(int(x, 16) for x in pair.split(':')) for pair in args.pairs]
+    begin = time.perf_counter()
+
+    def report(keys_done, total, num_found):
+        elapsed = time.perf_counter() - begin
+        print('%5.1f%% of the keys, %s found, %.0fs elapsed' % (100 * keys_done / total, num_found, elapsed))
+
+    keys = search_keys(known, args.rounds, args.key_length, workers=args.workers, checkpoint=args.checkpoint,
+                       stop_after=1 if args.first else None, progress=report)
+    for key in keys:
+        print('Key: %x' % key)
@@ -0,0 +1,142 @@
+from P1.spn import spn_tables, get_keys_int
+from common.lazy import lazy_import
+
+np = lazy_import('numpy')
+
+# Prefix-sharing evaluation of the SPN over many keys
+# Round key r is bits [4(r-1), 4(r-1)+16) of the master key, so the state at the end of round r
+# only depends on the first 4r + 12 key bits. The keyspace is a tree in which each level adds a
+# nibble of key and each node holds the state after one more round: keys sharing a prefix share
+# the path from the root, and only the rounds below the point where two keys part need to be
+# computed again.
+#
+# PrefixEvaluator walks the tree depth first over a whole codebook (or any set of blocks),
+# keeping the states of the current path, for measurements repeated over many keys.
+# spn_encrypt_key_range walks it breadth first over a range of keys for one block, computing
+# each round once per distinct prefix, for key search.
+
+class PrefixEvaluator:
+    """
+    Encrypts the same blocks under key after key, reusing the rounds that the previous key shared
+    """
+    def __init__(self, inputs, num_rounds=2, key_length=None, tables=spn_tables, stop_round=None,
+                 stage='w'):
+        """
+        :param inputs: array-like of 16-bit blocks, e.g. np.arange(2**16) for the whole codebook
+        :param num_rounds: number of spn rounds
+        :param key_length: length of the keys in bits, defaults to 4 * num_rounds + 16
+        :param tables: lookup tables from P1.spn.build_spn_tables
+        :param stop_round: if set, return the state of this round instead of the ciphertext
+        :param stage: which state of stop_round to return, 'u', 'v' or 'w', as in spn_encrypt_batch
+        """
+        if stop_round is not None and not 1 <= stop_round <= num_rounds:
+            raise ValueError('stop_round must be between 1 and num_rounds.')
+        if stage not in ('u', 'v', 'w'):
+            raise ValueError("stage must be one of 'u', 'v' or 'w'.")
+        self.num_rounds = num_rounds
+        self.key_length = 4 * num_rounds + 16 if key_length is None else key_length
+        self.tables = tables
+        self.last = num_rounds if stop_round is None else stop_round
+        self.stage = stage
+        # states[r] is w at the end of round r for round_keys[1..r], states[0] the inputs
+        self.states = [np.asarray(inputs, dtype=np.uint16)] + [None] * num_rounds
+        self.round_keys = [None] * (num_rounds + 2)
+        # number of rounds computed, against the number a full evaluation takes, for statistics
+        self.rounds_computed = 0
+        self.rounds_needed = 0
+
+    def evaluate(self, key: int):
+        """
+        Encrypt the inputs under a key
+        :param key: master key as an integer
+        :return: numpy uint16 array, the ciphertexts or the requested state
+        """
+        key_array = [None] + get_keys_int(key, self.num_rounds + 1, self.key_length)
+        s8, sp = self.tables['np']['s8'], self.tables['np']['sp']
+        last = self.last
+        # rounds before the last one end with w, which is cached along the path
+        full = last if self.stage == 'w' and last < self.num_rounds else last - 1
+        first = 1
+        while first <= full and self.round_keys[first] == key_array[first]:
+            first += 1
+        for round_number in range(first, full + 1):
+            u = self.states[round_number - 1] ^ np.uint16(key_array[round_number])
+            self.states[round_number] = sp[0][u >> 8] | sp[1][u & 0xff]
+            self.round_keys[round_number] = key_array[round_number]
+        self.rounds_computed += full + 1 - first
+        self.rounds_needed += full
+        if full == last:
+            return self.states[last]
+        u = self.states[last - 1] ^ np.uint16(key_array[last])
+        if self.stage == 'u':
+            return u
+        v = (s8[u >> 8] << 8) | s8[u & 0xff]
+        if self.stage == 'v':
+            return v
+        # final round which excludes permutation
+        return v ^ np.uint16(key_array[self.num_rounds + 1])
+
+    def walk(self, keys):
+        """
+        Evaluate many keys, in sorted order so that neighbouring keys share the longest prefixes
+        :param keys: iterable of master keys
+        :return: generator of (key, output) pairs
+        """
+        for key in sorted(set(int(k) for k in keys)):
+            yield key, self.evaluate(key)
+
+def prefix_levels(start: int, stop: int, num_rounds: int, key_length: int):
+    """
+    The distinct key prefixes each round depends on, over a range of keys
+    :param start: first key
+    :param stop: key after the last one
+    :param num_rounds: number of spn rounds
+    :param key_length: length of the keys in bits
+    :return: list over rounds 1 .. num_rounds + 1 of (shift, prefixes), prefixes being the numpy
+             uint64 array of the distinct values of key >> shift, whose low 16 bits are the round key
+    """
+    levels = []
+    for round_number in range(1, num_rounds + 2):
+        shift = key_length - 4 * round_number - 12
+        levels.append((shift, np.arange(start >> shift, ((stop - 1) >> shift) + 1, dtype=np.uint64)))
+    return levels
+
+def spn_encrypt_key_range(input: int, start: int, stop: int, num_rounds=2, key_length=None,
+                          tables=spn_tables):
+    """
+    Encrypt one block under every key of [start, stop), computing each round once per prefix;
+    gives the same result as P1.spn.spn_encrypt_keys(input, np.arange(start, stop))
+    :param input: 16-bit plaintext
+    :param start: first key
+    :param stop: key after the last one
+    :param num_rounds: number of spn rounds
+    :param key_length: length of the keys in bits, defaults to 4 * num_rounds + 16
+    :param tables: lookup tables from P1.spn.build_spn_tables
+    :return: numpy uint16 array of ciphertexts, one per key
+    """
+    if key_length is None:
+        key_length = 4 * num_rounds + 16
+    if key_length < 4 * num_rounds + 16:
+        raise ValueError('Master key is too short for %s round keys.' % (num_rounds + 1))
+    s8, sp = tables['np']['s8'], tables['np']['sp']
+    levels = prefix_levels(start, stop, num_rounds, key_length)
+    for round_number, (shift, prefixes) in enumerate(levels, 1):
+        if round_number == 1:
+            w = np.full(len(prefixes), input, dtype=np.uint16)
+        else:
+            # state of the parent node, one level up the tree
+            w = w[((prefixes >> np.uint64(4)) - parent[0]).astype(np.intp)]
+        u = w ^ (prefixes & np.uint64(0xffff)).astype(np.uint16)
+        if round_number == num_rounds:
+            # final round which excludes permutation
+            w = (s8[u >> 8] << 8) | s8[u & 0xff]
+        elif round_number == num_rounds + 1:
+            # u here is the ciphertext, the last key XOR applied to v
+            w = u
+        else:
+            w = sp[0][u >> 8] | sp[1][u & 0xff]
+        parent = prefixes
+    # keys longer than 4 * num_rounds + 16 bits have low bits the cipher does not use
+    shift = levels[-1][0]
+    keys = np.arange(start, stop, dtype=np.uint64) >> np.uint64(shift)
+    return w[(keys - parent[0]).astype(np.intp)] if shift else w
@@ -1,4 +1,9 @@
-from bitstring import *
+from common.lazy import lazy_import, lazy_attribute
+from common.permutation import compile_permutation
+from common.trace import Recorder, tee
+
+BitArray = lazy_attribute('bitstring', 'BitArray')
+np = lazy_import('numpy')
 
 # Change s_box dictionary to alter s-box behaviour
 # Change permutation_map to alter the permutation mapping
@@ -50,8 +55,12 @@ permutation_map = {
     16: 16,
 }
 
+# compiled permutation for encryption and its inverse for decryption
+permutation = compile_permutation(permutation_map, 16)
+inverse_permutation = permutation.inverse()
+
 # permutation dictionary for decryption, an inverse of the dictionary for encryption
-perm_dict_decrypt = {v: k for k, v in permutation_map.items()}
+perm_dict_decrypt = inverse_permutation.as_dict()
 
 def get_keys(master_key: BitArray, num_keys: int):
     """
@@ -105,64 +114,347 @@ def permute_two_bytes(bytes_in: BitArray, encrypt: bool):
     :param encrypt: set to True for encryption, False otherwise
     :return: scrambled set of two bytes
     """
-    output = BitArray('0x0000')
     if encrypt:
-        for i in range(1,17):
-            output[i-1] = bytes_in[permutation_map[i] - 1]
-    else:
-        for i in range(1,17):
-            output[i-1] = bytes_in[perm_dict_decrypt[i]-1]
+        return BitArray(uint=permutation(bytes_in.uint), length=16)
+    return BitArray(uint=inverse_permutation(bytes_in.uint), length=16)
+
+
+# Integer engine
+# The functions below work on plain 16-bit integers instead of BitArrays. Bit 1 in the
+# Stinson numbering (index 0 of a BitArray) is the most significant bit of the integer.
+# Substitution and permutation are merged into byte-indexed lookup tables that are built
+# once from s_box and permutation_map, so a round costs two table lookups.
+
+def sbox_to_list(sbox: dict):
+    """
+    Convert an s-box dictionary keyed by hex digits into a list indexed by integers
+    :param sbox: s-box dictionary, values may be hex strings or integers
+    :return: list whose element x is the substitution of x
+    """
+    output = [0] * len(sbox)
+    for k, v in sbox.items():
+        output[int(k, 16)] = int(v, 16) if isinstance(v, str) else v
     return output
 
+class SpnTables(dict):
+    """
+    Lookup tables of build_spn_tables. tables['np'] holds numpy copies of the same tables for the
+    batch functions, made the first time they are asked for.
+    """
+    def __missing__(self, name):
+        if name != 'np':
+            raise KeyError(name)
+        self['np'] = {name: np.array(table, dtype=np.uint16) for name, table in self.items()}
+        return self['np']
+
+def build_spn_tables(sbox=s_box, perm=permutation_map):
+    """
+    Build the lookup tables used by the integer engine
+    :param sbox: 4-bit s-box dictionary in the same form as s_box
+    :param perm: 16-bit permutation in any form accepted by compile_permutation
+    :return: dictionary of lookup tables
+    """
+    s = sbox_to_list(sbox)
+    s_inv = [0] * 16
+    for x, y in enumerate(s):
+        s_inv[y] = x
+    perm = compile_permutation(perm, 16)
+    perm_inv = perm.inverse()
+    # substitution of a whole byte (two nibbles at once)
+    s8 = [(s[b >> 4] << 4) | s[b & 0xf] for b in range(256)]
+    s8_inv = [(s_inv[b >> 4] << 4) | s_inv[b & 0xf] for b in range(256)]
+    # tables[..][0] is indexed by the high byte of the state, tables[..][1] by the low byte
+    p = [[perm(b << 8) for b in range(256)], [perm(b) for b in range(256)]]
+    p_inv = [[perm_inv(b << 8) for b in range(256)], [perm_inv(b) for b in range(256)]]
+    # substitution followed by permutation (encryption) and inverse substitution followed
+    # by inverse permutation (decryption)
+    sp = [[p[0][s8[b]] for b in range(256)], [p[1][s8[b]] for b in range(256)]]
+    sp_inv = [[p_inv[0][s8_inv[b]] for b in range(256)], [p_inv[1][s8_inv[b]] for b in range(256)]]
+    return SpnTables({'s': s, 's_inv': s_inv, 's8': s8, 's8_inv': s8_inv,
+                      'p': p, 'p_inv': p_inv, 'sp': sp, 'sp_inv': sp_inv})
+
+spn_tables = build_spn_tables(s_box, permutation_map)
 
-def spn_process(input: BitArray, key :BitArray, num_rounds=2, encrypt=True, verbose=False):
-    w_list = [BitArray()] * (num_rounds + 1)
-    u_list = [BitArray()] * (num_rounds + 1)
-    v_list = [BitArray()] * (num_rounds + 1)
-    key_array = get_keys(key, num_rounds + 1)
-    # pad the key_array to better fit with the algorithm given
-    key_array = [None] + key_array
+def get_keys_int(master_key: int, num_keys: int, key_length=None):
+    """
+    Integer version of get_keys, round key i is bits [4i, 4i+16) of the master key
+    :param master_key: master key which the round keys can be generated from
+    :param num_keys: the number of round keys needed
+    :param key_length: length of master_key in bits, defaults to the shortest usable length
+    :return: a list of 16-bit round keys
+    """
+    if key_length is None:
+        key_length = 4 * (num_keys - 1) + 16
+    if key_length < 4 * (num_keys - 1) + 16:
+        raise ValueError('Master key is too short for %s round keys.' % num_keys)
+    return [(master_key >> (key_length - 4 * i - 16)) & 0xffff for i in range(0, num_keys)]
+
+def spn_process_int(input: int, key: int, num_rounds=2, encrypt=True, key_length=None, tables=spn_tables,
+                    tracer=None):
+    """
+    Encrypt or decrypt a 16-bit integer with the SPN
+    :param input: 16-bit plaintext (encryption) or ciphertext (decryption)
+    :param key: master key as an integer
+    :param num_rounds: number of spn rounds
+    :param encrypt: set to True for encryption, False otherwise
+    :param key_length: length of key in bits, defaults to 4 * num_rounds + 16
+    :param tables: lookup tables from build_spn_tables
+    :param tracer: callable receiving (round, stage, value) events, see spn_trace_int
+    :return: 16-bit output
+    """
+    if tracer is not None:
+        return spn_trace_int(input, key, num_rounds, encrypt, key_length, tables, tracer)
+    key_array = [None] + get_keys_int(key, num_rounds + 1, key_length)
     if encrypt:
-        w_list[0] = input
+        sp_hi, sp_lo = tables['sp']
+        s8 = tables['s8']
+        w = input
         for round_number in range(1, num_rounds):
-            # perform a series of regular encryption rounds, including round key XOR, substitution, and permutation
+            u = w ^ key_array[round_number]
+            w = sp_hi[u >> 8] | sp_lo[u & 0xff]
+        # final round which excludes permutation
+        u = w ^ key_array[num_rounds]
+        return ((s8[u >> 8] << 8) | s8[u & 0xff]) ^ key_array[num_rounds + 1]
+    # decryption: P^-1(S^-1(v) ^ K) = P^-1(S^-1(v)) ^ P^-1(K), so each inner round is one
+    # pass through sp_inv followed by an XOR with the permuted round key
+    sp_hi, sp_lo = tables['sp_inv']
+    p_hi, p_lo = tables['p_inv']
+    s8_inv = tables['s8_inv']
+    v = input ^ key_array[num_rounds + 1]
+    for round_number in range(num_rounds, 1, -1):
+        k = key_array[round_number]
+        v = sp_hi[v >> 8] ^ sp_lo[v & 0xff] ^ p_hi[k >> 8] ^ p_lo[k & 0xff]
+    return ((s8_inv[v >> 8] << 8) | s8_inv[v & 0xff]) ^ key_array[1]
 
-            # XOR step
-            u_list[round_number] = w_list[round_number - 1] ^ key_array[round_number]
-            # Substitution step
-            v_list[round_number] = substitute_two_bytes(u_list[round_number], encrypt)
-            # Permutation step
-            w_list[round_number] = permute_two_bytes(v_list[round_number], encrypt)
+def spn_trace_int(input: int, key: int, num_rounds=2, encrypt=True, key_length=None, tables=spn_tables,
+                  tracer=None):
+    """
+    Step-by-step version of spn_process_int which reports every intermediate value to a tracer
+    (see common.trace): the round keys as stage 'key' (rounds 1 to num_rounds + 1), then u, v and
+    w of every round as named in spn_process; w of the last round is the ciphertext and when
+    decrypting the stages come in reverse, ending with w of round 0, the plaintext
+    :return: 16-bit output
+    """
+    key_array = [None] + get_keys_int(key, num_rounds + 1, key_length)
+    tracer(0, 'input', input)
+    for round_number in range(1, num_rounds + 2):
+        tracer(round_number, 'key', key_array[round_number])
 
-        # final round which excludes permutation
-        u_list[num_rounds] = w_list[num_rounds - 1] ^ key_array[num_rounds]
-        v_list[num_rounds] = substitute_two_bytes(u_list[num_rounds], encrypt)
-        output = v_list[num_rounds] ^ key_array[num_rounds + 1]
-    else:  # decryption
-        w_list[num_rounds] = input
-        v_list[num_rounds] = w_list[num_rounds] ^ key_array[num_rounds + 1]
-        u_list[num_rounds] = substitute_two_bytes(v_list[num_rounds], encrypt)
-        w_list[num_rounds - 1] = u_list[num_rounds] ^ key_array[num_rounds]
-        for round_number in range(num_rounds - 1, 0, -1):
-            # Permutation step
-            v_list[round_number] = permute_two_bytes(w_list[round_number], encrypt)
-            # Substitution step
-            u_list[round_number] = substitute_two_bytes(v_list[round_number], encrypt)
-            # XOR step
-            w_list[round_number - 1] = u_list[round_number] ^ key_array[round_number]
-
-        output = w_list[0]
+    def sub(x, table):
+        return (table[x >> 8] << 8) | table[x & 0xff]
+
+    def perm(x, table):
+        return table[0][x >> 8] | table[1][x & 0xff]
+
+    if encrypt:
+        w = input
+        for round_number in range(1, num_rounds + 1):
+            u = w ^ key_array[round_number]
+            tracer(round_number, 'u', u)
+            v = sub(u, tables['s8'])
+            tracer(round_number, 'v', v)
+            # final round which excludes permutation
+            w = perm(v, tables['p']) if round_number < num_rounds else v ^ key_array[num_rounds + 1]
+            tracer(round_number, 'w', w)
+        return w
+    v = input ^ key_array[num_rounds + 1]
+    tracer(num_rounds, 'v', v)
+    for round_number in range(num_rounds, 0, -1):
+        if round_number < num_rounds:
+            v = perm(w, tables['p_inv'])
+            tracer(round_number, 'v', v)
+        u = sub(v, tables['s8_inv'])
+        tracer(round_number, 'u', u)
+        w = u ^ key_array[round_number]
+        tracer(round_number - 1, 'w', w)
+    return w
+
+def spn_states_int(input: int, key: int, num_rounds=2, encrypt=True, key_length=None, tables=spn_tables):
+    """
+    Run spn_trace_int and keep every intermediate value
+    :return: the w, u and v lists and the key array (padded with None), as integers
+    """
+    recorder = Recorder()
+    spn_trace_int(input, key, num_rounds, encrypt, key_length, tables, recorder)
+    return recorded_states(recorder, input, num_rounds, encrypt)
+
+def recorded_states(recorder: Recorder, input: int, num_rounds: int, encrypt: bool):
+    """
+    Arrange the events of spn_trace_int into lists indexed by round
+    :param recorder: Recorder attached to spn_trace_int
+    :param input: input of the traced operation
+    :param num_rounds: number of spn rounds
+    :param encrypt: set to True for encryption, False otherwise
+    :return: the w, u and v lists and the key array (padded with None), as integers
+    """
+    w_list = recorder.table('w', num_rounds + 1)
+    w_list[0 if encrypt else num_rounds] = input
+    return (w_list, recorder.table('u', num_rounds + 1), recorder.table('v', num_rounds + 1),
+            recorder.table('key', num_rounds + 2))
+
+
+def spn_encrypt_batch(inputs, key: int, num_rounds=2, key_length=None, tables=spn_tables,
+                      stop_round=None, stage='w', tracer=None):
+    """
+    Encrypt many 16-bit blocks at once using numpy table gathers
+    :param inputs: array-like of 16-bit plaintexts, e.g. np.arange(2**16) for the whole codebook
+    :param key: master key as an integer
+    :param num_rounds: number of spn rounds
+    :param key_length: length of key in bits, defaults to 4 * num_rounds + 16
+    :param tables: lookup tables from build_spn_tables
+    :param stop_round: if set, return the state of this round instead of the ciphertext
+    :param stage: which state of stop_round to return, 'u' (after the key XOR), 'v' (after
+                  the substitution) or 'w' (end of the round), as named in spn_process
+    :param tracer: callable receiving (round, stage, value) events with the arrays of every
+                   stage, as in spn_trace_int
+    :return: numpy uint16 array with the same shape as inputs
+    """
+    if stop_round is not None and not 1 <= stop_round <= num_rounds:
+        raise ValueError('stop_round must be between 1 and num_rounds.')
+    if stage not in ('u', 'v', 'w'):
+        raise ValueError("stage must be one of 'u', 'v' or 'w'.")
+    w = np.asarray(inputs)
+    if w.dtype != np.uint16:
+        if w.size and (w.min() < 0 or w.max() > 0xffff):
+            raise ValueError('Inputs must be sixteen bits long.')
+        w = w.astype(np.uint16)
+    key_array = [None] + [np.uint16(k) for k in get_keys_int(key, num_rounds + 1, key_length)]
+    s8, sp = tables['np']['s8'], tables['np']['sp']
+    last = num_rounds if stop_round is None else stop_round
+    if tracer is not None:
+        tracer(0, 'input', w)
+    for round_number in range(1, last + 1):
+        u = w ^ key_array[round_number]
+        if tracer is not None:
+            tracer(round_number, 'u', u)
+        if round_number == last and stage == 'u':
+            return u
+        if round_number == num_rounds or (round_number == last and stage == 'v'):
+            v = (s8[u >> 8] << 8) | s8[u & 0xff]
+            if tracer is not None:
+                tracer(round_number, 'v', v)
+            if round_number == last and stage == 'v':
+                return v
+            # final round which excludes permutation, w is the ciphertext
+            w = v ^ key_array[num_rounds + 1]
+            if tracer is not None:
+                tracer(round_number, 'w', w)
+            return w
+        # substitution and permutation are a single lookup here, so there is no 'v' event
+        w = sp[0][u >> 8] | sp[1][u & 0xff]
+        if tracer is not None:
+            tracer(round_number, 'w', w)
+    return w
+
+
+def get_keys_batch(master_keys, num_keys: int, key_length=None):
+    """
+    Vectorized get_keys_int over many master keys
+    :param master_keys: array-like of master keys (at most 64 bits)
+    :param num_keys: the number of round keys needed
+    :param key_length: length of the master keys in bits, defaults to the shortest usable length
+    :return: list of num_keys numpy uint16 arrays, element i holding round key i of every master key
+    """
+    if key_length is None:
+        key_length = 4 * (num_keys - 1) + 16
+    if key_length < 4 * (num_keys - 1) + 16:
+        raise ValueError('Master key is too short for %s round keys.' % num_keys)
+    master_keys = np.asarray(master_keys, dtype=np.uint64)
+    return [((master_keys >> np.uint64(key_length - 4 * i - 16)) & np.uint64(0xffff)).astype(np.uint16)
+            for i in range(0, num_keys)]
+
+def spn_encrypt_keys(input: int, keys, num_rounds=2, key_length=None, tables=spn_tables):
+    """
+    Encrypt one 16-bit block under many master keys at once, the transpose of spn_encrypt_batch
+    :param input: 16-bit plaintext
+    :param keys: array-like of master keys
+    :param num_rounds: number of spn rounds
+    :param key_length: length of the keys in bits, defaults to 4 * num_rounds + 16
+    :param tables: lookup tables from build_spn_tables
+    :return: numpy uint16 array of ciphertexts, one per key
+    """
+    key_array = [None] + get_keys_batch(keys, num_rounds + 1, key_length)
+    s8, sp = tables['np']['s8'], tables['np']['sp']
+    w = np.uint16(input)
+    for round_number in range(1, num_rounds):
+        u = w ^ key_array[round_number]
+        w = sp[0][u >> 8] | sp[1][u & 0xff]
+    # final round which excludes permutation
+    u = w ^ key_array[num_rounds]
+    return ((s8[u >> 8] << 8) | s8[u & 0xff]) ^ key_array[num_rounds + 1]
+
+
+def spn_encrypt_parallel(inputs, key: int, num_rounds=2, workers=None, store=None, **kwargs):
+    """
+    spn_encrypt_batch sharded over a process pool, for sweeps over very many blocks
+    :param inputs: array-like of 16-bit plaintexts
+    :param key: master key as an integer
+    :param num_rounds: number of spn rounds
+    :param workers: number of worker processes, os.cpu_count() by default and at most
+    :param store: common.store.ArtifactStore to take the codebook of the key from, built on
+                  first use; the blocks are then looked up in it, the workers mapping the stored
+                  file instead of encrypting (the s-box and permutation of this module only)
+    :param kwargs: further arguments of spn_encrypt_batch (key_length, tables, stop_round, stage)
+    :return: numpy uint16 array, in the order of inputs
+    """
+    from common.parallel import map_blocks
+    inputs = np.asarray(inputs, dtype=np.uint16)
+    if store is not None:
+        if 'tables' in kwargs:
+            raise ValueError('Stored codebooks are only kept for the default tables.')
+        from common.store import spn_states
+        codebook = spn_states(key, num_rounds, kwargs.get('key_length'), kwargs.get('stop_round'),
+                              kwargs.get('stage', 'w'), store=store)
+        return map_blocks(lookup_blocks, inputs, codebook, workers=workers)
+    return map_blocks(spn_encrypt_batch, inputs, key, num_rounds, workers=workers, **kwargs)
+
+def lookup_blocks(blocks, codebook):
+    """
+    :param blocks: numpy array of 16-bit blocks
+    :param codebook: array of 2**16 outputs, e.g. from common.store.spn_codebook
+    :return: the output of every block
+    """
+    return codebook[blocks]
+
+
+def spn_process(input: BitArray, key :BitArray, num_rounds=2, encrypt=True, verbose=False, tracer=None):
+    """
+    Encrypt or decrypt a 16-bit BitArray with the SPN, a wrapper around spn_process_int
+    :param input: 16-bit plaintext (encryption) or ciphertext (decryption)
+    :param key: master key, at least 4 * num_rounds + 16 bits long
+    :param num_rounds: number of spn rounds
+    :param encrypt: set to True for encryption, False otherwise
+    :param verbose: set to True to print the intermediate values
+    :param tracer: callable receiving (round, stage, value) events, see spn_trace_int
+    :return: 16-bit output
+    """
+    if len(input) != 16:
+        raise(ValueError('Input must be sixteen bits long.'))
+    recorder = Recorder() if verbose else None
+    output = spn_process_int(input.uint, key.uint, num_rounds, encrypt, key_length=len(key),
+                             tracer=tee(recorder, tracer))
     if verbose:
+        states = recorded_states(recorder, input.uint, num_rounds, encrypt)
+
+        def to_bits(lst):
+            return [BitArray() if x is None else BitArray(uint=x, length=16) for x in lst]
+
+        w_list, u_list, v_list, key_array = [to_bits(lst) for lst in states]
+        key_array[0] = None
+        # the last w entry of an encryption is the output, which the BitArray loop never stored
+        if encrypt:
+            w_list[num_rounds] = BitArray()
         print("w_list: {0}, ".format(w_list))
         print("u_list: {0}, ".format(u_list))
         print("v_list: {0}, ".format(v_list))
         print("key array: {0}".format(key_array))
-    return output
+    return BitArray(uint=output, length=16)
 
-input = BitArray('0xF5B2')  # works for B33C -> F5B2
-key = BitArray('0x8FA507')
-rounds = 2
-verbosity = True
+if __name__ == '__main__':
+    input = BitArray('0xF5B2')  # works for B33C -> F5B2
+    key = BitArray('0x8FA507')
+    rounds = 2
+    verbosity = True
 
-output = spn_process(input, key, encrypt=False, verbose=verbosity)
-print('Output: %s' % output)
\ No newline at end of file
+    output = spn_process(input, key, encrypt=False, verbose=verbosity)
+    print('Output: %s' % output)
\ No newline at end of file
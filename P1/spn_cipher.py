@@ -0,0 +1,289 @@
+from functools import partial
+from P1.spn import s_box, permutation_map, sbox_to_list, get_keys_int
+from common.permutation import compile_permutation
+from common.lazy import lazy_import
+
+np = lazy_import('numpy')
+
+# Configurable substitution-permutation networks
+# An SPN object is built from an s-box, a bit permutation of the block, a block size and a key
+# schedule, and compiles them into packed-integer tables the same way build_spn_tables does for
+# the 16-bit cipher: the block is cut into chunks of a byte (or of one s-box when its width does
+# not divide 8), and for every chunk a table maps each chunk value to the substituted and
+# permuted contribution to the whole block, so a round costs one lookup per chunk. Batches are
+# stored in uint64 lanes, which bounds the batch block size to 64 bits; the scalar functions work
+# on Python integers of any size.
+#
+# Rounds are numbered from 1 as in spn_process: u is the state after the round key XOR, v after
+# the substitution and w after the permutation. Stinson's SPN leaves out the permutation of the
+# last round, PRESENT keeps it; either way the last round key is XORed after the last round.
+
+class SPN:
+    """
+    A substitution-permutation network with a given s-box, permutation, block size and key schedule
+    """
+    def __init__(self, sbox, perm, block_bits: int, key_schedule, num_rounds: int, final_permutation=False,
+                 name='SPN'):
+        """
+        :param sbox: s-box as a dictionary in the form of P1.spn.s_box, or a list indexed by integers
+        :param perm: bit permutation of the block in any form accepted by compile_permutation
+        :param block_bits: number of bits in the block, a multiple of the s-box width
+        :param key_schedule: function called as key_schedule(master_key, num_rounds) returning the
+                             num_rounds + 1 round keys as integers
+        :param num_rounds: number of rounds
+        :param final_permutation: set to True to apply the permutation in the last round too
+        :param name: name shown by repr
+        """
+        s = sbox_to_list(sbox) if isinstance(sbox, dict) else [int(x) for x in sbox]
+        sbox_bits = len(s).bit_length() - 1
+        if len(s) != 1 << sbox_bits or sorted(s) != list(range(len(s))):
+            raise ValueError('The s-box must be a bijection on 2**n values.')
+        if block_bits % sbox_bits:
+            raise ValueError('The block size must be a multiple of the s-box width.')
+        self.perm = compile_permutation(perm, block_bits)
+        if self.perm.out_bits != block_bits or not self.perm.is_bijective():
+            raise ValueError('The permutation must be a bijection on %s bits.' % block_bits)
+        self.perm_inv = self.perm.inverse()
+        self.s = s
+        self.s_inv = [0] * len(s)
+        for x, y in enumerate(s):
+            self.s_inv[y] = x
+        self.sbox_bits = sbox_bits
+        self.block_bits = block_bits
+        self.key_schedule = key_schedule
+        self.num_rounds = num_rounds
+        self.final_permutation = final_permutation
+        self.name = name
+        self.block_mask = (1 << block_bits) - 1
+        # a chunk holds whole s-boxes, chunk 0 being the most significant
+        self.chunk_bits = 8 if 8 % sbox_bits == 0 and block_bits % 8 == 0 else sbox_bits
+        self.shifts = list(range(block_bits - self.chunk_bits, -1, -self.chunk_bits))
+        self.chunk_mask = (1 << self.chunk_bits) - 1
+        s_chunk = [self.substitute_chunk(b, s) for b in range(1 << self.chunk_bits)]
+        s_inv_chunk = [self.substitute_chunk(b, self.s_inv) for b in range(1 << self.chunk_bits)]
+        # per-chunk tables: substitution alone, substitution then permutation (encryption), and
+        # inverse substitution then inverse permutation (decryption)
+        self.tables = {
+            's': [[y << shift for y in s_chunk] for shift in self.shifts],
+            's_inv': [[y << shift for y in s_inv_chunk] for shift in self.shifts],
+            'sp': [[self.perm(y << shift) for y in s_chunk] for shift in self.shifts],
+            'sp_inv': [[self.perm_inv(y << shift) for y in s_inv_chunk] for shift in self.shifts],
+        }
+        self.np_tables = None
+        if block_bits <= 64:
+            self.np_tables = {name: np.array(table, dtype=np.uint64) for name, table in self.tables.items()}
+
+    def substitute_chunk(self, value: int, table: list):
+        """
+        Substitute every s-box-sized piece of a chunk
+        :param value: chunk value
+        :param table: s-box or inverse s-box as a list
+        :return: substituted chunk
+        """
+        output = 0
+        for shift in range(self.chunk_bits - self.sbox_bits, -1, -self.sbox_bits):
+            output |= table[(value >> shift) & (len(table) - 1)] << shift
+        return output
+
+    def round_keys(self, key: int):
+        """
+        :param key: master key as an integer
+        :return: list of round keys padded with None, so that round key i is element i
+        """
+        keys = [int(k) for k in self.key_schedule(key, self.num_rounds)]
+        if len(keys) != self.num_rounds + 1:
+            raise ValueError('The key schedule must give %s round keys.' % (self.num_rounds + 1))
+        return [None] + keys
+
+    def layer(self, value: int, name: str):
+        """
+        Apply one of the compiled layers to a block
+        :param value: block as an integer
+        :param name: 's', 's_inv', 'sp' or 'sp_inv'
+        :return: output block
+        """
+        output = 0
+        for shift, table in zip(self.shifts, self.tables[name]):
+            output |= table[(value >> shift) & self.chunk_mask]
+        return output
+
+    def layer_batch(self, values, name: str):
+        """
+        Apply one of the compiled layers to a numpy array of blocks
+        :param values: numpy uint64 array
+        :param name: 's', 's_inv', 'sp' or 'sp_inv'
+        :return: numpy uint64 array
+        """
+        tables = self.np_tables[name]
+        if self.chunk_bits == 8:
+            # byte chunks are read straight from a little-endian byte view of the lanes
+            data = np.ascontiguousarray(values, dtype='<u8').view(np.uint8).reshape(values.shape + (8,))
+            output = tables[0][data[..., self.shifts[0] // 8]]
+            for shift, table in zip(self.shifts[1:], tables[1:]):
+                output |= table[data[..., shift // 8]]
+            return output
+        mask = np.uint64(self.chunk_mask)
+        output = tables[0][(values >> np.uint64(self.shifts[0])) & mask]
+        for shift, table in zip(self.shifts[1:], tables[1:]):
+            output |= table[(values >> np.uint64(shift)) & mask]
+        return output
+
+    def encrypt(self, plaintext: int, key: int):
+        """
+        Encrypt one block
+        :param plaintext: block as an integer
+        :param key: master key as an integer
+        :return: ciphertext as an integer
+        """
+        key_array = self.round_keys(key)
+        w = plaintext
+        for round_number in range(1, self.num_rounds + 1):
+            u = w ^ key_array[round_number]
+            if round_number < self.num_rounds or self.final_permutation:
+                w = self.layer(u, 'sp')
+            else:
+                w = self.layer(u, 's')
+        return w ^ key_array[self.num_rounds + 1]
+
+    def decrypt(self, ciphertext: int, key: int):
+        """
+        Decrypt one block
+        :param ciphertext: block as an integer
+        :param key: master key as an integer
+        :return: plaintext as an integer
+        """
+        key_array = self.round_keys(key)
+        v = ciphertext ^ key_array[self.num_rounds + 1]
+        if self.final_permutation:
+            v = self.perm_inv(v)
+        # P^-1(S^-1(v) ^ K) = P^-1(S^-1(v)) ^ P^-1(K), as in spn_process_int
+        for round_number in range(self.num_rounds, 1, -1):
+            v = self.layer(v, 'sp_inv') ^ self.perm_inv(key_array[round_number])
+        return self.layer(v, 's_inv') ^ key_array[1]
+
+    def check_batch(self, values):
+        """
+        Convert batch inputs into uint64 lanes
+        :param values: array-like of blocks
+        :return: numpy uint64 array
+        """
+        if self.np_tables is None:
+            raise ValueError('Batches are limited to blocks of 64 bits.')
+        values = np.asarray(values)
+        if values.dtype != np.uint64:
+            if values.size and (values.min() < 0 or int(values.max()) > self.block_mask):
+                raise ValueError('Inputs must be %s bits long.' % self.block_bits)
+            values = values.astype(np.uint64)
+        return values
+
+    def encrypt_batch(self, inputs, key: int, stop_round=None, stage='w'):
+        """
+        Encrypt many blocks at once, optionally stopping at an intermediate state
+        :param inputs: array-like of blocks
+        :param key: master key as an integer
+        :param stop_round: if set, return the state of this round instead of the ciphertext
+        :param stage: which state of stop_round to return, 'u', 'v' or 'w', as in
+                      P1.spn.spn_encrypt_batch (w of the last round is the ciphertext)
+        :return: numpy uint64 array with the same shape as inputs
+        """
+        if stop_round is not None and not 1 <= stop_round <= self.num_rounds:
+            raise ValueError('stop_round must be between 1 and num_rounds.')
+        if stage not in ('u', 'v', 'w'):
+            raise ValueError("stage must be one of 'u', 'v' or 'w'.")
+        w = self.check_batch(inputs)
+        key_array = [None] + [np.uint64(k) for k in self.round_keys(key)[1:]]
+        last = self.num_rounds if stop_round is None else stop_round
+        for round_number in range(1, last + 1):
+            u = w ^ key_array[round_number]
+            if round_number == last and stage == 'u':
+                return u
+            if round_number == last and stage == 'v':
+                return self.layer_batch(u, 's')
+            if round_number < self.num_rounds or self.final_permutation:
+                w = self.layer_batch(u, 'sp')
+            else:
+                w = self.layer_batch(u, 's')
+        if last == self.num_rounds:
+            w = w ^ key_array[self.num_rounds + 1]
+        return w
+
+    def decrypt_batch(self, inputs, key: int):
+        """
+        Decrypt many blocks at once
+        :param inputs: array-like of ciphertext blocks
+        :param key: master key as an integer
+        :return: numpy uint64 array of plaintexts
+        """
+        key_array = self.round_keys(key)
+        v = self.check_batch(inputs) ^ np.uint64(key_array[self.num_rounds + 1])
+        if self.final_permutation:
+            v = self.perm_inv.apply_array(v).astype(np.uint64)
+        for round_number in range(self.num_rounds, 1, -1):
+            v = self.layer_batch(v, 'sp_inv') ^ np.uint64(self.perm_inv(key_array[round_number]))
+        return self.layer_batch(v, 's_inv') ^ np.uint64(key_array[1])
+
+    def __repr__(self):
+        return '%s(%s-bit block, %s-bit s-box, %s rounds)' % (self.name, self.block_bits, self.sbox_bits,
+                                                             self.num_rounds)
+
+def stinson_key_schedule(master_key: int, num_rounds: int, key_length=None):
+    """
+    Key schedule of Stinson 3.2 (get_keys), round key i is bits [4i, 4i+16) of the master key
+    :param master_key: master key as an integer
+    :param num_rounds: number of rounds
+    :param key_length: length of the master key in bits, defaults to 4 * num_rounds + 16
+    :return: list of num_rounds + 1 round keys
+    """
+    return get_keys_int(master_key, num_rounds + 1, key_length)
+
+def stinson_spn(num_rounds=4, key_length=None, sbox=s_box, perm=permutation_map):
+    """
+    The 16-bit SPN of Stinson 3.2, the configuration of P1/spn.py
+    :param num_rounds: number of rounds
+    :param key_length: length of the master key in bits, defaults to 4 * num_rounds + 16
+    :param sbox: s-box, P1.spn.s_box by default
+    :param perm: permutation, P1.spn.permutation_map by default
+    :return: SPN
+    """
+    return SPN(sbox, perm, 16, partial(stinson_key_schedule, key_length=key_length), num_rounds,
+               name='Stinson 3.2')
+
+# PRESENT s-box and bit permutation: bit i (0 being the least significant) moves to 16i mod 63,
+# bit 63 stays in place. Written as input positions per output bit, most significant bit first.
+present_sbox = [0xc, 0x5, 0x6, 0xb, 0x9, 0x0, 0xa, 0xd, 0x3, 0xe, 0xf, 0x8, 0x4, 0x7, 0x1, 0x2]
+present_permutation = [0] * 64
+for _bit in range(64):
+    present_permutation[63 - (63 if _bit == 63 else 16 * _bit % 63)] = 64 - _bit
+del _bit
+
+def present_key_schedule(master_key: int, num_rounds: int):
+    """
+    Key schedule of PRESENT-80: the round key is the top 64 bits of an 80-bit register which is
+    rotated left by 61, has its top nibble substituted and the round counter XORed in bits 19..15
+    :param master_key: 80-bit master key as an integer
+    :param num_rounds: number of rounds
+    :return: list of num_rounds + 1 round keys
+    """
+    register = master_key & ((1 << 80) - 1)
+    keys = []
+    for counter in range(1, num_rounds + 2):
+        keys.append(register >> 16)
+        register = ((register << 61) | (register >> 19)) & ((1 << 80) - 1)
+        register = (present_sbox[register >> 76] << 76) | (register & ((1 << 76) - 1))
+        register ^= counter << 15
+    return keys
+
+def present_spn(num_rounds=31):
+    """
+    PRESENT-80, a 64-bit SPN with a 4-bit s-box and the permutation in every round
+    :param num_rounds: number of rounds, 31 in PRESENT
+    :return: SPN
+    """
+    return SPN(present_sbox, present_permutation, 64, present_key_schedule, num_rounds, final_permutation=True,
+               name='PRESENT')
+
+# preset constructors by name
+presets = {
+    'stinson': stinson_spn,
+    'present': present_spn,
+}
@@ -1,4 +1,8 @@
-from bitstring import *
+from P1.spn import BitArray, np, build_spn_tables
+from P1.prefix_tree import PrefixEvaluator
+from P4.bias_estimate import parity
+from common.permutation import compile_permutation
+from common.store import ArtifactStore, spn_states_config
 
 # Define dictionaries used for substititutions and pemutations
 # substitution dictionary for encryption
@@ -44,8 +48,12 @@ perm_dict_encrypt = {
     16: 16,
 }
 
+# compiled permutation for encryption and its inverse for decryption
+permutation = compile_permutation(perm_dict_encrypt, 16)
+inverse_permutation = permutation.inverse()
+
 # permutation dictionary for decryption, an inverse of the dictionary for encryption
-perm_dict_decrypt = {v: k for k, v in perm_dict_encrypt.items()}
+perm_dict_decrypt = inverse_permutation.as_dict()
 
 def get_keys(master_key: BitArray, num_keys: int):
     """
@@ -99,53 +107,54 @@ def permute_two_bytes(bytes_in: BitArray, encrypt: bool):
     :param encrypt: set to True for encryption, False otherwise
     :return: scrambled set of two bytes
     """
-    output = BitArray('0x0000')
     if encrypt:
-        for i in range(1,17):
-            output[i-1] = bytes_in[perm_dict_encrypt[i]-1]
-    else:
-        for i in range(1,17):
-            output[i-1] = bytes_in[perm_dict_decrypt[i]-1]
-    return output
+        return BitArray(uint=permutation(bytes_in.uint), length=16)
+    return BitArray(uint=inverse_permutation(bytes_in.uint), length=16)
 
-for i in range(1, 3):
+def observed_zero_counts(keys, num_rounds=4, in_mask=0x0001, out_mask=0x8080, store=None):
+    """
+    Count over the whole codebook the plaintexts for which a linear approximation holds
+    :param keys: iterable of 32-bit master keys
+    :param num_rounds: number of spn rounds
+    :param in_mask: mask on the plaintext, 0x0001 for input[15] (bit 0 being the most significant)
+    :param out_mask: mask on u of the last round, 0x8080 for output[0] ^ output[8]
+    :param store: ArtifactStore keeping the states of every key between runs (see
+                  common.store.spn_states), the default one if None, False for none
+    :return: dictionary of key to number of zeroes, in increasing key order
+    """
+    inputs = np.arange(2**16, dtype=np.uint16)
+    input_parity = parity(inputs & np.uint16(in_mask))
+
+    def zeros(output):
+        return 2**16 - int(np.count_nonzero(parity(output & np.uint16(out_mask)) ^ input_parity))
+
+    def config(K):
+        return spn_states_config(K, num_rounds, 32, num_rounds, 'u', sub_dict_encrypt, perm_dict_encrypt)
+    counts = {}
+    if store is not False:
+        store = store or ArtifactStore()
+        for K in set(int(k) for k in keys):
+            output = store.get(config(K))
+            if output is not None:
+                counts[K] = zeros(output)
+    missing = [K for K in keys if int(K) not in counts]
+    if missing:
+        # tables for the s-box and permutation above, used by the batch encryption
+        spn_tables = build_spn_tables(sub_dict_encrypt, perm_dict_encrypt)
+        # state after the last round key XOR (u of the last round) for the whole codebook, keys
+        # sharing leading bits share the rounds they have in common
+        evaluator = PrefixEvaluator(inputs, num_rounds, key_length=32, tables=spn_tables,
+                                    stop_round=num_rounds, stage='u')
+        for K, output in evaluator.walk(missing):
+            if store is not False:
+                store.put(config(K), output)
+            counts[K] = zeros(output)
+    return {K: counts[K] for K in sorted(counts)}
+
+if __name__ == '__main__':
     num_of_rounds = 4
-    currInput = 0
-    encrypt = True
-    zeroCount = 0
-    if i == 1:
-        K = BitArray('0x93E026DE') #key 1
-    else:
-        K = BitArray('0xE5D7F82E') #key 2
-        
-    while currInput < 2**16:
-        input = BitArray(uint=currInput, length=16)
-
-
-        w_list = [BitArray()]*(num_of_rounds+1)
-        u_list = [BitArray()]*(num_of_rounds+1)
-        v_list = [BitArray()]*(num_of_rounds+1)
-        key_array = get_keys(K, num_of_rounds+1)
-        # pad the key_array to better fit with the algorithm given
-        key_array = [None] + key_array
-
-        w_list[0] = input
-        for round_number in range(1, num_of_rounds):
-            # perform a series of regular encryption rounds, including round key XOR, substitution, and permutation
-
-            # XOR step
-            u_list[round_number] = w_list[round_number-1] ^ key_array[round_number]
-            # Substitution step
-            v_list[round_number] = substitute_two_bytes(u_list[round_number], encrypt)
-            # Permutation step
-            w_list[round_number] = permute_two_bytes(v_list[round_number], encrypt)
-
-        output = w_list[num_of_rounds-1] ^ key_array[num_of_rounds]
-        currInput+=1
-        output = output[0] ^ output[8] ^ input[15]
-
-        if not output:
-            zeroCount+=1
-
-    print(zeroCount)
-    print('The observed bias for key {0}  is: {1}'.format(i, (zeroCount / 2**16) - 0.5))
\ No newline at end of file
+    keys = {BitArray('0x93E026DE').uint: 1, #key 1
+            BitArray('0xE5D7F82E').uint: 2} #key 2
+    for K, zeroCount in observed_zero_counts(keys, num_of_rounds).items():
+        print(zeroCount)
+        print('The observed bias for key {0}  is: {1}'.format(keys[K], (zeroCount / 2**16) - 0.5))
@@ -0,0 +1,177 @@
+from statistics import NormalDist
+from common.lazy import lazy_import
+
+np = lazy_import('numpy')
+
+# Bias of a linear approximation, measured exactly or by sampling
+# An approximation is a mask on the input and a mask on the output of an oracle, a function
+# mapping a numpy array of blocks to the array of values the output mask applies to (e.g.
+# spn_encrypt_batch stopped at u of the last round, as in Observed_bias_4c.py). Its bias is the
+# fraction of inputs for which the two parities are equal (zero xor), minus 1/2.
+#
+# exact_bias enumerates every input, which is only practical for small blocks. estimate_bias
+# draws random inputs batch by batch and keeps a normal-approximation confidence interval on the
+# bias, stopping once the interval is narrow enough or, if asked, once it excludes zero. Batches
+# start small and double up to BATCH_SIZE, so an easy decision is taken after few samples. The
+# interval is recomputed after every batch, so its coverage is nominal: ask for a higher
+# confidence when the stopping rule is used to decide significance.
+
+# inputs drawn or enumerated at a time
+BATCH_SIZE = 2**16
+# size of the first batch of estimate_bias
+FIRST_BATCH = 2**10
+
+def parity(values):
+    """
+    Parity of every element of an array of integers up to 64 bits
+    :param values: numpy array
+    :return: numpy uint8 array of 0s and 1s
+    """
+    values = np.asarray(values).astype(np.uint64)
+    for shift in (32, 16, 8, 4):
+        values = values ^ (values >> np.uint64(shift))
+    # 0x6996 holds the parity of every nibble
+    return ((np.uint64(0x6996) >> (values & np.uint64(0xf))) & np.uint64(1)).astype(np.uint8)
+
+def block_dtype(block_bits: int):
+    """
+    :param block_bits: number of bits in the block
+    :return: the smallest unsigned numpy type holding a block
+    """
+    for dtype in (np.uint8, np.uint16, np.uint32, np.uint64):
+        if block_bits <= np.iinfo(dtype).bits:
+            return dtype
+    raise ValueError('Blocks are limited to 64 bits.')
+
+def count_zeros(oracle, inputs, in_mask: int, out_mask: int):
+    """
+    Count the inputs for which the approximation holds
+    :param oracle: function from an array of inputs to the array of masked outputs
+    :param inputs: numpy array of inputs
+    :param in_mask: mask on the input
+    :param out_mask: mask on the output of oracle
+    :return: number of inputs whose input parity equals their output parity
+    """
+    outputs = np.asarray(oracle(inputs)).astype(np.uint64)
+    inputs = inputs.astype(np.uint64)
+    return len(inputs) - int(np.count_nonzero(parity((inputs & np.uint64(in_mask)) ^
+                                                     (outputs & np.uint64(out_mask)))))
+
+def bias_interval(zeros: int, samples: int, confidence: float):
+    """
+    Normal-approximation confidence interval on the bias
+    :param zeros: number of samples for which the approximation holds
+    :param samples: number of samples
+    :param confidence: confidence level, e.g. 0.95
+    :return: (bias, lower end, upper end)
+    """
+    p = zeros / samples
+    z = NormalDist().inv_cdf(0.5 + confidence / 2)
+    half_width = z * max(p * (1 - p), 1 / samples) ** 0.5 / samples ** 0.5
+    return p - 0.5, p - 0.5 - half_width, p - 0.5 + half_width
+
+def exact_bias(oracle, in_mask: int, out_mask: int, block_bits=16, batch_size=BATCH_SIZE):
+    """
+    Bias of an approximation over every input
+    :param oracle: function from an array of inputs to the array of masked outputs
+    :param in_mask: mask on the input
+    :param out_mask: mask on the output of oracle
+    :param block_bits: number of input bits
+    :param batch_size: inputs enumerated at a time
+    :return: dictionary with the bias, its interval (a single point), the number of samples and
+             of zeros, and 'stop' set to 'exact'
+    """
+    if block_bits > 32:
+        raise ValueError('Exact enumeration is limited to 32-bit blocks, use estimate_bias.')
+    dtype = block_dtype(block_bits)
+    zeros = 0
+    for start in range(0, 2**block_bits, batch_size):
+        zeros += count_zeros(oracle, np.arange(start, min(start + batch_size, 2**block_bits), dtype=dtype),
+                             in_mask, out_mask)
+    bias = zeros / 2**block_bits - 0.5
+    return {'bias': bias, 'interval': (bias, bias), 'samples': 2**block_bits, 'zeros': zeros,
+            'confidence': 1.0, 'stop': 'exact'}
+
+def estimate_bias(oracle, in_mask: int, out_mask: int, block_bits=16, precision=None, confidence=0.95,
+                  stop_on_nonzero=False, max_samples=2**24, batch_size=BATCH_SIZE, first_batch=FIRST_BATCH,
+                  seed=None):
+    """
+    Estimate the bias of an approximation from random inputs, stopping as early as possible
+    :param oracle: function from an array of inputs to the array of masked outputs
+    :param in_mask: mask on the input
+    :param out_mask: mask on the output of oracle
+    :param block_bits: number of input bits, at most 64
+    :param precision: stop once the half-width of the interval is at most this, None to only
+                      stop on the other conditions
+    :param confidence: confidence level of the interval
+    :param stop_on_nonzero: stop once the interval excludes zero, i.e. the bias is significant
+    :param max_samples: stop after this many samples whatever the interval
+    :param batch_size: largest number of inputs drawn at a time
+    :param first_batch: number of inputs drawn first, doubled after every batch
+    :param seed: seed for the random inputs
+    :return: dictionary with the 'bias', its 'interval' (lower, upper), the number of 'samples'
+             and of 'zeros', the 'confidence' and the condition that ended sampling in 'stop':
+             'precision', 'significance' or 'max_samples'
+    """
+    rng = np.random.default_rng(seed)
+    dtype = block_dtype(block_bits)
+
+    def draw(count):
+        inputs = rng.integers(0, 2**block_bits, count, dtype=dtype)
+        return count_zeros(oracle, inputs, in_mask, out_mask), count
+    return sample_bias(draw, precision, confidence, stop_on_nonzero, max_samples, batch_size, first_batch)
+
+def sample_bias(draw, precision=None, confidence=0.95, stop_on_nonzero=False, max_samples=2**24,
+                batch_size=BATCH_SIZE, first_batch=FIRST_BATCH):
+    """
+    The sampling loop of estimate_bias, for any source of samples
+    :param draw: function called with a number of samples to draw, returning the number of
+                 zeros among them and the number actually drawn (which may be a little more,
+                 e.g. to fill whole words)
+    :param precision: stop once the half-width of the interval is at most this
+    :param confidence: confidence level of the interval
+    :param stop_on_nonzero: stop once the interval excludes zero
+    :param max_samples: stop after this many samples whatever the interval
+    :param batch_size: largest number of samples drawn at a time
+    :param first_batch: number of samples drawn first, doubled after every batch
+    :return: dictionary as returned by estimate_bias
+    """
+    if precision is None and not stop_on_nonzero and max_samples is None:
+        raise ValueError('Give a precision, stop_on_nonzero or max_samples to bound the sampling.')
+    zeros = samples = 0
+    batch = min(first_batch, batch_size)
+    while True:
+        count = batch if max_samples is None else min(batch, max_samples - samples)
+        batch = min(2 * batch, batch_size)
+        batch_zeros, count = draw(count)
+        zeros += batch_zeros
+        samples += count
+        bias, lower, upper = bias_interval(zeros, samples, confidence)
+        if precision is not None and (upper - lower) / 2 <= precision:
+            stop = 'precision'
+        elif stop_on_nonzero and (lower > 0 or upper < 0):
+            stop = 'significance'
+        elif max_samples is not None and samples >= max_samples:
+            stop = 'max_samples'
+        else:
+            continue
+        return {'bias': bias, 'interval': (lower, upper), 'samples': samples, 'zeros': zeros,
+                'confidence': confidence, 'stop': stop}
+
+if __name__ == '__main__':
+    from functools import partial
+    from P1.spn import build_spn_tables, spn_encrypt_batch
+    from P4.Observed_bias_4c import sub_dict_encrypt, perm_dict_encrypt
+    attack_tables = build_spn_tables(sub_dict_encrypt, perm_dict_encrypt)
+    # the approximation of Observed_bias_4c.py: input[15] and u_4 bits 0 and 8
+    in_mask, out_mask = 0x0001, 0x8080
+    for key in (0x93E026DE, 0xE5D7F82E):
+        oracle = partial(spn_encrypt_batch, key=key, num_rounds=4, key_length=32, tables=attack_tables,
+                         stop_round=4, stage='u')
+        exact = exact_bias(oracle, in_mask, out_mask)
+        sampled = estimate_bias(oracle, in_mask, out_mask, precision=0.01, seed=1)
+        significant = estimate_bias(oracle, in_mask, out_mask, confidence=0.999, stop_on_nonzero=True, seed=1)
+        print('key %08x: exact bias %s' % (key, exact['bias']))
+        for result in (sampled, significant):
+            print('  estimate %.5f in [%.5f, %.5f] from %s samples (stopped on %s)' %
+                  (result['bias'], *result['interval'], result['samples'], result['stop']))
@@ -0,0 +1,168 @@
+import EC.DES_VALS as vals
+from EC.DES import E_PERM, P_PERM, key_schedule, sboxes_bitsliced, check_rounds
+from P4.sbox_analysis import lat_batch, ddt_batch
+from P4.bias_estimate import sample_bias, BATCH_SIZE
+from common.lazy import lazy_import
+
+np = lazy_import('numpy')
+
+# Linear and differential profiling of the DES S-boxes, and Matsui-style bias estimation over
+# reduced-round DES
+# The eight S-boxes of vals.sbox_array are 4 x 16 tables read with the outer bits of the 6-bit
+# input as the row and the inner four as the column. sbox_lists flattens them into 64-entry
+# lists indexed by the input, which the batch functions of P4.sbox_analysis take as they are.
+#
+# Masks follow Matsui: a 64-bit plaintext mask applies to the block after IP (P_H, the left
+# half, in the high 32 bits and P_L in the low ones) and a ciphertext mask to the block before
+# IP^-1 (C_H = R_r high, C_L = L_r low), the permutations being linear and keyless. Bits are
+# numbered from the right, bit 0 being the least significant, so the 3-round approximation
+#   P_H[7,18,24,29] ^ P_L[15] ^ C_H[7,18,24,29] ^ C_L[15] = K_1[22] ^ K_3[22]
+# is matsui_mask((7, 18, 24, 29), (15,)) on both sides.
+#
+# The bias estimator draws random plaintexts straight in bitsliced form: uniform random bit
+# planes are uniform random blocks, and after IP as well, so there is nothing to transpose. The
+# rounds run on the planes, each side of the approximation is the xor of the planes its mask
+# selects, and the zeros are counted 64 blocks per word, so millions of plaintexts take seconds.
+
+def sbox_lists():
+    """
+    :return: numpy array of shape (8, 64), row i holding S-box i + 1 indexed by its 6-bit input
+    """
+    output = np.empty((8, 64), dtype=np.int64)
+    for i, box in enumerate(vals.sbox_array):
+        for chunk in range(0, 64):
+            output[i, chunk] = box[((chunk >> 4) & 2) | (chunk & 1)][(chunk >> 1) & 0xf]
+    return output
+
+def des_lat():
+    """
+    Linear approximation tables of the eight S-boxes
+    :return: array L of shape (8, 64, 16), L[i, a, b] being the number of 6-bit inputs x for
+             which a.x xor b.S_{i+1}(x) is zero (Matsui's NS_{i+1}(a, b) + 32)
+    """
+    return lat_batch(sbox_lists(), out_bits=4)
+
+def des_ddt():
+    """
+    Difference distribution tables of the eight S-boxes
+    :return: array D of shape (8, 64, 16), D[i, dx, dy] being the number of inputs x for which
+             S_{i+1}(x) xor S_{i+1}(x xor dx) is dy
+    """
+    return ddt_batch(sbox_lists(), out_bits=4)
+
+def best_approximations(count=5):
+    """
+    The strongest linear approximations of the S-boxes
+    :param count: number of approximations to return
+    :return: list of (|bias|, S-box number 1 to 8, input mask, output mask), strongest first
+    """
+    bias = np.abs(des_lat()[:, 1:, 1:] - 32)
+    order = np.argsort(bias, axis=None)[::-1][:count]
+    output = []
+    for box, a, b in zip(*np.unravel_index(order, bias.shape)):
+        output.append((bias[box, a, b] / 64, int(box) + 1, int(a) + 1, int(b) + 1))
+    return output
+
+def matsui_mask(high=(), low=()):
+    """
+    :param high: bit numbers in the left half (P_H or C_H), 0 being the least significant
+    :param low: bit numbers in the right half (P_L or C_L)
+    :return: 64-bit mask
+    """
+    mask = 0
+    for bit in high:
+        mask |= 1 << (32 + bit)
+    for bit in low:
+        mask |= 1 << bit
+    return mask
+
+def mask_planes(mask: int):
+    """
+    :param mask: 64-bit mask
+    :return: numpy array of the indices of the planes it selects, plane 0 being bit 63
+    """
+    return np.array([63 - bit for bit in range(64) if (mask >> bit) & 1], dtype=np.intp)
+
+def popcount(words):
+    """
+    :param words: numpy uint64 array
+    :return: total number of set bits
+    """
+    if hasattr(np, 'bitwise_count'):
+        return int(np.bitwise_count(words).sum(dtype=np.int64))
+    return int(np.unpackbits(np.ascontiguousarray(words).view(np.uint8)).sum(dtype=np.int64))
+
+def rounds_bitsliced(planes, key_masks: list, num_rounds: int):
+    """
+    Run DES rounds over bitsliced blocks, without IP and IP^-1
+    :param planes: uint64 array of shape (64, words), the blocks after IP
+    :param key_masks: subkey lanes from KeySchedule
+    :param num_rounds: number of rounds
+    :return: planes of shape (64, words) of R_r L_r, the blocks before IP^-1
+    """
+    L = planes[:32]
+    R = planes[32:]
+    for i in range(1, num_rounds + 1):
+        L, R = R, L ^ sboxes_bitsliced(R[E_PERM.indices] ^ key_masks[i])[P_PERM.indices]
+    return np.concatenate((R, L))
+
+def count_zeros_bitsliced(planes, output, in_planes, out_planes, count: int):
+    """
+    :param planes: input planes
+    :param output: output planes
+    :param in_planes: plane indices of the input mask, from mask_planes
+    :param out_planes: plane indices of the output mask
+    :param count: number of blocks, at most 64 per word
+    :return: number of blocks for which the two parities are equal
+    """
+    xor = np.bitwise_xor.reduce(planes[in_planes], axis=0) if len(in_planes) else 0
+    if len(out_planes):
+        xor = xor ^ np.bitwise_xor.reduce(output[out_planes], axis=0)
+    if np.isscalar(xor):
+        return count
+    return count - popcount(xor)
+
+def des_bias(in_mask: int, out_mask: int, num_rounds: int, key=None, precision=None, confidence=0.95,
+             stop_on_nonzero=False, max_samples=2**24, batch_size=BATCH_SIZE * 4, seed=None):
+    """
+    Estimate the bias of a linear approximation of reduced-round DES from random plaintexts
+    :param in_mask: 64-bit mask on the plaintext after IP, see matsui_mask
+    :param out_mask: 64-bit mask on the ciphertext before IP^-1
+    :param num_rounds: number of rounds, 3 to 8 being the range of Matsui's approximations
+    :param key: 64-bit key or KeySchedule, a random key if None; the key bits of the
+                approximation only flip the sign of the bias
+    :param precision: stop once the half-width of the interval is at most this
+    :param confidence: confidence level of the interval
+    :param stop_on_nonzero: stop once the interval excludes zero
+    :param max_samples: stop after this many plaintexts whatever the interval
+    :param batch_size: largest number of plaintexts encrypted at a time, a multiple of 64
+    :param seed: seed for the plaintexts and the random key
+    :return: dictionary as returned by P4.bias_estimate.estimate_bias, with the 'key' used
+    """
+    check_rounds(num_rounds)
+    rng = np.random.default_rng(seed)
+    if key is None:
+        key = int(rng.integers(0, 2**64, dtype=np.uint64))
+    key_masks = key_schedule(key).round_key_masks(num_rounds)
+    in_planes, out_planes = mask_planes(in_mask), mask_planes(out_mask)
+
+    def draw(count):
+        words = -(-count // 64)
+        planes = rng.integers(0, 2**64, (64, words), dtype=np.uint64, endpoint=False)
+        output = rounds_bitsliced(planes, key_masks, num_rounds)
+        return count_zeros_bitsliced(planes, output, in_planes, out_planes, 64 * words), 64 * words
+    result = sample_bias(draw, precision, confidence, stop_on_nonzero, max_samples, batch_size, batch_size)
+    result['key'] = key
+    return result
+
+if __name__ == '__main__':
+    lat = des_lat()
+    # Matsui's strongest S-box approximation, NS_5(16, 15) = -20
+    print('NS_5(0x10, 0xf) = %s' % (lat[4, 0x10, 0xf] - 32))
+    print('differential uniformity of S_1 to S_8: %s' % des_ddt()[:, 1:].max(axis=(1, 2)).tolist())
+    for bias, box, a, b in best_approximations(3):
+        print('S_%s: input mask 0x%02x, output mask 0x%x, bias %s' % (box, a, b, bias))
+    mask = matsui_mask((7, 18, 24, 29), (15,))
+    result = des_bias(mask, mask, 3, max_samples=2**20, seed=0)
+    print('3 rounds, P_H[7,18,24,29] ^ P_L[15] ^ C_H[7,18,24,29] ^ C_L[15]: bias %.4f in [%.4f, %.4f] '
+          'from %s plaintexts (Matsui: +-0.195)' % ((result['bias'],) + result['interval'] + (result['samples'],)))
@@ -0,0 +1,144 @@
+from functools import partial
+from P1.spn import spn_tables, spn_encrypt_batch, get_keys_int
+from P4.key_recovery import target_nibbles, gather_nibbles, scatter_nibbles
+from P4.sbox_analysis import chunk_entries
+from common.lazy import lazy_import
+
+np = lazy_import('numpy')
+
+# Chosen-plaintext differential attack against the last round of the SPN
+# A differential is given by an input difference on the plaintext and the difference it is
+# expected to cause on u of the last round (the input of the last s-box layer), e.g. Stinson's
+# 0x0b00 -> 0x0606 through three rounds. Pairs of plaintexts with the input difference are
+# encrypted together; a pair following the differential has a zero ciphertext difference in
+# every nibble where the expected difference is zero, since the last round only substitutes and
+# adds the key nibble by nibble, so all other pairs are dropped at once by a mask test. Every
+# candidate for the subkey nibbles in front of the active last-round s-boxes is counted by
+# partially decrypting the remaining pairs through the inverse s-boxes and checking the
+# difference of u, all candidates together as one gather over (pairs x candidates).
+#
+# Pairs are generated, encrypted, filtered and counted one chunk at a time, and the counting of
+# a chunk is split so that pairs x candidates stays under sbox_analysis.chunk_entries, so memory
+# does not grow with the number of pairs.
+
+def chosen_pairs(encrypt, in_diff: int, num_pairs: int, chunk_size=2**20, seed=None):
+    """
+    Generate ciphertext pairs for plaintext pairs with a fixed difference, in chunks
+    :param encrypt: function from a numpy array of 16-bit plaintexts to the array of
+                    ciphertexts, e.g. spn_oracle(key, ...) or an oracle client's encrypt
+    :param in_diff: xor difference of the plaintexts of every pair
+    :param num_pairs: total number of pairs
+    :param chunk_size: number of pairs per chunk
+    :param seed: seed for the random plaintexts
+    :return: generator of (ciphertexts, ciphertexts of the partner plaintexts) numpy arrays
+    """
+    rng = np.random.default_rng(seed)
+    for start in range(0, num_pairs, chunk_size):
+        plaintexts = rng.integers(0, 2**16, min(chunk_size, num_pairs - start), dtype=np.uint16)
+        # both halves of every pair in one batch
+        ciphertexts = np.asarray(encrypt(np.concatenate((plaintexts, plaintexts ^ np.uint16(in_diff)))))
+        yield ciphertexts[:len(plaintexts)], ciphertexts[len(plaintexts):]
+
+def spn_oracle(key: int, num_rounds: int, tables=spn_tables, key_length=None):
+    """
+    :param key: master key as an integer
+    :param num_rounds: number of spn rounds
+    :param tables: lookup tables from P1.spn.build_spn_tables
+    :param key_length: length of key in bits, defaults to 4 * num_rounds + 16
+    :return: batch encryption function under the key, for chosen_pairs
+    """
+    return partial(spn_encrypt_batch, key=key, num_rounds=num_rounds, key_length=key_length, tables=tables)
+
+def filter_pairs(ciphertexts, partners, out_diff: int):
+    """
+    Drop the pairs which can not follow the differential
+    :param ciphertexts: numpy array of ciphertexts
+    :param partners: numpy array of the ciphertexts of the partner plaintexts
+    :param out_diff: expected difference on u of the last round
+    :return: (ciphertexts, partners) of the pairs whose ciphertext difference is zero in every
+             nibble where out_diff is zero
+    """
+    inactive = 0
+    for j in range(4):
+        if not (out_diff >> (4 * (3 - j))) & 0xf:
+            inactive |= 0xf << (4 * (3 - j))
+    keep = ((np.asarray(ciphertexts) ^ np.asarray(partners)) & inactive) == 0
+    return ciphertexts[keep], partners[keep]
+
+def packed_inverse(nibbles: list, tables=spn_tables):
+    """
+    Inverse s-box over packed target nibbles
+    :param nibbles: nibble positions as returned by target_nibbles
+    :param tables: lookup tables from P1.spn.build_spn_tables
+    :return: numpy int64 array t, t[x] applying the inverse s-box to every nibble of x
+    """
+    s_inv = np.array(tables['s_inv'], dtype=np.int64)
+    output = np.zeros(1, dtype=np.int64)
+    for _ in nibbles:
+        output = ((output[:, np.newaxis] << 4) | s_inv[np.newaxis, :]).ravel()
+    return output
+
+def differential_counts(pairs, out_diff: int, tables=spn_tables, chunk_size=2**20):
+    """
+    Count the pairs following the differential under every candidate partial subkey
+    :param pairs: iterable of (ciphertexts, partners) numpy arrays, of any length
+    :param out_diff: expected difference on u of the last round
+    :param tables: lookup tables from P1.spn.build_spn_tables
+    :param chunk_size: largest number of pairs handled at once
+    :return: (counts, number of pairs, number of pairs left by the filter), counts being indexed
+             by the packed candidate subkey nibbles
+    """
+    nibbles = target_nibbles(out_diff)
+    if not nibbles:
+        raise ValueError('The expected difference must not be zero.')
+    s_inv = packed_inverse(nibbles, tables)
+    expected = int(gather_nibbles(np.array([out_diff]), nibbles)[0])
+    candidates = np.arange(len(s_inv), dtype=np.int64)
+    counts = np.zeros(len(s_inv), dtype=np.int64)
+    total = kept = 0
+    # pairs per counting step, so that the (pairs x candidates) arrays stay bounded
+    step = max(1, chunk_entries // len(candidates))
+    for ciphertexts, partners in pairs:
+        for start in range(0, len(ciphertexts), chunk_size):
+            c, c_star = filter_pairs(ciphertexts[start:start + chunk_size], partners[start:start + chunk_size],
+                                     out_diff)
+            total += min(chunk_size, len(ciphertexts) - start)
+            kept += len(c)
+            c = gather_nibbles(c, nibbles)
+            c_star = gather_nibbles(c_star, nibbles)
+            for i in range(0, len(c), step):
+                u = s_inv[c[i:i + step, np.newaxis] ^ candidates]
+                u_star = s_inv[c_star[i:i + step, np.newaxis] ^ candidates]
+                counts += np.count_nonzero((u ^ u_star) == expected, axis=0)
+    return counts, total, kept
+
+def recover_subkey(pairs, out_diff: int, tables=spn_tables, chunk_size=2**20, num_candidates=None):
+    """
+    Rank candidate last-round partial subkeys by the number of pairs following the differential
+    :param pairs: iterable of (ciphertexts, partners) numpy arrays, e.g. from chosen_pairs
+    :param out_diff: expected difference on u of the last round
+    :param tables: lookup tables from P1.spn.build_spn_tables
+    :param chunk_size: largest number of pairs handled at once
+    :param num_candidates: number of candidates to return, all of them if not given
+    :return: list of (partial subkey, estimated probability of the differential), most likely
+             first; the subkey is a 16-bit value with the candidate nibbles in place and zeroes
+             elsewhere
+    """
+    counts, total, _ = differential_counts(pairs, out_diff, tables, chunk_size)
+    if not total:
+        raise ValueError('No ciphertext pairs were given.')
+    order = np.argsort(-counts, kind='stable')[:num_candidates]
+    nibbles = target_nibbles(out_diff)
+    return [(scatter_nibbles(int(k), nibbles), int(counts[k]) / total) for k in order]
+
+if __name__ == '__main__':
+    num_rounds = 4
+    key = 0x3A94D63F
+    # Stinson's differential through three rounds, probability 27/1024
+    in_diff, out_diff = 0x0b00, 0x0606
+    pairs = chosen_pairs(spn_oracle(key, num_rounds), in_diff, 5000, seed=1)
+    ranking = recover_subkey(pairs, out_diff, num_candidates=5)
+    last_key = get_keys_int(key, num_rounds + 1)[num_rounds]
+    print('Actual last round key: %04x, target bits %04x' % (last_key, last_key & 0x0f0f))
+    for subkey, probability in ranking:
+        print('candidate %04x: probability %s' % (subkey, probability))
@@ -0,0 +1,170 @@
+from P1.spn import spn_tables, spn_encrypt_batch, get_keys_int
+from P4.sbox_analysis import fwht, parity_table
+from common.lazy import lazy_import
+
+np = lazy_import('numpy')
+
+# Matsui's Algorithm 2 against the last round of the SPN
+# A linear approximation is given by a mask on the plaintext and a mask on u of the last round
+# (the input of the last s-box layer), e.g. the 'input_mask' and 'output_mask' of a trail from
+# linear_trail.search_linear_trails. Every candidate for the subkey bits in front of the active
+# last-round s-boxes is tested by partially decrypting the ciphertexts through the inverse
+# s-box and counting how often the approximation holds.
+#
+# The pairs are reduced to a histogram over (target ciphertext bits, plaintext parity) one chunk
+# at a time, so memory does not grow with the number of pairs. The counts for all candidates are
+# then a single xor-convolution of that histogram with the partial decryption, done with the
+# fast Walsh-Hadamard transform.
+#
+# The block width is a parameter throughout, so the wide presets of P1.spn_cipher work as well:
+# pass their plaintext/ciphertext pairs, block_bits and tables={'s_inv': spn.s_inv}. The last
+# round is assumed to end with the key XOR after the s-boxes, as in Stinson's SPN; for PRESENT
+# undo the final permutation on the ciphertexts (spn.perm_inv) first.
+
+def target_nibbles(out_mask: int, block_bits=16):
+    """
+    Find the last-round s-boxes touched by a mask on u of the last round
+    :param out_mask: mask on u of the last round
+    :param block_bits: number of bits in the block
+    :return: list of nibble positions, 0 being the most significant nibble
+    """
+    n = block_bits // 4
+    return [j for j in range(n) if (out_mask >> (4 * (n - 1 - j))) & 0xf]
+
+def gather_nibbles(values, nibbles: list, block_bits=16):
+    """
+    Pack the given nibbles of every value into one integer, first nibble most significant
+    :param values: numpy array of blocks
+    :param nibbles: nibble positions as returned by target_nibbles
+    :param block_bits: number of bits in the block
+    :return: numpy int64 array
+    """
+    n = block_bits // 4
+    values = np.asarray(values).astype(np.int64)
+    output = np.zeros(values.shape, dtype=np.int64)
+    for j in nibbles:
+        output = (output << 4) | ((values >> (4 * (n - 1 - j))) & 0xf)
+    return output
+
+def scatter_nibbles(value: int, nibbles: list, block_bits=16):
+    """
+    Inverse of gather_nibbles for a single integer, other nibbles are zero
+    :param value: packed nibbles
+    :param nibbles: nibble positions as returned by target_nibbles
+    :param block_bits: number of bits in the block
+    :return: block with the nibbles in place
+    """
+    n = block_bits // 4
+    output = 0
+    for i, j in enumerate(reversed(nibbles)):
+        output |= ((value >> (4 * i)) & 0xf) << (4 * (n - 1 - j))
+    return output
+
+def known_pairs(key: int, num_rounds: int, num_pairs: int, tables=spn_tables, key_length=None,
+                chunk_size=2**20, seed=None):
+    """
+    Generate random known plaintext/ciphertext pairs in chunks
+    :param key: master key as an integer
+    :param num_rounds: number of spn rounds
+    :param num_pairs: total number of pairs
+    :param tables: lookup tables from P1.spn.build_spn_tables
+    :param key_length: length of key in bits, defaults to 4 * num_rounds + 16
+    :param chunk_size: number of pairs per chunk
+    :param seed: seed for the random plaintexts
+    :return: generator of (plaintexts, ciphertexts) numpy arrays
+    """
+    rng = np.random.default_rng(seed)
+    for start in range(0, num_pairs, chunk_size):
+        plaintexts = rng.integers(0, 2**16, min(chunk_size, num_pairs - start), dtype=np.uint16)
+        yield plaintexts, spn_encrypt_batch(plaintexts, key, num_rounds, key_length, tables)
+
+def linear_histogram(pairs, in_mask: int, out_mask: int, chunk_size=2**20, block_bits=16):
+    """
+    Reduce a stream of pairs to signed counts over the target ciphertext bits
+    :param pairs: iterable of (plaintexts, ciphertexts) numpy arrays, of any length
+    :param in_mask: mask on the plaintext
+    :param out_mask: mask on u of the last round
+    :param chunk_size: largest number of pairs handled at once
+    :param block_bits: number of bits in the block, at most 64
+    :return: (histogram, number of pairs), histogram[c] being the number of pairs with target
+             ciphertext bits c and even plaintext parity minus the number with odd parity
+    """
+    nibbles = target_nibbles(out_mask, block_bits)
+    parity = parity_table(16)
+    histogram = np.zeros(16**len(nibbles), dtype=np.int64)
+    total = 0
+    for plaintexts, ciphertexts in pairs:
+        for start in range(0, len(plaintexts), chunk_size):
+            p = np.asarray(plaintexts[start:start + chunk_size]).astype(np.uint64) & np.uint64(in_mask)
+            # fold wider blocks down to 16 bits, which keeps the parity
+            for shift in (32, 16):
+                if block_bits > shift:
+                    p ^= p >> np.uint64(shift)
+            c = gather_nibbles(ciphertexts[start:start + chunk_size], nibbles, block_bits)
+            odd = parity[(p & np.uint64(0xffff)).astype(np.intp)].astype(bool)
+            histogram += np.bincount(c[~odd], minlength=len(histogram))
+            histogram -= np.bincount(c[odd], minlength=len(histogram))
+            total += len(p)
+    return histogram, total
+
+def candidate_counts(histogram, total: int, out_mask: int, tables=spn_tables, block_bits=16):
+    """
+    Count how often the approximation holds for every candidate partial subkey
+    :param histogram: signed histogram from linear_histogram
+    :param total: number of pairs behind the histogram
+    :param out_mask: mask on u of the last round
+    :param tables: lookup tables from P1.spn.build_spn_tables, or any dictionary with the
+                   inverse s-box as 's_inv'
+    :param block_bits: number of bits in the block
+    :return: numpy array of zero counts indexed by the packed candidate subkey nibbles
+    """
+    n = block_bits // 4
+    nibbles = target_nibbles(out_mask, block_bits)
+    masks = [(out_mask >> (4 * (n - 1 - j))) & 0xf for j in nibbles]
+    parity = parity_table(4)
+    s_inv = np.array(tables['s_inv'])
+    # g[x] = (-1)^(parity of S^-1(x) under the mask) for the packed target nibbles x
+    g = np.ones(1, dtype=np.int64)
+    for mask in masks:
+        g = np.outer(g, 1 - 2 * parity[s_inv & mask].astype(np.int64)).ravel()
+    # sum over c of histogram[c] * g[c xor k], for every k at once
+    correlation = fwht(fwht(histogram) * fwht(g)) // len(g)
+    return (total + correlation) // 2
+
+def recover_subkey(pairs, in_mask: int, out_mask: int, tables=spn_tables, chunk_size=2**20,
+                   num_candidates=None, block_bits=16):
+    """
+    Rank candidate last-round partial subkeys with Matsui's Algorithm 2
+    :param pairs: iterable of (plaintexts, ciphertexts) numpy arrays
+    :param in_mask: mask on the plaintext
+    :param out_mask: mask on u of the last round
+    :param tables: lookup tables from P1.spn.build_spn_tables, see candidate_counts
+    :param chunk_size: largest number of pairs handled at once
+    :param num_candidates: number of candidates to return, all of them if not given
+    :param block_bits: number of bits in the block, at most 64
+    :return: list of (partial subkey, observed bias), largest |bias| first; the subkey is a
+             block_bits value with the candidate nibbles in place and zeroes elsewhere
+    """
+    histogram, total = linear_histogram(pairs, in_mask, out_mask, chunk_size, block_bits)
+    if not total:
+        raise ValueError('No plaintext/ciphertext pairs were given.')
+    counts = candidate_counts(histogram, total, out_mask, tables, block_bits)
+    bias = counts / total - 0.5
+    order = np.argsort(-np.abs(bias), kind='stable')[:num_candidates]
+    nibbles = target_nibbles(out_mask, block_bits)
+    return [(scatter_nibbles(int(k), nibbles, block_bits), float(bias[k])) for k in order]
+
+if __name__ == '__main__':
+    from P1.spn import build_spn_tables
+    from P4.Observed_bias_4c import sub_dict_encrypt, perm_dict_encrypt
+    attack_tables = build_spn_tables(sub_dict_encrypt, perm_dict_encrypt)
+    num_rounds = 4
+    key = 0x93E026DE
+    # the approximation used in Observed_bias_4c.py: input[15] and u_4 bits 0 and 8
+    in_mask, out_mask = 0x0001, 0x8080
+    pairs = known_pairs(key, num_rounds, 2**18, attack_tables, seed=1)
+    ranking = recover_subkey(pairs, in_mask, out_mask, attack_tables, num_candidates=5)
+    last_key = get_keys_int(key, num_rounds + 1)[num_rounds]
+    print('Actual last round key: %04x, target bits %04x' % (last_key, last_key & 0xf0f0))
+    for subkey, bias in ranking:
+        print('candidate %04x: bias %s' % (subkey, bias))
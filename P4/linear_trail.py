@@ -0,0 +1,211 @@
+import math
+from P1.spn import permutation_map
+from common.permutation import compile_permutation
+from common.lazy import lazy_import
+
+np = lazy_import('numpy')
+
+# Branch-and-bound search for linear trails through the SPN
+# A trail over r rounds is a list of (input mask, output mask) pairs for the s-box layers of
+# rounds 1 to r, where the input mask of round i+1 is the output mask of round i sent through
+# the permutation. Masks are integers with bit 1 of the Stinson numbering as the most
+# significant bit, so a trail over num_rounds - 1 rounds gives masks on the plaintext and on
+# u of the last round, as used in Observed_bias_4c.py.
+# Trails are ranked by weight, the sum of -log2|c| over the active s-boxes where c = 2 * bias,
+# so by the piling-up lemma the bias of a trail is +-2**(-weight) / 2.
+
+# tolerance used when comparing weights
+weight_eps = 1e-9
+
+def build_trail_tables(lat_table, perm=permutation_map, block_bits=16):
+    """
+    Precompute the s-box transitions used by the trail search
+    :param lat_table: linear approximation table of zero counts, as returned by sbox_analysis.lat
+    :param perm: permutation in any form accepted by compile_permutation
+    :param block_bits: number of bits in the block
+    :return: dictionary of tables
+    """
+    lat_table = np.asarray(lat_table)
+    size = lat_table.shape[0]
+    sbox_bits = size.bit_length() - 1
+    if block_bits % sbox_bits:
+        raise ValueError('Block size must be a multiple of the s-box size.')
+    corr = 2 * lat_table / size - 1
+    # transitions[a] lists (weight, output mask, correlation) for input mask a, best first
+    transitions = [[] for _ in range(size)]
+    # best_input[b] is (weight, input mask, correlation) of the best transition ending in b
+    best_input = [(math.inf, 0, 0.0)] * size
+    for a in range(1, size):
+        for b in range(1, corr.shape[1]):
+            if corr[a][b] == 0:
+                continue
+            weight = -math.log2(abs(corr[a][b]))
+            transitions[a].append((weight, b, float(corr[a][b])))
+            if weight < best_input[b][0]:
+                best_input[b] = (weight, a, float(corr[a][b]))
+        transitions[a].sort()
+    return {
+        'sbox_bits': sbox_bits, 'block_bits': block_bits,
+        'num_sboxes': block_bits // sbox_bits, 'perm': compile_permutation(perm, block_bits),
+        'transitions': transitions, 'best_input': best_input,
+    }
+
+def split_mask(mask: int, tables: dict):
+    """
+    Split a block mask into s-box masks, the first s-box being the most significant
+    :param mask: block mask
+    :param tables: tables from build_trail_tables
+    :return: list of s-box masks
+    """
+    bits = tables['sbox_bits']
+    n = tables['num_sboxes']
+    return [(mask >> (bits * (n - 1 - j))) & ((1 << bits) - 1) for j in range(n)]
+
+def first_round_masks(tables: dict):
+    """
+    Weights of every output mask of the first s-box layer, taking the best input mask for it
+    :param tables: tables from build_trail_tables
+    :return: (output masks sorted by weight, their weights)
+    """
+    bits = tables['sbox_bits']
+    masks = np.arange(1, 2**tables['block_bits'])
+    in_weights = np.array([w for w, _, _ in tables['best_input']])
+    in_weights[0] = 0
+    weights = np.zeros(len(masks))
+    for j in range(tables['num_sboxes']):
+        weights += in_weights[(masks >> (bits * j)) & ((1 << bits) - 1)]
+    order = np.argsort(weights, kind='stable')
+    keep = np.isfinite(weights[order])
+    return masks[order][keep], weights[order][keep]
+
+def search_linear_trails(tables: dict, num_rounds: int, num_trails=1, bounds=None):
+    """
+    Find the highest-bias linear trails over a number of s-box layers
+    :param tables: tables from build_trail_tables
+    :param num_rounds: number of s-box layers covered by the trail
+    :param num_trails: number of trails to return
+    :param bounds: best trail weights for fewer rounds, bounds[i] for i rounds; worked out
+                   recursively if not given
+    :return: list of trails, best first, each a dictionary with the keys
+             'rounds' - list of (input mask, output mask) per round
+             'input_mask' - mask on the plaintext
+             'output_mask' - mask on u of the round after the trail
+             'active_sboxes', 'weight' and 'bias' (signed, from the piling-up lemma)
+    """
+    if num_rounds < 1:
+        raise ValueError('A trail needs at least one round.')
+    if bounds is None:
+        bounds = [0.0]
+        for r in range(1, num_rounds):
+            bounds.append(search_linear_trails(tables, r, 1, bounds)[0]['weight'])
+    transitions = tables['transitions']
+    bits = tables['sbox_bits']
+    n = tables['num_sboxes']
+    perm = tables['perm']
+    block_bits = tables['block_bits']
+    out_masks, out_weights = first_round_masks(tables)
+
+    found = []
+    # failed[(rounds left, mask)] is the largest budget for which nothing was found from there
+    failed = {}
+
+    def threshold(estimate):
+        if len(found) < num_trails:
+            return estimate
+        return min(estimate, found[-1][0])
+
+    def record(weight, trail, count, corr):
+        found.append((weight, trail, count, corr))
+        found.sort(key=lambda item: item[0])
+        del found[num_trails:]
+
+    def layer(mask, round_number, weight, trail, count, corr, estimate):
+        # enumerate output masks of the s-box layer for input mask, one s-box at a time
+        rounds_left = num_rounds - round_number
+        active = [(j, a) for j, a in enumerate(split_mask(mask, tables)) if a]
+        hit = [False]
+
+        def choose(i, out_mask, w, c):
+            if w + bounds[rounds_left] > threshold(estimate) + weight_eps:
+                return
+            if i == len(active):
+                next_mask = perm(out_mask)
+                step = trail + [(mask, out_mask)]
+                if extend(next_mask, round_number + 1, w, step, count + len(active), corr * c, estimate):
+                    hit[0] = True
+                return
+            j, a = active[i]
+            for t_weight, b, t_corr in transitions[a]:
+                if w + t_weight + bounds[rounds_left] > threshold(estimate) + weight_eps:
+                    break
+                choose(i + 1, out_mask | (b << (bits * (n - 1 - j))), w + t_weight, c * t_corr)
+
+        choose(0, 0, weight, 1.0)
+        return hit[0]
+
+    def extend(mask, round_number, weight, trail, count, corr, estimate):
+        if round_number > num_rounds:
+            record(weight, trail, count, corr)
+            return True
+        rounds_left = num_rounds - round_number + 1
+        if failed.get((rounds_left, mask), -math.inf) >= threshold(estimate) - weight - weight_eps:
+            return False
+        hit = layer(mask, round_number, weight, trail, count, corr, estimate)
+        if not hit:
+            # the threshold only goes down, so the whole subtree was searched up to its final value
+            budget = threshold(estimate) - weight
+            failed[(rounds_left, mask)] = max(failed.get((rounds_left, mask), -math.inf), budget)
+        return hit
+
+    # Matsui's estimate: start just above the lower bound and raise it until enough trails are found
+    estimate = bounds[num_rounds - 1] + min(out_weights[0], 1.0)
+    while True:
+        found.clear()
+        failed.clear()
+        for b, w1 in zip(out_masks.tolist(), out_weights.tolist()):
+            if w1 + bounds[num_rounds - 1] > threshold(estimate) + weight_eps:
+                break
+            count = 0
+            corr = 1.0
+            in_mask = 0
+            for j, b_j in enumerate(split_mask(b, tables)):
+                if b_j:
+                    _, a_j, c_j = tables['best_input'][b_j]
+                    in_mask |= a_j << (bits * (n - 1 - j))
+                    count += 1
+                    corr *= c_j
+            next_mask = perm(b)
+            extend(next_mask, 2, w1, [(in_mask, b)], count, corr, estimate)
+        if len(found) >= num_trails or estimate > 2 * block_bits * num_rounds:
+            break
+        estimate += 1.0
+
+    output = []
+    for weight, trail, count, corr in found:
+        output.append({
+            'rounds': trail,
+            'input_mask': trail[0][0],
+            'output_mask': perm(trail[-1][1]),
+            'active_sboxes': count,
+            'weight': weight,
+            'bias': corr / 2,
+        })
+    return output
+
+def mask_bits(mask: int, block_bits=16):
+    """
+    List the bit positions set in a mask, numbered from 0 at the most significant bit
+    :param mask: block mask
+    :param block_bits: number of bits in the block
+    :return: list of bit positions, as used to index a BitArray
+    """
+    return [i for i in range(block_bits) if (mask >> (block_bits - 1 - i)) & 1]
+
+if __name__ == '__main__':
+    from P4.Observed_bias_4c import sub_dict_encrypt, perm_dict_encrypt
+    from P4.sbox_analysis import lat
+    trail_tables = build_trail_tables(lat(sub_dict_encrypt), perm_dict_encrypt)
+    for trail in search_linear_trails(trail_tables, 3, num_trails=5):
+        print('input bits %s, output (u_4) bits %s, active s-boxes %s, bias %s'
+              % (mask_bits(trail['input_mask']), mask_bits(trail['output_mask']),
+                 trail['active_sboxes'], trail['bias']))
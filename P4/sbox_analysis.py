@@ -0,0 +1,204 @@
+from __future__ import annotations
+from P1.spn import sbox_to_list
+from common.lazy import lazy_import
+
+np = lazy_import('numpy')
+
+# Vectorized s-box analysis
+# S-boxes can be given as dictionaries in the form of s_box / sub_dict_encrypt (keys are hex
+# digits) or as lists/arrays indexed by integers. The batch functions take many s-boxes of
+# the same size at once, as a 2-D array with one s-box per row or as a list of dictionaries.
+
+# number of table entries computed per chunk in the batch functions, bounds the memory used
+chunk_entries = 2**22
+
+def sbox_batch_array(sboxes):
+    """
+    Convert one or many s-boxes into a 2-D array with one s-box per row
+    :param sboxes: an s-box, a list of s-boxes or a 2-D array
+    :return: integer numpy array of shape (number of s-boxes, 2**n)
+    """
+    if isinstance(sboxes, dict):
+        sboxes = [sboxes]
+    elif len(sboxes) and isinstance(sboxes[0], dict):
+        sboxes = [sbox_to_list(sbox) for sbox in sboxes]
+    output = np.asarray(sboxes, dtype=np.int64)
+    if output.ndim == 1:
+        output = output[np.newaxis, :]
+    size = output.shape[1]
+    if output.ndim != 2 or size < 2 or size & (size - 1):
+        raise ValueError('S-boxes must have 2**n entries.')
+    if output.min() < 0:
+        raise ValueError('S-box entries must not be negative.')
+    return output
+
+def sbox_sizes(sboxes: np.ndarray, out_bits=None):
+    """
+    Get the number of input and output bits of a batch of s-boxes
+    :param sboxes: array returned by sbox_batch_array
+    :param out_bits: number of output bits, worked out from the largest entry if not given
+    :return: (input bits, output bits)
+    """
+    in_bits = sboxes.shape[1].bit_length() - 1
+    needed = max(int(sboxes.max()).bit_length(), 1)
+    if out_bits is None:
+        out_bits = max(in_bits, needed)
+    elif out_bits < needed:
+        raise ValueError('S-box entries do not fit in %s bits.' % out_bits)
+    return in_bits, out_bits
+
+def parity_table(bits: int):
+    """
+    Parity of every integer below 2**bits
+    :param bits: number of bits
+    :return: numpy array whose element i is the xor of the bits of i
+    """
+    output = np.zeros(1, dtype=np.int8)
+    for _ in range(bits):
+        output = np.concatenate((output, output ^ 1))
+    return output
+
+def fwht(data, axis=-1):
+    """
+    Fast Walsh-Hadamard transform (unnormalized) along one axis
+    :param data: array whose length along axis is a power of two
+    :param axis: axis to transform
+    :return: transformed copy of data, element a is sum over x of (-1)^(a.x) * data[x]
+    """
+    output = np.moveaxis(np.array(data), axis, -1)
+    shape = output.shape
+    size = shape[-1]
+    if size & (size - 1):
+        raise ValueError('Transform length must be a power of two.')
+    h = 1
+    while h < size:
+        # pair up index i with index i + h for every i with bit h clear
+        output = output.reshape(shape[:-1] + (size // (2 * h), 2, h))
+        x = output[..., 0, :]
+        y = output[..., 1, :]
+        output = np.stack((x + y, x - y), axis=-2)
+        h *= 2
+    return np.moveaxis(output.reshape(shape), -1, axis)
+
+def walsh_batch(sboxes, out_bits=None):
+    """
+    Walsh spectra of many s-boxes
+    :param sboxes: s-boxes accepted by sbox_batch_array
+    :param out_bits: number of output bits, worked out from the entries if not given
+    :return: int32 array W of shape (number of s-boxes, 2**n, 2**m), where W[i, a, b] is the
+             sum over x of (-1)^(a.x xor b.S_i(x))
+    """
+    sboxes = sbox_batch_array(sboxes)
+    in_bits, out_bits = sbox_sizes(sboxes, out_bits)
+    parity = parity_table(out_bits)
+    out_masks = np.arange(2**out_bits)
+    output = np.empty((sboxes.shape[0], 2**in_bits, 2**out_bits), dtype=np.int32)
+    chunk = max(1, chunk_entries // (2**in_bits * 2**out_bits))
+    for start in range(0, sboxes.shape[0], chunk):
+        block = sboxes[start:start + chunk]
+        # signs[i, x, b] = (-1)^(b.S_i(x)), then transform over x
+        signs = 1 - 2 * parity[block[:, :, np.newaxis] & out_masks].astype(np.int32)
+        output[start:start + chunk] = fwht(signs, axis=1)
+    return output
+
+def lat_batch(sboxes, out_bits=None):
+    """
+    Linear approximation tables of many s-boxes, counting zeroes as in spn_NL_table.py
+    :param sboxes: s-boxes accepted by sbox_batch_array
+    :param out_bits: number of output bits, worked out from the entries if not given
+    :return: array L of shape (number of s-boxes, 2**n, 2**m), where L[i, a, b] is the number
+             of inputs x for which a.x xor b.S_i(x) is zero
+    """
+    walsh = walsh_batch(sboxes, out_bits)
+    return (walsh + walsh.shape[1]) // 2
+
+def lat(sbox, out_bits=None):
+    """
+    Linear approximation table of a single s-box
+    :param sbox: s-box dictionary or list
+    :param out_bits: number of output bits, worked out from the entries if not given
+    :return: 2-D array of zero counts, indexed by [input mask, output mask]
+    """
+    return lat_batch([sbox] if isinstance(sbox, dict) else [list(sbox)], out_bits)[0]
+
+def ddt_batch(sboxes, out_bits=None):
+    """
+    Difference distribution tables of many s-boxes
+    :param sboxes: s-boxes accepted by sbox_batch_array
+    :param out_bits: number of output bits, worked out from the entries if not given
+    :return: array D of shape (number of s-boxes, 2**n, 2**m), where D[i, dx, dy] is the number
+             of inputs x for which S_i(x) xor S_i(x xor dx) is dy
+    """
+    sboxes = sbox_batch_array(sboxes)
+    in_bits, out_bits = sbox_sizes(sboxes, out_bits)
+    xs = np.arange(2**in_bits)
+    # partner[dx, x] = x xor dx
+    partner = xs[:, np.newaxis] ^ xs
+    table_size = 2**in_bits * 2**out_bits
+    output = np.empty((sboxes.shape[0], 2**in_bits, 2**out_bits), dtype=np.int32)
+    chunk = max(1, chunk_entries // table_size)
+    for start in range(0, sboxes.shape[0], chunk):
+        block = sboxes[start:start + chunk]
+        out_diff = block[:, np.newaxis, :] ^ block[:, partner]
+        # flat index of (s-box, dx, dy) so one bincount fills every table in the chunk
+        index = (np.arange(block.shape[0])[:, np.newaxis, np.newaxis] * 2**in_bits
+                 + xs[:, np.newaxis]) * 2**out_bits + out_diff
+        counts = np.bincount(index.ravel(), minlength=block.shape[0] * table_size)
+        output[start:start + chunk] = counts.reshape(block.shape[0], 2**in_bits, 2**out_bits)
+    return output
+
+def ddt(sbox, out_bits=None):
+    """
+    Difference distribution table of a single s-box
+    :param sbox: s-box dictionary or list
+    :param out_bits: number of output bits, worked out from the entries if not given
+    :return: 2-D array of counts, indexed by [input difference, output difference]
+    """
+    return ddt_batch([sbox] if isinstance(sbox, dict) else [list(sbox)], out_bits)[0]
+
+def best_differentials(tables):
+    """
+    Find the most likely output difference for every input difference
+    :param tables: a DDT from ddt or a batch of DDTs from ddt_batch
+    :return: (output differences, counts, probabilities), each indexed by [..., input difference]
+    """
+    tables = np.asarray(tables)
+    best_out = tables.argmax(axis=-1)
+    counts = np.take_along_axis(tables, best_out[..., np.newaxis], axis=-1)[..., 0]
+    return best_out, counts, counts / tables.shape[-2]
+
+def screen_sboxes(sboxes, out_bits=None):
+    """
+    Linear and differential figures of merit for many s-boxes in one pass
+    :param sboxes: s-boxes accepted by sbox_batch_array
+    :param out_bits: number of output bits, worked out from the entries if not given
+    :return: dictionary of arrays with one entry per s-box:
+             'linearity' - largest |W[a, b]| over non-zero output masks b
+             'max_bias' - linearity / 2**(n + 1), the largest bias of a linear approximation
+             'differential_uniformity' - largest DDT entry over non-zero input differences
+             'max_probability' - differential_uniformity / 2**n
+    """
+    sboxes = sbox_batch_array(sboxes)
+    size = sboxes.shape[1]
+    linearity = np.abs(walsh_batch(sboxes, out_bits)[:, :, 1:]).max(axis=(1, 2))
+    uniformity = ddt_batch(sboxes, out_bits)[:, 1:, :].max(axis=(1, 2))
+    return {
+        'linearity': linearity,
+        'max_bias': linearity / (2 * size),
+        'differential_uniformity': uniformity,
+        'max_probability': uniformity / size,
+    }
+
+if __name__ == '__main__':
+    from P1.spn import s_box
+    from P4.Observed_bias_4c import sub_dict_encrypt
+    names = ['P1 s_box', 'P4 sub_dict_encrypt']
+    results = screen_sboxes([s_box, sub_dict_encrypt])
+    for i, name in enumerate(names):
+        print('%s: max bias %s, differential uniformity %s'
+              % (name, results['max_bias'][i], results['differential_uniformity'][i]))
+    for name, sbox in zip(names, [s_box, sub_dict_encrypt]):
+        best_out, counts, _ = best_differentials(ddt(sbox))
+        print('\nBest differentials for %s (input difference -> output difference: count):' % name)
+        for dx in range(1, len(best_out)):
+            print('%x -> %x: %s' % (dx, best_out[dx], counts[dx]))
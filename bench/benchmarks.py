@@ -0,0 +1,236 @@
+import argparse
+import ast
+import json
+import os
+import platform
+import sys
+import time
+import numpy as np
+from bitstring import BitArray
+
+# Benchmarks of the cipher and analysis hot paths
+# Every benchmark times one function call handling a known number of blocks (or tables, or key
+# schedules) and reports ns per block and blocks per second. The known-answer checks below run
+# first and nothing is timed if one of them fails. Results can be written as JSON and compared
+# against a stored baseline (bench/baseline.json by default), the run failing when a benchmark
+# got slower than the baseline by more than the threshold. Timings depend on the machine, so
+# save a fresh baseline with --save-baseline before comparing on another one.
+#
+#   python -m bench.benchmarks [--quick] [--filter des] [--json out.json] [--threshold 0.25]
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+NL_TABLE = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'P4', 'NL_table+test.txt')
+
+def load_modules():
+    """
+    Import the modules under test
+    :return: dictionary of module name to module
+    """
+    import EC.DES as DES
+    import P1.spn as spn
+    import P4.Observed_bias_4c as observed_bias
+    import P4.sbox_analysis as sbox_analysis
+    return {'DES': DES, 'spn': spn, 'observed_bias': observed_bias, 'sbox_analysis': sbox_analysis}
+
+def expected_lat():
+    """
+    :return: the linear approximation table stored in P4/NL_table+test.txt
+    """
+    with open(NL_TABLE) as f:
+        text = f.read()
+    return ast.literal_eval(text[:text.index(']]') + 2])
+
+def bias_sweep(m: dict, key: int):
+    """
+    The full-codebook sweep of Observed_bias_4c.py for one key
+    :param m: modules from load_modules
+    :param key: 32-bit key
+    :return: number of inputs for which the approximation holds
+    """
+    inputs = np.arange(2**16, dtype=np.uint16)
+    output = m['spn'].spn_encrypt_batch(inputs, key, 4, key_length=32, tables=m['bias_tables'],
+                                        stop_round=4, stage='u')
+    return int(np.count_nonzero((((output >> 15) ^ (output >> 7) ^ inputs) & 1) == 0))
+
+def check_vectors(m: dict):
+    """
+    Known-answer checks of everything benchmarked
+    :param m: modules from load_modules
+    :return: list of the names of the failed checks
+    """
+    DES, spn = m['DES'], m['spn']
+    des_key = BitArray('0x133457799BBCDFF1')
+    des_plaintext = BitArray('0x0123456789abcdef')
+    rng = np.random.default_rng(0)
+    blocks = rng.integers(0, 2**64, 300, dtype=np.uint64)
+    codebook = np.arange(2**16)
+    checks = {
+        # Stinson 3.2, the example of P1/spn.py
+        'spn decrypt': spn.spn_process(BitArray('0xF5B2'), BitArray('0x8FA507'), encrypt=False).uint == 0xb33c,
+        'spn encrypt': spn.spn_process(BitArray('0xB33C'), BitArray('0x8FA507')).uint == 0xf5b2,
+        'spn batch': all(spn.spn_encrypt_batch(codebook[::997], 0x8FA507)[i] ==
+                         spn.spn_process_int(int(x), 0x8FA507) for i, x in enumerate(codebook[::997])),
+        # zero counts printed by Observed_bias_4c.py
+        'observed bias': (bias_sweep(m, 0x93E026DE), bias_sweep(m, 0xE5D7F82E)) == (29056, 28288),
+        'lat': m['sbox_analysis'].lat(m['observed_bias'].sub_dict_encrypt).tolist() == expected_lat(),
+        # http://page.math.tu-berlin.de/~kant/teaching/hess/krypto-ws2006/des.htm
+        'do_f': DES.do_f(BitArray('0xF0AAF0AA'), BitArray('0x1B02EFFC7072')).uint == 0x234AA9BB,
+        'get_subkeys': [k.uint for k in DES.get_subkeys(des_key)][1] == 0x1B02EFFC7072,
+        'DES_encrypt': DES.DES_encrypt(des_plaintext, des_key).hex == '85e813540f0ab405',
+        'DES_decrypt': DES.DES_decrypt(BitArray('0x85e813540f0ab405'), des_key).uint == des_plaintext.uint,
+        # the example at the end of EC/DES.py
+        'DES_encrypt script': DES.DES_encrypt_int(0x2567CDB3FDCE7E2A, 0xE567CDB3FDCE7F2A) == 0x6039863c89412f73,
+        'DES batch': [int(c) for c in DES.DES_encrypt_batch(blocks, des_key.uint)] ==
+                     [DES.DES_encrypt_int(int(x), des_key.uint) for x in blocks],
+        'DES keys': [int(c) for c in DES.DES_encrypt_keys(des_plaintext.uint, blocks)] ==
+                    [DES.DES_encrypt_int(des_plaintext.uint, int(k)) for k in blocks],
+    }
+    return [name for name, ok in checks.items() if not ok]
+
+def benchmarks(m: dict):
+    """
+    The benchmarks, as (name, function, blocks per call)
+    :param m: modules from load_modules
+    :return: list of tuples
+    """
+    DES, spn, sbox_analysis = m['DES'], m['spn'], m['sbox_analysis']
+    rng = np.random.default_rng(1)
+    spn_key = BitArray('0x8FA507')
+    spn_block = BitArray('0xB33C')
+    R = BitArray('0xF0AAF0AA')
+    K = BitArray('0x1B02EFFC7072')
+    des_key = BitArray('0x133457799BBCDFF1')
+    des_block = BitArray('0x0123456789abcdef')
+    schedule = DES.key_schedule(des_key.uint)
+    output = [
+        ('spn_process encrypt', lambda: spn.spn_process(spn_block, spn_key), 1),
+        ('spn_process decrypt', lambda: spn.spn_process(spn_block, spn_key, encrypt=False), 1),
+        ('spn_process_int encrypt', lambda: spn.spn_process_int(0xB33C, 0x8FA507), 1),
+        ('spn_process_int decrypt', lambda: spn.spn_process_int(0xB33C, 0x8FA507, encrypt=False), 1),
+    ]
+    for size in (256, 2**16):
+        inputs = rng.integers(0, 2**16, size, dtype=np.uint16)
+        output.append(('spn_encrypt_batch %s' % size,
+                       lambda inputs=inputs: spn.spn_encrypt_batch(inputs, 0x8FA507), size))
+    output += [
+        ('observed bias sweep', lambda: bias_sweep(m, 0x93E026DE), 2**16),
+        ('lat 4-bit', lambda: sbox_analysis.lat(m['observed_bias'].sub_dict_encrypt), 1),
+        ('do_f', lambda: DES.do_f(R, K), 1),
+        ('do_f_int', lambda: DES.do_f_int(0xF0AAF0AA, 0x1B02EFFC7072), 1),
+        ('get_subkeys', lambda: DES.get_subkeys(des_key), 1),
+        ('get_subkeys_int', lambda: DES.get_subkeys_int(des_key.uint), 1),
+        ('DES_encrypt', lambda: DES.DES_encrypt(des_block, des_key), 1),
+        ('DES_encrypt_int', lambda: DES.DES_encrypt_int(des_block.uint, schedule), 1),
+    ]
+    for size in (64, 4096, 2**16):
+        blocks = rng.integers(0, 2**64, size, dtype=np.uint64)
+        output.append(('DES_encrypt_batch %s' % size,
+                       lambda blocks=blocks: DES.DES_encrypt_batch(blocks, schedule), size))
+    for size in (64, 4096, 2**16):
+        keys = rng.integers(0, 2**64, size, dtype=np.uint64)
+        output.append(('DES_encrypt_keys %s' % size,
+                       lambda keys=keys: DES.DES_encrypt_keys(des_block.uint, keys), size))
+    return output
+
+def measure(func, min_time=0.2, repeat=5):
+    """
+    Time a function, calling it enough times per run for the clock to be accurate
+    :param func: function without arguments
+    :param min_time: shortest duration of a run in seconds
+    :param repeat: number of runs, the fastest one counts
+    :return: (seconds per call, calls per run)
+    """
+    number = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time:
+            break
+        number = max(number * 2, int(number * min_time / max(elapsed, 1e-9) * 1.1))
+    best = elapsed
+    for _ in range(repeat - 1):
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        best = min(best, time.perf_counter() - start)
+    return best / number, number
+
+def run(name_filter=None, min_time=0.2, repeat=5):
+    """
+    Check the test vectors, then run the benchmarks
+    :param name_filter: only run the benchmarks whose name contains this string
+    :param min_time: shortest duration of a timed run in seconds
+    :param repeat: number of timed runs per benchmark
+    :return: results dictionary, ready to be written as JSON
+    """
+    m = load_modules()
+    m['bias_tables'] = m['spn'].build_spn_tables(m['observed_bias'].sub_dict_encrypt,
+                                                 m['observed_bias'].perm_dict_encrypt)
+    failed = check_vectors(m)
+    if failed:
+        raise ValueError('Known-answer checks failed: %s' % ', '.join(failed))
+    results = {}
+    for name, func, blocks in benchmarks(m):
+        if name_filter and name_filter.lower() not in name.lower():
+            continue
+        seconds, number = measure(func, min_time, repeat)
+        results[name] = {'ns_per_block': seconds * 1e9 / blocks, 'blocks_per_s': blocks / seconds,
+                         'blocks_per_call': blocks, 'calls_per_run': number}
+    return {'meta': {'python': platform.python_version(), 'numpy': np.__version__,
+                     'machine': platform.machine(), 'platform': platform.platform(),
+                     'date': time.strftime('%Y-%m-%d %H:%M:%S')},
+            'results': results}
+
+def compare(results: dict, baseline: dict, threshold: float):
+    """
+    Compare results against a baseline
+    :param results: output of run
+    :param baseline: output of an earlier run
+    :param threshold: allowed slowdown, 0.25 for 25%
+    :return: dictionary of benchmark name to ratio of current over baseline time per block, and
+             the list of the names beyond the threshold
+    """
+    ratios = {}
+    for name, result in results['results'].items():
+        if name in baseline['results']:
+            ratios[name] = result['ns_per_block'] / baseline['results'][name]['ns_per_block']
+    return ratios, [name for name, ratio in ratios.items() if ratio > 1 + threshold]
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmarks of the cipher and analysis hot paths')
+    parser.add_argument('--filter', default=None, help='only run benchmarks whose name contains this')
+    parser.add_argument('--quick', action='store_true', help='shorter, noisier timings')
+    parser.add_argument('--json', default=None, help='write the results to this file')
+    parser.add_argument('--baseline', default=BASELINE, help='baseline to compare against')
+    parser.add_argument('--save-baseline', action='store_true', help='store the results as the baseline')
+    parser.add_argument('--threshold', type=float, default=0.25,
+                        help='fail when a benchmark is slower than the baseline by more than this fraction')
+    args = parser.parse_args(argv)
+    try:
+        results = run(args.filter, *((0.05, 3) if args.quick else (0.2, 5)))
+    except ValueError as e:
+        print(e)
+        return 2
+    ratios, regressions = {}, []
+    if not args.save_baseline and os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            ratios, regressions = compare(results, json.load(f), args.threshold)
+    print('%-28s %14s %16s %10s' % ('benchmark', 'ns/block', 'blocks/s', 'baseline'))
+    for name, result in results['results'].items():
+        ratio = '%.2fx' % ratios[name] if name in ratios else '-'
+        print('%-28s %14.1f %16.0f %10s%s' % (name, result['ns_per_block'], result['blocks_per_s'], ratio,
+                                              '  REGRESSION' if name in regressions else ''))
+    for path in [args.json] + ([args.baseline] if args.save_baseline else []):
+        if path:
+            with open(path, 'w') as f:
+                json.dump(results, f, indent=2)
+    if regressions:
+        print('%s benchmark(s) slower than the baseline by more than %s%%: %s' %
+              (len(regressions), round(100 * args.threshold), ', '.join(regressions)))
+        return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,92 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+# Cold import time of the modules
+# Every module is imported in a fresh interpreter, several times, and the fastest run counts.
+# The time covers the import statement only, not the start of the interpreter. An import must
+# stay under the budget and must not load numpy or bitstring, which the modules only import on
+# first use (see common.lazy); the run fails otherwise. Bytecode caching changes the result, so
+# compare timings taken with the same PYTHONDONTWRITEBYTECODE setting.
+#
+#   python -m bench.import_time [--budget 60] [--repeat 5] [--json out.json]
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+modules = [
+    'common.cli',
+    'common.permutation',
+    'common.parallel',
+    'common.oracle',
+    'common.store',
+    'EC.DES',
+    'EC.TDES',
+    'EC.DES_modes',
+    'P1.spn',
+    'P1.spn_cipher',
+    'P1.prefix_tree',
+    'P1.key_search',
+    'P4.Observed_bias_4c',
+    'P4.spn_NL_table',
+    'P4.sbox_analysis',
+    'P4.linear_trail',
+    'P4.key_recovery',
+    'P4.differential',
+    'P4.bias_estimate',
+    'P4.des_linear',
+]
+
+# modules which must not be loaded by importing any of the above
+deferred = ['numpy', 'bitstring']
+
+PROBE = '''
+import sys, time, json
+start = time.perf_counter()
+import %s
+elapsed = time.perf_counter() - start
+print(json.dumps([elapsed, [name for name in %r if name in sys.modules]]))
+'''
+
+def import_time(module: str, repeat=5):
+    """
+    :param module: full name of a module
+    :param repeat: number of fresh interpreters to import it in
+    :return: (fastest import in seconds, list of the deferred modules it loaded)
+    """
+    best, loaded = None, []
+    for _ in range(repeat):
+        output = subprocess.run([sys.executable, '-c', PROBE % (module, deferred)], cwd=ROOT,
+                                capture_output=True, text=True, check=True).stdout
+        elapsed, loaded = json.loads(output.splitlines()[-1])
+        best = elapsed if best is None else min(best, elapsed)
+    return best, loaded
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Cold import time of the modules')
+    parser.add_argument('--budget', type=float, default=60, help='longest allowed import in milliseconds')
+    parser.add_argument('--repeat', type=int, default=5, help='number of imports per module')
+    parser.add_argument('--json', default=None, help='write the results to this file')
+    args = parser.parse_args(argv)
+    results = {}
+    failed = []
+    print('%-24s %10s  %s' % ('module', 'ms', 'loaded'))
+    for module in modules:
+        elapsed, loaded = import_time(module, args.repeat)
+        results[module] = {'ms': elapsed * 1e3, 'loaded': loaded}
+        over = elapsed * 1e3 > args.budget
+        if over or loaded:
+            failed.append(module)
+        print('%-24s %10.1f  %s%s' % (module, elapsed * 1e3, ', '.join(loaded) or '-', '  OVER BUDGET' if over else ''))
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'budget_ms': args.budget, 'results': results}, f, indent=2)
+    if failed:
+        print('%s module(s) over the %s ms budget or loading %s: %s' %
+              (len(failed), args.budget, ' or '.join(deferred), ', '.join(failed)))
+        return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
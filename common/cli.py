@@ -0,0 +1,213 @@
+import argparse
+import sys
+
+# Command line entry points
+# One command with a subcommand per task, in place of editing the values hard-coded at the end
+# of the scripts:
+#
+#   python -m common.cli encrypt --cipher des --key 133457799BBCDFF1 0123456789abcdef
+#   python -m common.cli decrypt --cipher spn --key 8FA507 F5B2 --trace
+#   python -m common.cli encrypt --cipher tdes --key k1,k2,k3 --in file --out file.enc --mode CBC
+#   python -m common.cli bias [--key 93E026DE --key E5D7F82E] [--in-mask 0001 --out-mask 8080]
+#   python -m common.cli lat observed [--ddt]
+#
+# The cipher and analysis modules are only imported by the subcommand which needs them, so the
+# help and the argument errors come back without loading numpy.
+
+# block size in bits of the ciphers
+ciphers = {
+    'des': 64,
+    'tdes': 64,
+    'spn': 16,
+    'present': 64,
+}
+
+def hex_int(text: str):
+    """
+    :param text: hexadecimal number, with or without 0x
+    :return: its value
+    """
+    try:
+        return int(text, 16)
+    except ValueError:
+        raise argparse.ArgumentTypeError('%r is not a hexadecimal number' % text)
+
+def des_key(text: str):
+    """
+    :param text: DES key, 16 hexadecimal digits with or without 0x
+    :return: its value
+    """
+    digits = text[2:] if text.lower().startswith('0x') else text
+    if len(digits) != 16:
+        raise ValueError('A DES key is 16 hexadecimal digits, not %r.' % text)
+    return int(digits, 16)
+
+def tdes_keys(text: str):
+    """
+    :param text: two or three comma-separated DES keys, or a 32 or 48 digit key
+    :return: tuple of the 64-bit keys
+    """
+    parts = text.split(',')
+    digits = text[2:] if text.lower().startswith('0x') else text
+    if len(parts) == 1 and len(digits) in (32, 48):
+        parts = [digits[i:i + 16] for i in range(0, len(digits), 16)]
+    if len(parts) not in (2, 3):
+        raise ValueError('A 3DES key is two or three DES keys, e.g. k1,k2,k3, or 32 or 48 hexadecimal digits.')
+    return tuple(des_key(part) for part in parts)
+
+def block_function(cipher: str, key: str, encrypt: bool, num_rounds=None, tracer=None):
+    """
+    :param cipher: name of the cipher, a key of ciphers
+    :param key: key in hexadecimal, see tdes_keys for 3DES
+    :param encrypt: set to True for encryption, False otherwise
+    :param num_rounds: number of rounds of the SPNs, 2 for spn and 31 for present if None
+    :param tracer: tracer to attach, see common.trace (DES and the 16-bit SPN only)
+    :return: function from an integer block to the integer output block
+    """
+    if cipher == 'spn':
+        from P1.spn import spn_process_int
+        # the key is as long as its digits, like the BitArray keys of spn_process
+        digits = key[2:] if key.lower().startswith('0x') else key
+        key, key_length, num_rounds = int(digits, 16), 4 * len(digits), num_rounds or 2
+        return lambda block: spn_process_int(block, key, num_rounds, encrypt, key_length, tracer=tracer)
+    if cipher == 'present':
+        from P1.spn_cipher import present_spn
+        present, key = present_spn(num_rounds or 31), int(key, 16)
+        return lambda block: present.encrypt(block, key) if encrypt else present.decrypt(block, key)
+    if cipher == 'tdes':
+        from EC.TDES import TDES_encrypt_int, TDES_decrypt_int, tdes_key_schedule
+        schedule = tdes_key_schedule(tdes_keys(key))
+        func = TDES_encrypt_int if encrypt else TDES_decrypt_int
+        return lambda block: func(block, schedule)
+    from EC.DES import DES_encrypt_int, DES_decrypt_int, key_schedule
+    schedule = key_schedule(des_key(key))
+    func = DES_encrypt_int if encrypt else DES_decrypt_int
+    return lambda block: func(block, schedule, tracer=tracer)
+
+def process(args, encrypt: bool):
+    """
+    The encrypt and decrypt subcommands
+    """
+    bits = ciphers[args.cipher]
+    if args.input is not None:
+        if args.cipher not in ('des', 'tdes') or args.output is None:
+            raise ValueError('Files are handled by DES and 3DES only, and need both --in and --out.')
+        from EC.DES_modes import encrypt_file, decrypt_file
+        key_seed = tdes_keys(args.key) if args.cipher == 'tdes' else des_key(args.key)
+        (encrypt_file if encrypt else decrypt_file)(args.input, args.output, key_seed, args.mode,
+                                                    args.iv, workers=args.workers)
+        return
+    if not args.blocks:
+        raise ValueError('Give the blocks to process, or a file with --in and --out.')
+    tracer = None
+    if args.trace:
+        from common.trace import Printer
+        tracer = Printer(width=bits if args.cipher == 'spn' else None)
+    func = block_function(args.cipher, args.key, encrypt, args.rounds, tracer)
+    for block in args.blocks:
+        if block >= 2**bits:
+            raise ValueError('Block %x is longer than %s bits.' % (block, bits))
+        print(format(func(block), '0%sx' % (bits // 4)))
+
+def bias(args):
+    """
+    The bias subcommand, the measurement of P4/Observed_bias_4c.py
+    """
+    from P4.Observed_bias_4c import observed_zero_counts
+    keys = {key: i for i, key in enumerate(args.key or [0x93E026DE, 0xE5D7F82E], start=1)}
+    for key, zeros in observed_zero_counts(keys, args.rounds, args.in_mask, args.out_mask).items():
+        print(zeros)
+        print('The observed bias for key {0}  is: {1}'.format(keys[key], (zeros / 2**16) - 0.5))
+
+def sbox_choices():
+    """
+    :return: dictionary of name to function returning the s-box
+    """
+    def observed():
+        from P4.Observed_bias_4c import sub_dict_encrypt
+        return sub_dict_encrypt
+
+    def nl():
+        from P4.spn_NL_table import sub_dict_encrypt
+        return sub_dict_encrypt
+
+    def stinson():
+        from P1.spn import s_box
+        return s_box
+
+    def present():
+        from P1.spn_cipher import present_sbox
+        return present_sbox
+    return {'observed': observed, 'nl': nl, 'stinson': stinson, 'present': present}
+
+def table(args):
+    """
+    The lat subcommand, the table of P4/spn_NL_table.py for any s-box
+    """
+    from P4.sbox_analysis import lat, ddt
+    choices = sbox_choices()
+    if args.sbox in choices:
+        sbox = choices[args.sbox]()
+    else:
+        # the entries in order, one hex digit each, e.g. e4d12fb83a6c5907
+        sbox = [int(digit, 16) for digit in args.sbox]
+    output = (ddt if args.ddt else lat)(sbox).tolist()
+    if args.list:
+        print(output)
+        return
+    width = max(len(str(x)) for row in output for x in row)
+    print(' ' * 3 + ' '.join('%*x' % (width, b) for b in range(len(output[0]))))
+    for a, row in enumerate(output):
+        print('%2x ' % a + ' '.join('%*s' % (width, x) for x in row))
+
+def parser():
+    """
+    :return: the argument parser of main
+    """
+    p = argparse.ArgumentParser(prog='python -m common.cli', description='Ciphers and cryptanalysis of the homework')
+    commands = p.add_subparsers(dest='command', required=True)
+    for name, func in (('encrypt', lambda args: process(args, True)), ('decrypt', lambda args: process(args, False))):
+        c = commands.add_parser(name, help='%s blocks or a file' % name)
+        c.add_argument('blocks', nargs='*', type=hex_int, help='blocks in hexadecimal')
+        c.add_argument('-c', '--cipher', choices=sorted(ciphers), default='des', help='cipher, des by default')
+        c.add_argument('-k', '--key', required=True, help='key in hexadecimal, k1,k2[,k3] for 3DES')
+        c.add_argument('--rounds', type=int, default=None, help='number of rounds of the SPNs')
+        c.add_argument('--trace', action='store_true', help='print the state after every stage (des and spn)')
+        c.add_argument('--in', dest='input', default=None, help='file to %s (des and tdes)' % name)
+        c.add_argument('--out', dest='output', default=None, help='file to write')
+        c.add_argument('--mode', default='CBC', help="block mode of the files, 'ECB', 'CBC' or 'CTR'")
+        c.add_argument('--iv', type=hex_int, default=None, help='IV or initial counter, random if not given')
+        c.add_argument('--workers', type=int, default=1, help='number of worker processes for the files')
+        c.set_defaults(func=func)
+    c = commands.add_parser('bias', help='observed bias of a linear approximation of the 4-round SPN')
+    c.add_argument('-k', '--key', type=hex_int, action='append', help='32-bit key, may be repeated')
+    c.add_argument('--rounds', type=int, default=4, help='number of spn rounds')
+    c.add_argument('--in-mask', type=hex_int, default=0x0001, help='mask on the plaintext')
+    c.add_argument('--out-mask', type=hex_int, default=0x8080, help='mask on u of the last round')
+    c.set_defaults(func=bias)
+    c = commands.add_parser('lat', help='linear approximation table of an s-box')
+    c.add_argument('sbox', nargs='?', default='nl',
+                   help='%s, or the entries as hex digits' % ', '.join(sbox_choices()))
+    c.add_argument('--ddt', action='store_true', help='print the difference distribution table instead')
+    c.add_argument('--list', action='store_true', help='print the table as a Python list')
+    c.set_defaults(func=table)
+    return p
+
+def main(argv=None):
+    p = parser()
+    args = p.parse_args(argv)
+    if getattr(args, 'cipher', None) in ('des', 'tdes'):
+        # a wrong key length is an argument error, before any work
+        try:
+            (tdes_keys if args.cipher == 'tdes' else des_key)(args.key)
+        except ValueError as e:
+            p.error(str(e))
+    try:
+        args.func(args)
+    except ValueError as e:
+        print(e, file=sys.stderr)
+        return 2
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
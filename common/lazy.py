@@ -0,0 +1,85 @@
+import importlib
+
+# Deferred imports
+# numpy and bitstring make up most of the start-up time of the modules here, while the integer
+# ciphers and the command line help need neither. lazy_import returns a stand-in for a module
+# which imports it the first time one of its attributes is used, and lazy_attribute a stand-in
+# for one class or function of a module, such as bitstring.BitArray, which can be called and
+# used with isinstance like the real thing. Both are meant to be bound at module level in place
+# of the usual import statement:
+#
+#   np = lazy_import('numpy')
+#   BitArray = lazy_attribute('bitstring', 'BitArray')
+
+class LazyModule:
+    """
+    A module imported on first use
+    """
+    def __init__(self, name: str):
+        """
+        :param name: full name of the module
+        """
+        self.__dict__['_name'] = name
+        self.__dict__['_module'] = None
+
+    def _load(self):
+        if self._module is None:
+            self.__dict__['_module'] = importlib.import_module(self._name)
+        return self._module
+
+    def __getattr__(self, attr: str):
+        value = getattr(self._load(), attr)
+        # keep it, so the next lookup does not come through here
+        self.__dict__[attr] = value
+        return value
+
+    def __repr__(self):
+        return 'LazyModule(%r, %s)' % (self._name, 'loaded' if self._module is not None else 'not loaded')
+
+class LazyAttribute:
+    """
+    A class or function of a module imported on first use
+    """
+    def __init__(self, module: str, name: str):
+        """
+        :param module: full name of the module
+        :param name: name of the attribute in the module
+        """
+        self._module = module
+        self._name = name
+        self._value = None
+
+    def resolve(self):
+        """
+        :return: the attribute itself, importing its module if needed
+        """
+        if self._value is None:
+            self._value = getattr(importlib.import_module(self._module), self._name)
+        return self._value
+
+    def __call__(self, *args, **kwargs):
+        return self.resolve()(*args, **kwargs)
+
+    def __instancecheck__(self, instance):
+        return isinstance(instance, self.resolve())
+
+    def __getattr__(self, attr: str):
+        return getattr(self.resolve(), attr)
+
+    def __repr__(self):
+        return 'LazyAttribute(%r, %r)' % (self._module, self._name)
+
+def lazy_import(name: str):
+    """
+    :param name: full name of a module
+    :return: LazyModule standing in for it
+    """
+    return LazyModule(name)
+
+def lazy_attribute(module: str, name: str):
+    """
+    :param module: full name of a module
+    :param name: name of a class or function in it
+    :return: LazyAttribute standing in for it
+    """
+    return LazyAttribute(module, name)
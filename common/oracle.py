@@ -0,0 +1,635 @@
+import json
+import os
+import socket
+import struct
+import sys
+import time
+from common.lazy import lazy_import, lazy_attribute
+
+np = lazy_import('numpy')
+# clients using BlockingOracleClient do not need the event loop machinery
+asyncio = lazy_import('asyncio')
+ThreadPoolExecutor = lazy_attribute('concurrent.futures', 'ThreadPoolExecutor')
+
+# Encryption oracle service
+# An asyncio server, on a Unix socket or a localhost TCP port, holding secret keys for a set of
+# named targets (a cipher, its number of rounds and a key) and answering encrypt and decrypt
+# requests from any number of clients, e.g. attack workers collecting chosen-plaintext pairs.
+#
+# A request carries an array of blocks. Requests for the same target and direction are queued
+# together and a batching loop takes everything queued (up to max_batch blocks) at once, runs
+# one call of the vectorized engine (spn_encrypt_batch, DES_encrypt_batch, ...) on a worker
+# thread and hands every request its slice of the output. While a batch is being computed the
+# next one fills up, so concurrent clients share batches instead of paying one engine call each.
+#
+# Backpressure: a target stops accepting requests while max_pending blocks are queued, and a
+# connection stops reading once max_in_flight of its requests are unanswered, so a client going
+# faster than the engine ends up blocked in its socket writes rather than growing the queues.
+# Requests on a connection are answered in order, so a client may pipeline them.
+#
+# Wire format, integers big-endian:
+#   request:  op (1 byte), length of the target name (1 byte), number of blocks (4 bytes),
+#             target name, blocks of block_bits / 8 bytes each
+#   response: status (1 byte, 0 for success), payload length in bytes (4 bytes), payload
+# The ops are b'E' (encrypt), b'D' (decrypt), b'T' (JSON dictionary of target name to block size
+# in bits) and b'S' (JSON statistics of every client, see OracleServer.report). Errors come back
+# with status 1 and the message as payload.
+#
+#   python -m common.oracle --unix /tmp/oracle.sock --target spn4=spn:4 --target des=des
+
+REQUEST = struct.Struct('>cBI')
+RESPONSE = struct.Struct('>BI')
+
+# largest number of blocks in one request
+MAX_REQUEST = 2**22
+
+# default number of blocks per engine call, of queued blocks per target and of unanswered
+# requests per connection
+MAX_BATCH = 2**16
+MAX_PENDING = 2**20
+MAX_IN_FLIGHT = 32
+
+# block size in bits of the ciphers
+ciphers = {
+    'spn': 16,
+    'present': 64,
+    'des': 64,
+    'tdes': 64,
+}
+
+# default number of rounds of the SPNs
+default_rounds = {
+    'spn': 2,
+    'present': 31,
+}
+
+class Target:
+    """
+    A cipher under a fixed key, as batch functions over numpy arrays
+    """
+    def __init__(self, cipher: str, key, num_rounds=None, key_length=None):
+        """
+        :param cipher: 'spn' (P1/spn.py), 'present', 'des' or 'tdes'
+        :param key: master key as an integer, a tuple of two or three keys for 'tdes'
+        :param num_rounds: number of rounds of the SPNs, 2 for spn and 31 for present if None
+        :param key_length: length of the spn key in bits, 4 * num_rounds + 16 by default; the
+                           round keys are taken from its leading bits, as in spn_process
+        """
+        if cipher not in ciphers:
+            raise ValueError('Unknown cipher %r, expected one of %s.' % (cipher, ', '.join(ciphers)))
+        self.cipher = cipher
+        self.block_bits = ciphers[cipher]
+        self.num_rounds = num_rounds or default_rounds.get(cipher, 16)
+        if cipher == 'spn':
+            from P1.spn import spn_encrypt_batch
+            from P1.spn_cipher import stinson_spn
+            key_length = key_length or 4 * self.num_rounds + 16
+            if key.bit_length() > key_length:
+                raise ValueError('The key is longer than %s bits.' % key_length)
+            spn = stinson_spn(self.num_rounds, key_length)
+            self.encrypt = lambda blocks: spn_encrypt_batch(blocks, key, self.num_rounds, key_length)
+            self.decrypt = lambda blocks: spn.decrypt_batch(blocks, key).astype(np.uint16)
+        elif cipher == 'present':
+            from P1.spn_cipher import present_spn
+            spn = present_spn(self.num_rounds)
+            self.encrypt = lambda blocks: spn.encrypt_batch(blocks, key)
+            self.decrypt = lambda blocks: spn.decrypt_batch(blocks, key)
+        elif cipher == 'des':
+            from EC.DES import DES_encrypt_batch, DES_decrypt_batch, key_schedule
+            schedule = key_schedule(key)
+            self.encrypt = lambda blocks: DES_encrypt_batch(blocks, schedule)
+            self.decrypt = lambda blocks: DES_decrypt_batch(blocks, schedule)
+        else:
+            from EC.TDES import TDES_encrypt_batch, TDES_decrypt_batch, tdes_key_schedule
+            schedule = tdes_key_schedule(tuple(key))
+            self.encrypt = lambda blocks: TDES_encrypt_batch(blocks, schedule)
+            self.decrypt = lambda blocks: TDES_decrypt_batch(blocks, schedule)
+
+    @property
+    def dtype(self):
+        """
+        :return: numpy type the engine takes blocks in
+        """
+        return np.uint16 if self.block_bits == 16 else np.uint64
+
+    @property
+    def wire_dtype(self):
+        """
+        :return: numpy type of the blocks on the wire
+        """
+        return np.dtype('>u%s' % (self.block_bits // 8))
+
+    def __repr__(self):
+        return 'Target(%s, %s rounds)' % (self.cipher, self.num_rounds)
+
+def random_key(cipher: str, num_rounds=None):
+    """
+    Draw a secret key for a target
+    :param cipher: name of the cipher, a key of ciphers
+    :param num_rounds: number of rounds of the SPNs, see Target
+    :return: key accepted by Target
+    """
+    if cipher == 'tdes':
+        return tuple(int.from_bytes(os.urandom(8), 'big') for _ in range(3))
+    if cipher == 'spn':
+        bits = 4 * (num_rounds or default_rounds['spn']) + 16
+    else:
+        bits = 80 if cipher == 'present' else 64
+    return int.from_bytes(os.urandom(-(-bits // 8)), 'big') >> (-bits % 8)
+
+class Batcher:
+    """
+    Queue of the requests for one function, run in micro-batches
+    """
+    def __init__(self, func, executor, max_batch=MAX_BATCH, max_pending=MAX_PENDING):
+        """
+        :param func: function from a numpy array of blocks to the array of outputs
+        :param executor: executor running func, off the event loop
+        :param max_batch: largest number of blocks per call of func, one request may exceed it
+        :param max_pending: number of queued blocks beyond which submit waits
+        """
+        self.func = func
+        self.executor = executor
+        self.max_batch = max_batch
+        self.max_pending = max_pending
+        self.queue = []
+        self.pending = 0
+        self.batches = 0
+        self.blocks = 0
+        self.changed = asyncio.Condition()
+        self.task = asyncio.get_running_loop().create_task(self.run())
+
+    async def submit(self, blocks):
+        """
+        :param blocks: numpy array of blocks
+        :return: array of outputs, once the batch holding them is done
+        """
+        future = asyncio.get_running_loop().create_future()
+        async with self.changed:
+            await self.changed.wait_for(lambda: self.pending < self.max_pending)
+            self.queue.append((blocks, future))
+            self.pending += len(blocks)
+            self.changed.notify_all()
+        return await future
+
+    def take(self):
+        """
+        :return: the requests of the next batch, in the order they came
+        """
+        count = 0
+        for i, (blocks, _) in enumerate(self.queue):
+            if i and count + len(blocks) > self.max_batch:
+                break
+            count += len(blocks)
+        else:
+            i = len(self.queue)
+        batch, self.queue = self.queue[:i], self.queue[i:]
+        return batch
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            async with self.changed:
+                await self.changed.wait_for(lambda: self.queue)
+                batch = self.take()
+            sizes = [len(blocks) for blocks, _ in batch]
+            try:
+                data = batch[0][0] if len(batch) == 1 else np.concatenate([blocks for blocks, _ in batch])
+                outputs = np.split(await loop.run_in_executor(self.executor, self.func, data),
+                                   np.cumsum(sizes[:-1]))
+            except Exception as e:
+                outputs = [e] * len(batch)
+            for (_, future), output in zip(batch, outputs):
+                if future.done():
+                    continue
+                if isinstance(output, Exception):
+                    future.set_exception(output)
+                else:
+                    future.set_result(output)
+            self.batches += 1
+            self.blocks += sum(sizes)
+            async with self.changed:
+                self.pending -= sum(sizes)
+                self.changed.notify_all()
+
+    def close(self):
+        self.task.cancel()
+
+class OracleServer:
+    """
+    The oracle, serving a dictionary of targets
+    """
+    def __init__(self, targets: dict, max_batch=MAX_BATCH, max_pending=MAX_PENDING, max_in_flight=MAX_IN_FLIGHT):
+        """
+        :param targets: dictionary of name to Target
+        :param max_batch: largest number of blocks per engine call
+        :param max_pending: number of queued blocks per target and direction beyond which
+                            requests wait
+        :param max_in_flight: number of unanswered requests per connection beyond which the
+                              connection is not read
+        """
+        if any(len(name.encode()) > 255 for name in targets):
+            raise ValueError('Target names are limited to 255 bytes.')
+        self.targets = targets
+        self.max_batch = max_batch
+        self.max_pending = max_pending
+        self.max_in_flight = max_in_flight
+        self.batchers = {}
+        self.executor = None
+        self.clients = {}
+        self.next_client = 1
+        self.server = None
+        # handler task to writer of every open connection
+        self.connections = {}
+        self.closing = False
+
+    async def start(self, path=None, host='127.0.0.1', port=0):
+        """
+        Start listening
+        :param path: Unix socket to listen on, or None for TCP
+        :param host: TCP address, localhost by default
+        :param port: TCP port, 0 for any free port
+        :return: the socket path, or the (host, port) listened on
+        """
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        for name, target in self.targets.items():
+            for op, func in ((b'E', target.encrypt), (b'D', target.decrypt)):
+                self.batchers[name, op] = Batcher(func, self.executor, self.max_batch, self.max_pending)
+        if path is not None:
+            self.server = await asyncio.start_unix_server(self.handle, path)
+            return path
+        self.server = await asyncio.start_server(self.handle, host, port)
+        return self.server.sockets[0].getsockname()[:2]
+
+    async def close(self):
+        """
+        Stop listening and end every connection, then the batching loops
+        """
+        self.closing = True
+        if self.server is not None:
+            self.server.close()
+        # the handlers end on their own once their connection is closed, unless parked elsewhere
+        handlers = list(self.connections)
+        for task, writer in self.connections.items():
+            writer.close()
+            task.cancel()
+        await asyncio.gather(*handlers, return_exceptions=True)
+        if self.server is not None:
+            await self.server.wait_closed()
+        for batcher in self.batchers.values():
+            batcher.close()
+        await asyncio.gather(*(batcher.task for batcher in self.batchers.values()), return_exceptions=True)
+        if self.executor is not None:
+            self.executor.shutdown(wait=False)
+
+    def report(self):
+        """
+        :return: dictionary of client number to its statistics: peer, connection time in
+                 seconds, requests, blocks, blocks per second of connection, mean time in ms
+                 from a request coming in to its answer, and whether it is still connected
+        """
+        now = time.perf_counter()
+        output = {}
+        for number, client in self.clients.items():
+            elapsed = (client['end'] or now) - client['start']
+            output[number] = {
+                'peer': client['peer'],
+                'seconds': elapsed,
+                'requests': client['requests'],
+                'blocks': client['blocks'],
+                'blocks_per_s': client['blocks'] / elapsed if elapsed else 0.0,
+                'mean_latency_ms': 1e3 * client['latency'] / client['requests'] if client['requests'] else 0.0,
+                'connected': client['end'] is None,
+            }
+        return output
+
+    def batch_report(self):
+        """
+        :return: dictionary of 'target op' to (engine calls, blocks, mean blocks per call)
+        """
+        return {'%s %s' % (name, op.decode()): (b.batches, b.blocks, b.blocks / b.batches if b.batches else 0.0)
+                for (name, op), b in self.batchers.items()}
+
+    async def answer(self, op: bytes, name: str, payload: bytes, count: int):
+        """
+        :return: (status, response payload) for one request
+        """
+        if op == b'T':
+            return 0, json.dumps({n: t.block_bits for n, t in self.targets.items()}).encode()
+        if op == b'S':
+            return 0, json.dumps(self.report()).encode()
+        if (name, op) not in self.batchers:
+            return 1, ('Unknown target %r.' % name if name not in self.targets else 'Unknown op %r.' % op).encode()
+        target = self.targets[name]
+        blocks = np.frombuffer(payload, dtype=target.wire_dtype).astype(target.dtype)
+        output = await self.batchers[name, op].submit(blocks)
+        return 0, np.asarray(output).astype(target.wire_dtype).tobytes()
+
+    async def handle(self, reader, writer):
+        number = self.next_client
+        self.next_client += 1
+        client = {'peer': str(writer.get_extra_info('peername') or 'unix'), 'start': time.perf_counter(),
+                  'end': None, 'requests': 0, 'blocks': 0, 'latency': 0.0}
+        self.clients[number] = client
+        self.connections[asyncio.current_task()] = writer
+        # answers in request order, the queue bound being the backpressure on the reads
+        in_flight = asyncio.Queue(maxsize=self.max_in_flight)
+
+        async def respond():
+            closed = False
+            while True:
+                item = await in_flight.get()
+                if item is None:
+                    return
+                task, count, start = item
+                try:
+                    status, payload = await task
+                except Exception as e:
+                    status, payload = 1, str(e).encode()
+                if closed:
+                    continue
+                try:
+                    writer.write(RESPONSE.pack(status, len(payload)) + payload)
+                    await writer.drain()
+                except ConnectionError:
+                    # the client is gone: keep taking the queue, so the reads never block on it
+                    closed = True
+                    continue
+                client['requests'] += 1
+                client['blocks'] += count
+                client['latency'] += time.perf_counter() - start
+
+        responder = asyncio.get_running_loop().create_task(respond())
+        try:
+            while not writer.is_closing():
+                try:
+                    op, name_length, count = REQUEST.unpack(await reader.readexactly(REQUEST.size))
+                    name = (await reader.readexactly(name_length)).decode()
+                    if count > MAX_REQUEST:
+                        raise ValueError('Requests are limited to %s blocks.' % MAX_REQUEST)
+                    if count and name not in self.targets:
+                        raise ValueError('Unknown target %r.' % name)
+                    payload = await reader.readexactly(count * self.targets[name].block_bits // 8 if count else 0)
+                except (asyncio.IncompleteReadError, ConnectionError):
+                    break
+                except ValueError as e:
+                    # the rest of the stream can not be parsed, answer and hang up
+                    task = asyncio.get_running_loop().create_future()
+                    task.set_exception(e)
+                    await in_flight.put((task, 0, time.perf_counter()))
+                    break
+                start = time.perf_counter()
+                task = asyncio.get_running_loop().create_task(self.answer(op, name, payload, count))
+                await in_flight.put((task, count, start))
+            await in_flight.put(None)
+            await responder
+        except asyncio.CancelledError:
+            # ended by close(), which waits for the handler: finish normally so the stream
+            # callback has no cancellation to report
+            if not self.closing:
+                raise
+        finally:
+            responder.cancel()
+            self.connections.pop(asyncio.current_task(), None)
+            client['end'] = time.perf_counter()
+            writer.close()
+
+class OracleClient:
+    """
+    Asynchronous client, requests may be issued concurrently and are pipelined on one connection
+    """
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        self.waiting = []
+        self.block_bits = {}
+        self.task = asyncio.get_running_loop().create_task(self.receive())
+
+    @classmethod
+    async def connect(cls, path=None, host='127.0.0.1', port=None):
+        """
+        :param path: Unix socket of the server, or None for TCP
+        :param host: TCP address of the server
+        :param port: TCP port of the server
+        :return: OracleClient
+        """
+        if path is not None:
+            reader, writer = await asyncio.open_unix_connection(path)
+        else:
+            reader, writer = await asyncio.open_connection(host, port)
+        client = cls(reader, writer)
+        client.block_bits = json.loads(await client.request(b'T'))
+        return client
+
+    async def receive(self):
+        try:
+            while True:
+                status, length = RESPONSE.unpack(await self.reader.readexactly(RESPONSE.size))
+                payload = await self.reader.readexactly(length)
+                future = self.waiting.pop(0)
+                if status:
+                    future.set_exception(ValueError(payload.decode()))
+                else:
+                    future.set_result(payload)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            for future in self.waiting:
+                future.set_exception(ConnectionError('The oracle closed the connection.'))
+            self.waiting = []
+
+    async def request(self, op: bytes, name='', payload=b'', count=0):
+        """
+        :return: response payload
+        """
+        if self.task.done():
+            raise ConnectionError('The oracle closed the connection.')
+        future = asyncio.get_running_loop().create_future()
+        name = name.encode()
+        # one write per request, so concurrent requests do not interleave on the wire
+        self.writer.write(REQUEST.pack(op, len(name), count) + name + payload)
+        self.waiting.append(future)
+        await self.writer.drain()
+        return await future
+
+    async def process(self, op: bytes, target: str, blocks):
+        if target not in self.block_bits:
+            raise ValueError('Unknown target %r.' % target)
+        wire_dtype = np.dtype('>u%s' % (self.block_bits[target] // 8))
+        blocks = np.asarray(blocks)
+        output = await self.request(op, target, blocks.astype(wire_dtype).tobytes(), len(blocks))
+        return np.frombuffer(output, dtype=wire_dtype).astype(np.uint16 if wire_dtype.itemsize == 2 else np.uint64)
+
+    async def encrypt(self, target: str, blocks):
+        """
+        :param target: name of the target
+        :param blocks: array-like of blocks
+        :return: numpy array of ciphertexts
+        """
+        return await self.process(b'E', target, blocks)
+
+    async def decrypt(self, target: str, blocks):
+        """
+        :param target: name of the target
+        :param blocks: array-like of blocks
+        :return: numpy array of plaintexts
+        """
+        return await self.process(b'D', target, blocks)
+
+    async def stats(self):
+        """
+        :return: statistics of every client, see OracleServer.report
+        """
+        return json.loads(await self.request(b'S'))
+
+    async def close(self):
+        self.writer.close()
+        await self.writer.wait_closed()
+        self.task.cancel()
+
+class BlockingOracleClient:
+    """
+    Synchronous client, for worker processes without an event loop. Requests go one at a time,
+    so send many blocks per request.
+    """
+    def __init__(self, path=None, host='127.0.0.1', port=None):
+        """
+        :param path: Unix socket of the server, or None for TCP
+        :param host: TCP address of the server
+        :param port: TCP port of the server
+        """
+        if path is not None:
+            self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self.sock.connect(path)
+        else:
+            self.sock = socket.create_connection((host, port))
+        self.block_bits = json.loads(self.request(b'T'))
+
+    def receive_exactly(self, size: int):
+        buffer = bytearray(size)
+        view = memoryview(buffer)
+        done = 0
+        while done < size:
+            count = self.sock.recv_into(view[done:])
+            if not count:
+                raise ConnectionError('The oracle closed the connection.')
+            done += count
+        return bytes(buffer)
+
+    def request(self, op: bytes, name='', payload=b'', count=0):
+        """
+        :return: response payload
+        """
+        name = name.encode()
+        self.sock.sendall(REQUEST.pack(op, len(name), count) + name + payload)
+        status, length = RESPONSE.unpack(self.receive_exactly(RESPONSE.size))
+        payload = self.receive_exactly(length)
+        if status:
+            raise ValueError(payload.decode())
+        return payload
+
+    def process(self, op: bytes, target: str, blocks):
+        if target not in self.block_bits:
+            raise ValueError('Unknown target %r.' % target)
+        wire_dtype = np.dtype('>u%s' % (self.block_bits[target] // 8))
+        blocks = np.asarray(blocks)
+        output = self.request(op, target, blocks.astype(wire_dtype).tobytes(), len(blocks))
+        return np.frombuffer(output, dtype=wire_dtype).astype(np.uint16 if wire_dtype.itemsize == 2 else np.uint64)
+
+    def encrypt(self, target: str, blocks):
+        """
+        :param target: name of the target
+        :param blocks: array-like of blocks
+        :return: numpy array of ciphertexts
+        """
+        return self.process(b'E', target, blocks)
+
+    def decrypt(self, target: str, blocks):
+        """
+        :param target: name of the target
+        :param blocks: array-like of blocks
+        :return: numpy array of plaintexts
+        """
+        return self.process(b'D', target, blocks)
+
+    def stats(self):
+        """
+        :return: statistics of every client, see OracleServer.report
+        """
+        return json.loads(self.request(b'S'))
+
+    def close(self):
+        self.sock.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def parse_target(text: str, keys: dict):
+    """
+    :param text: target as name=cipher[:rounds], e.g. spn4=spn:4
+    :param keys: dictionary of target name to key in hexadecimal (k1,k2,k3 for tdes), a random
+                 key being drawn for the targets not in it
+    :return: (name, Target)
+    """
+    name, _, spec = text.partition('=')
+    cipher, _, rounds = (spec or name).partition(':')
+    num_rounds = int(rounds) if rounds else None
+    key_length = None
+    if name in keys:
+        key = tuple(int(k, 16) for k in keys[name].split(',')) if cipher == 'tdes' else int(keys[name], 16)
+        if cipher == 'spn':
+            # the key is as long as its digits, as in common.cli
+            digits = keys[name][2:] if keys[name].lower().startswith('0x') else keys[name]
+            key_length = 4 * len(digits)
+    else:
+        key = random_key(cipher, num_rounds)
+    return name, Target(cipher, key, num_rounds, key_length)
+
+async def serve(targets: dict, path=None, host='127.0.0.1', port=0, report_every=None, **kwargs):
+    """
+    Run the oracle until cancelled
+    :param targets: dictionary of name to Target
+    :param path: Unix socket to listen on, or None for TCP
+    :param host: TCP address
+    :param port: TCP port
+    :param report_every: seconds between printed client reports, None for no reports
+    :param kwargs: limits passed to OracleServer
+    """
+    server = OracleServer(targets, **kwargs)
+    address = await server.start(path, host, port)
+    print('Oracle listening on %s, targets: %s' %
+          (address, ', '.join('%s (%s)' % (name, target) for name, target in targets.items())), flush=True)
+    try:
+        while True:
+            await asyncio.sleep(report_every or 3600)
+            if report_every:
+                for number, stats in server.report().items():
+                    print('client %s %s: %s requests, %s blocks, %.0f blocks/s, %.2f ms mean latency' %
+                          (number, stats['peer'], stats['requests'], stats['blocks'], stats['blocks_per_s'],
+                           stats['mean_latency_ms']), flush=True)
+    finally:
+        await server.close()
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='Encryption oracle holding secret keys')
+    parser.add_argument('--unix', default=None, help='Unix socket to listen on')
+    parser.add_argument('--host', default='127.0.0.1', help='TCP address to listen on')
+    parser.add_argument('--port', type=int, default=0, help='TCP port to listen on, any free one by default')
+    parser.add_argument('--target', action='append', default=None,
+                        help='target as name=cipher[:rounds] with cipher one of %s, may be repeated' %
+                             ', '.join(ciphers))
+    parser.add_argument('--key', action='append', default=[],
+                        help='key of a target as name=hex, random if not given')
+    parser.add_argument('--max-batch', type=int, default=MAX_BATCH, help='largest number of blocks per engine call')
+    parser.add_argument('--max-pending', type=int, default=MAX_PENDING, help='queued blocks per target before waiting')
+    parser.add_argument('--report', type=float, default=None, help='seconds between client reports')
+    args = parser.parse_args()
+    keys = dict(key.split('=', 1) for key in args.key)
+    targets = dict(parse_target(text, keys) for text in args.target or ['spn', 'des'])
+    try:
+        asyncio.run(serve(targets, args.unix, args.host, args.port, args.report, max_batch=args.max_batch,
+                          max_pending=args.max_pending))
+    except KeyboardInterrupt:
+        sys.exit(0)
@@ -0,0 +1,193 @@
+import mmap
+import os
+from common.lazy import lazy_import, lazy_attribute
+
+np = lazy_import('numpy')
+# the process machinery takes longer to import than the rest of the package
+ProcessPoolExecutor = lazy_attribute('concurrent.futures', 'ProcessPoolExecutor')
+SharedMemory = lazy_attribute('multiprocessing.shared_memory', 'SharedMemory')
+
+# Multi-core execution of independent-block work
+# The input array is copied once into a shared-memory segment and an output segment of the same
+# length is allocated next to it. The work is split into shards and each worker process attaches
+# to both segments by name, runs the function on its slice of the input and writes the result
+# straight into its slice of the output, so only the segment names and shard bounds are pickled
+# and the results come back in order without being sent through the pool.
+#
+# The function and its extra arguments must be picklable, i.e. defined at module level, such as
+# EC.DES.DES_encrypt_batch or P1.spn.spn_encrypt_batch. Large arguments used by every call (SPN
+# tables, a DES key schedule) are given to the executor as shared objects: the pool initializer
+# sends them once to each worker, and map_blocks passes a reference in their place. A shared
+# memory-mapped array, such as an artifact of common.store, is not sent at all: the workers map
+# the same file.
+#
+# Workers beyond the number of cores only add pickling and process switches, so the pool is
+# capped at os.cpu_count() processes, and with a single one the work runs in-process.
+
+# smallest shard worth sending to another process
+MIN_SHARD = 2**12
+
+# objects received from the pool initializer, in the worker processes
+worker_shared = ()
+
+class SharedRef:
+    """
+    Stand-in for the shared object at an index, resolved in the worker
+    """
+    def __init__(self, index: int):
+        self.index = index
+
+class MappedArray:
+    """
+    Stand-in for a memory-mapped array, mapped again from its file by the worker
+    """
+    def __init__(self, array):
+        self.filename = array.filename
+        self.offset = array.offset
+        self.dtype = array.dtype.str
+        self.shape = array.shape
+
+    def load(self):
+        return np.memmap(self.filename, dtype=self.dtype, mode='r', offset=self.offset, shape=self.shape)
+
+def mapped(obj):
+    """
+    :return: a MappedArray for a whole read-only file mapping (not a view of one), obj otherwise
+    """
+    if (isinstance(obj, np.memmap) and isinstance(obj.base, mmap.mmap) and obj.filename
+            and obj.flags.c_contiguous and not obj.flags.writeable):
+        return MappedArray(obj)
+    return obj
+
+def init_worker(shared: tuple):
+    """
+    Pool initializer, keeps the shared objects of the executor in the worker process
+    """
+    global worker_shared
+    worker_shared = tuple(obj.load() if isinstance(obj, MappedArray) else obj for obj in shared)
+
+def resolve(value):
+    return worker_shared[value.index] if isinstance(value, SharedRef) else value
+
+def run_shard(func, args: tuple, kwargs: dict, in_spec: tuple, out_spec: tuple, start: int, stop: int):
+    """
+    Worker side of map_blocks: process one shard in place
+    :param func: function taking an array of inputs and returning an array of the same length
+    :param args: extra positional arguments for func
+    :param kwargs: extra keyword arguments for func
+    :param in_spec: (segment name, dtype, length) of the inputs
+    :param out_spec: (segment name, dtype, length) of the outputs
+    :param start: first index of the shard
+    :param stop: index after the last one of the shard
+    :return: number of items processed
+    """
+    # the worker shares the resource tracker of the parent, which creates and unlinks the segments
+    args = tuple(resolve(value) for value in args)
+    kwargs = dict((name, resolve(value)) for name, value in kwargs.items())
+    in_shm = SharedMemory(name=in_spec[0])
+    out_shm = SharedMemory(name=out_spec[0])
+    try:
+        inputs = np.ndarray((in_spec[2],), dtype=in_spec[1], buffer=in_shm.buf)
+        outputs = np.ndarray((out_spec[2],), dtype=out_spec[1], buffer=out_shm.buf)
+        outputs[start:stop] = func(inputs[start:stop], *args, **kwargs)
+        del inputs, outputs
+    finally:
+        in_shm.close()
+        out_shm.close()
+    return stop - start
+
+class ParallelExecutor:
+    """
+    A process pool for functions over arrays of independent blocks, fed through shared memory.
+    Use it as a context manager, or call shutdown when done.
+    """
+    def __init__(self, workers=None, shared=()):
+        """
+        :param workers: number of worker processes, os.cpu_count() by default and at most
+        :param shared: objects sent once to every worker, map_blocks arguments which are one of
+                       them (the same object) are not pickled again for every shard
+        """
+        cores = os.cpu_count() or 1
+        self.workers = min(workers or cores, cores)
+        self.shared = tuple(shared)
+        self.pool = None
+        if self.workers > 1:
+            self.pool = ProcessPoolExecutor(max_workers=self.workers, initializer=init_worker,
+                                            initargs=(tuple(mapped(obj) for obj in self.shared),))
+
+    def reference(self, value):
+        """
+        :return: a SharedRef if value is one of the shared objects, value otherwise
+        """
+        for i, obj in enumerate(self.shared):
+            if value is obj:
+                return SharedRef(i)
+        return value
+
+    def map_blocks(self, func, inputs, *args, out_dtype=None, shard_size=None, **kwargs):
+        """
+        Apply func to every block of inputs, sharded over the worker processes
+        :param func: picklable function taking an array of inputs and returning an array of
+                     the same length, called as func(shard, *args, **kwargs)
+        :param inputs: 1-D numpy array
+        :param out_dtype: dtype of the output, the dtype of inputs by default
+        :param shard_size: items per shard, by default the inputs are split evenly over the workers
+        :return: numpy array of outputs, in the order of inputs
+        """
+        inputs = np.ascontiguousarray(inputs)
+        if inputs.ndim != 1:
+            raise ValueError('Inputs must be a one-dimensional array.')
+        out_dtype = np.dtype(inputs.dtype if out_dtype is None else out_dtype)
+        count = len(inputs)
+        if self.pool is None or count <= MIN_SHARD:
+            return np.asarray(func(inputs, *args, **kwargs), dtype=out_dtype)
+        if shard_size is None:
+            shard_size = max(MIN_SHARD, -(-count // self.workers))
+        in_shm = SharedMemory(create=True, size=max(1, inputs.nbytes))
+        out_shm = SharedMemory(create=True, size=max(1, count * out_dtype.itemsize))
+        try:
+            np.ndarray(inputs.shape, dtype=inputs.dtype, buffer=in_shm.buf)[:] = inputs
+            args = tuple(self.reference(value) for value in args)
+            kwargs = dict((name, self.reference(value)) for name, value in kwargs.items())
+            in_spec = (in_shm.name, inputs.dtype.str, count)
+            out_spec = (out_shm.name, out_dtype.str, count)
+            futures = [self.pool.submit(run_shard, func, args, kwargs, in_spec, out_spec,
+                                        start, min(start + shard_size, count))
+                       for start in range(0, count, shard_size)]
+            for future in futures:
+                future.result()
+            outputs = np.ndarray((count,), dtype=out_dtype, buffer=out_shm.buf).copy()
+        finally:
+            in_shm.close()
+            in_shm.unlink()
+            out_shm.close()
+            out_shm.unlink()
+        return outputs
+
+    def shutdown(self):
+        """
+        Stop the worker processes
+        """
+        if self.pool is not None:
+            self.pool.shutdown()
+            self.pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.shutdown()
+
+def map_blocks(func, inputs, *args, workers=None, out_dtype=None, shard_size=None, **kwargs):
+    """
+    One-off version of ParallelExecutor.map_blocks, starting and stopping a pool around the call
+    :param func: picklable function taking an array of inputs and returning an array of the same length
+    :param inputs: 1-D numpy array
+    :param workers: number of worker processes, os.cpu_count() by default and at most
+    :param out_dtype: dtype of the output, the dtype of inputs by default
+    :param shard_size: items per shard
+    :return: numpy array of outputs, in the order of inputs
+    """
+    # the extra arguments go to each worker once, with the pool
+    with ParallelExecutor(workers, shared=args + tuple(kwargs.values())) as executor:
+        return executor.map_blocks(func, inputs, *args, out_dtype=out_dtype, shard_size=shard_size, **kwargs)
@@ -0,0 +1,175 @@
+from functools import lru_cache
+from common.lazy import lazy_import
+
+np = lazy_import('numpy')
+
+# Compiled bit permutations
+# A permutation table lists, for every output bit, the 1-based input bit it is taken from, bit 1
+# being the most significant. Tables can be matrices (the DES tables in EC/DES_VALS.py), flat
+# lists, or dictionaries mapping output position to input position (permutation_map in
+# P1/spn.py). compile_permutation turns a table into a Permutation once, after which applying
+# it to an integer costs one lookup per input byte, or one mask and shift per distinct bit
+# offset, whichever is fewer.
+
+def flatten_table(table):
+    """
+    Turn a permutation table in any of the accepted forms into a flat tuple of input positions
+    :param table: permutation matrix, flat list or dictionary
+    :return: tuple of 1-based input positions, one per output bit
+    """
+    if isinstance(table, dict):
+        return tuple(table[i] for i in range(1, len(table) + 1))
+    output = []
+    for row in table:
+        if isinstance(row, (list, tuple)):
+            output.extend(row)
+        else:
+            output.append(row)
+    return tuple(output)
+
+class Permutation:
+    """
+    A bit permutation (or expansion / selection) compiled into lookup tables
+    """
+    def __init__(self, table, in_bits=None, method='auto'):
+        """
+        :param table: permutation matrix, flat list or dictionary of 1-based input positions
+        :param in_bits: length of the input in bits, the largest position in table by default
+        :param method: 'tables' for per-byte lookup tables, 'shifts' for mask-and-shift groups,
+                       or 'auto' to pick the one needing fewer operations
+        """
+        self.positions = flatten_table(table)
+        self.in_bits = max(self.positions) if in_bits is None else in_bits
+        self.out_bits = len(self.positions)
+        if min(self.positions) < 1 or max(self.positions) > self.in_bits:
+            raise ValueError('Permutation positions must be between 1 and %s.' % self.in_bits)
+        # output bits fed by every input bit, input bit 0 being the most significant
+        targets = [0] * self.in_bits
+        for out_pos, in_pos in enumerate(self.positions):
+            targets[in_pos - 1] |= 1 << (self.out_bits - 1 - out_pos)
+        # per-byte lookup tables, chunk i covers input bits [8i, 8i + 8) counted from the top
+        self.chunks = []
+        for start in range(0, self.in_bits, 8):
+            width = min(8, self.in_bits - start)
+            shift = self.in_bits - start - width
+            table = [0] * (1 << width)
+            # each entry is the entry without its lowest set bit plus the outputs of that bit
+            for value in range(1, 1 << width):
+                low = value & -value
+                table[value] = table[value ^ low] | targets[start + width - low.bit_length()]
+            self.chunks.append((shift, (1 << width) - 1, table))
+        # mask-and-shift groups, one per distinct distance an input bit moves
+        groups = {}
+        for out_pos, in_pos in enumerate(self.positions):
+            in_shift = self.in_bits - in_pos
+            out_shift = self.out_bits - 1 - out_pos
+            groups.setdefault(out_shift - in_shift, []).append(in_shift)
+        self.groups = []
+        for distance, bits in sorted(groups.items()):
+            # an input bit used twice at the same distance only needs to be masked once
+            mask = 0
+            for bit in bits:
+                mask |= 1 << bit
+            self.groups.append((distance, mask))
+        if method == 'auto':
+            method = 'tables' if len(self.chunks) <= len(self.groups) else 'shifts'
+        if method not in ('tables', 'shifts'):
+            raise ValueError("method must be 'auto', 'tables' or 'shifts'.")
+        self.method = method
+        self._np_chunks = None
+        self._indices = None
+
+    @property
+    def indices(self):
+        """
+        0-based input index of every output bit as a numpy array, e.g. for reordering bit planes
+        """
+        if self._indices is None:
+            self._indices = np.array(self.positions) - 1
+        return self._indices
+
+    def __call__(self, value: int):
+        """
+        Apply the permutation to an integer
+        :param value: input data, in_bits long
+        :return: permuted data, out_bits long
+        """
+        output = 0
+        if self.method == 'tables':
+            for shift, mask, table in self.chunks:
+                output |= table[(value >> shift) & mask]
+        else:
+            for distance, mask in self.groups:
+                if distance >= 0:
+                    output |= (value & mask) << distance
+                else:
+                    output |= (value & mask) >> -distance
+        return output
+
+    def apply_array(self, values):
+        """
+        Apply the permutation to every element of a numpy array
+        :param values: array of integers, in_bits long each (at most 64 bits)
+        :return: numpy array of permuted values, the smallest unsigned type holding out_bits
+        """
+        if self.in_bits > 64 or self.out_bits > 64:
+            raise ValueError('Arrays are limited to 64-bit values.')
+        values = np.asarray(values).astype(np.uint64)
+        output = np.zeros(values.shape, dtype=np.uint64)
+        if self.method == 'tables':
+            if self._np_chunks is None:
+                self._np_chunks = [(np.uint64(shift), np.uint64(mask), np.array(table, dtype=np.uint64))
+                                   for shift, mask, table in self.chunks]
+            for shift, mask, table in self._np_chunks:
+                output |= table[(values >> shift) & mask]
+        else:
+            for distance, mask in self.groups:
+                if distance >= 0:
+                    output |= (values & np.uint64(mask)) << np.uint64(distance)
+                else:
+                    output |= (values & np.uint64(mask)) >> np.uint64(-distance)
+        for dtype in (np.uint8, np.uint16, np.uint32):
+            if self.out_bits <= np.iinfo(dtype).bits:
+                return output.astype(dtype)
+        return output
+
+    def is_bijective(self):
+        """
+        :return: True if every input bit is used exactly once
+        """
+        return sorted(self.positions) == list(range(1, self.in_bits + 1))
+
+    def inverse(self):
+        """
+        Compute the inverse permutation
+        :return: Permutation undoing this one
+        """
+        if not self.is_bijective():
+            raise ValueError('Only a one-to-one permutation has an inverse.')
+        inverse = [0] * self.in_bits
+        for out_pos, in_pos in enumerate(self.positions):
+            inverse[in_pos - 1] = out_pos + 1
+        return compile_permutation(tuple(inverse), self.out_bits)
+
+    def as_dict(self):
+        """
+        :return: the permutation as a dictionary of output position to input position
+        """
+        return {i + 1: pos for i, pos in enumerate(self.positions)}
+
+    def __repr__(self):
+        return 'Permutation(%s -> %s bits, %s)' % (self.in_bits, self.out_bits, self.method)
+
+@lru_cache(maxsize=None)
+def _compile(positions: tuple, in_bits, method: str):
+    return Permutation(positions, in_bits, method)
+
+def compile_permutation(table, in_bits=None, method='auto'):
+    """
+    Compile a permutation table, compiled tables are cached so this is cheap to call again
+    :param table: permutation matrix, flat list or dictionary of 1-based input positions
+    :param in_bits: length of the input in bits, the largest position in table by default
+    :param method: 'auto', 'tables' or 'shifts', see Permutation
+    :return: Permutation
+    """
+    return _compile(flatten_table(table), in_bits, method)
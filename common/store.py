@@ -0,0 +1,278 @@
+import hashlib
+import json
+import os
+import time
+from common.lazy import lazy_import
+
+np = lazy_import('numpy')
+
+# On-disk store of precomputed artifacts
+# An artifact is a numpy array (a full SPN codebook for a key, the states of one round for a
+# key, a LAT, DES lookup tables...) described by a configuration dictionary holding everything
+# it depends on: the kind of artifact, the s-box, the permutation, the number of rounds, the key.
+# The sha256 of the canonical JSON form of the configuration names the files, so the same
+# configuration always finds the same artifact and any change to it finds another one.
+#
+# Every artifact is a .npy file, which np.load opens with mmap_mode='r' for zero-copy reads
+# shared between processes, next to a .json file with the configuration, the shape, the dtype
+# and the size (the .npy header has no room for extra fields). Files are written under a
+# temporary name and renamed, so readers never see half an artifact. The store keeps its total
+# size under a cap by evicting the least recently used artifacts, use being recorded in the
+# modification time of the .json file.
+
+# default location of the store and size cap in bytes
+STORE_DIR = os.environ.get('ARTIFACT_STORE', os.path.join(os.path.expanduser('~'), '.cache', 'crypto_hw10'))
+MAX_BYTES = 2**30
+
+def canonical(value):
+    """
+    Convert a configuration value into plain JSON types, with a single form for equal values
+    :param value: dictionary, list, tuple, numpy array or scalar
+    :return: JSON-serializable value
+    """
+    if isinstance(value, dict):
+        return [[str(k), canonical(v)] for k, v in sorted(value.items(), key=lambda item: str(item[0]))]
+    if isinstance(value, (list, tuple)):
+        return [canonical(v) for v in value]
+    if hasattr(value, 'tolist'):
+        return canonical(value.tolist())
+    return value
+
+def config_digest(config: dict):
+    """
+    :param config: configuration of an artifact
+    :return: hex sha256 of its canonical form
+    """
+    text = json.dumps(canonical(config), separators=(',', ':'))
+    return hashlib.sha256(text.encode()).hexdigest()
+
+class ArtifactStore:
+    """
+    A directory of artifacts keyed by configuration, with a size cap and LRU eviction
+    """
+    def __init__(self, root=STORE_DIR, max_bytes=MAX_BYTES):
+        """
+        :param root: directory of the store, created if missing
+        :param max_bytes: size cap of the .npy files together
+        """
+        self.root = root
+        self.max_bytes = max_bytes
+        os.makedirs(root, exist_ok=True)
+
+    def paths(self, digest: str):
+        """
+        :return: (.npy path, .json path) of an artifact
+        """
+        base = os.path.join(self.root, digest)
+        return base + '.npy', base + '.json'
+
+    def get(self, config: dict):
+        """
+        Open a stored artifact
+        :param config: configuration of the artifact
+        :return: read-only memory-mapped numpy array, or None if not stored
+        """
+        data_path, meta_path = self.paths(config_digest(config))
+        try:
+            array = np.load(data_path, mmap_mode='r')
+            # mark as used
+            os.utime(meta_path)
+        except FileNotFoundError:
+            return None
+        return array
+
+    def put(self, config: dict, array):
+        """
+        Store an artifact, evicting others if needed to stay under the size cap
+        :param config: configuration of the artifact
+        :param array: numpy array
+        :return: the stored artifact, memory-mapped
+        """
+        array = np.ascontiguousarray(array)
+        if array.nbytes > self.max_bytes:
+            raise ValueError('The artifact (%s bytes) is larger than the store (%s bytes).'
+                             % (array.nbytes, self.max_bytes))
+        digest = config_digest(config)
+        data_path, meta_path = self.paths(digest)
+        self.evict(self.max_bytes - array.nbytes, keep=digest)
+        meta = {'config': canonical(config), 'shape': list(array.shape), 'dtype': array.dtype.str,
+                'bytes': int(array.nbytes), 'created': time.time()}
+        # unique names, so concurrent writers of the same artifact do not trip over each other
+        suffix = '.%s.%s.tmp' % (os.getpid(), id(array))
+        with open(data_path + suffix, 'wb') as f:
+            np.save(f, array)
+        with open(meta_path + suffix, 'w') as f:
+            json.dump(meta, f)
+        os.replace(data_path + suffix, data_path)
+        os.replace(meta_path + suffix, meta_path)
+        return np.load(data_path, mmap_mode='r')
+
+    def get_or_build(self, config: dict, build):
+        """
+        :param config: configuration of the artifact
+        :param build: function without arguments computing the artifact when it is not stored
+        :return: the artifact, memory-mapped
+        """
+        array = self.get(config)
+        if array is None:
+            array = self.put(config, build())
+        return array
+
+    def entries(self):
+        """
+        :return: list of the metadata of every artifact, with its 'digest' and 'used' time,
+                 least recently used first
+        """
+        output = []
+        for name in os.listdir(self.root):
+            if not name.endswith('.json'):
+                continue
+            path = os.path.join(self.root, name)
+            try:
+                with open(path) as f:
+                    meta = json.load(f)
+                meta['used'] = os.path.getmtime(path)
+            except (FileNotFoundError, ValueError):
+                continue
+            meta['digest'] = name[:-len('.json')]
+            output.append(meta)
+        return sorted(output, key=lambda meta: meta['used'])
+
+    def size(self):
+        """
+        :return: total size of the stored arrays in bytes
+        """
+        return sum(meta['bytes'] for meta in self.entries())
+
+    def remove(self, digest: str):
+        for path in self.paths(digest):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def evict(self, max_bytes=None, keep=None):
+        """
+        Remove the least recently used artifacts until the store fits in max_bytes. Arrays
+        already mapped stay readable until closed.
+        :param max_bytes: target size, the size cap by default
+        :param keep: digest of an artifact not to remove
+        :return: list of the digests removed
+        """
+        if max_bytes is None:
+            max_bytes = self.max_bytes
+        entries = self.entries()
+        total = sum(meta['bytes'] for meta in entries)
+        removed = []
+        for meta in entries:
+            if total <= max_bytes:
+                break
+            if meta['digest'] == keep:
+                continue
+            self.remove(meta['digest'])
+            total -= meta['bytes']
+            removed.append(meta['digest'])
+        return removed
+
+    def clear(self):
+        for meta in self.entries():
+            self.remove(meta['digest'])
+
+# Artifacts of the ciphers and the analysis
+
+def spn_config(kind: str, sbox, perm, num_rounds: int, key=None, **extra):
+    """
+    :param kind: kind of artifact
+    :param sbox: s-box, a dictionary in the form of P1.spn.s_box or a list
+    :param perm: permutation, in any form accepted by compile_permutation
+    :param num_rounds: number of spn rounds
+    :param key: master key, if the artifact depends on it
+    :param extra: other settings the artifact depends on
+    :return: configuration dictionary
+    """
+    from P1.spn import sbox_to_list
+    from common.permutation import compile_permutation
+    sbox = sbox_to_list(sbox) if isinstance(sbox, dict) else [int(x) for x in sbox]
+    config = {'kind': kind, 'sbox': sbox, 'perm': compile_permutation(perm, 16).positions,
+              'rounds': num_rounds, 'key': key}
+    config.update(extra)
+    return config
+
+def spn_codebook(key: int, num_rounds=2, key_length=None, sbox=None, perm=None, store=None):
+    """
+    The full codebook of the 16-bit SPN under a key: entry x is the encryption of x
+    :param key: master key as an integer
+    :param num_rounds: number of spn rounds
+    :param key_length: length of key in bits, defaults to 4 * num_rounds + 16
+    :param sbox: s-box, P1.spn.s_box by default
+    :param perm: permutation, P1.spn.permutation_map by default
+    :param store: ArtifactStore, the default one if None
+    :return: memory-mapped numpy uint16 array of 2**16 ciphertexts
+    """
+    return spn_states(key, num_rounds, key_length, sbox=sbox, perm=perm, store=store)
+
+def spn_states(key: int, num_rounds=2, key_length=None, stop_round=None, stage='w', sbox=None, perm=None,
+               store=None):
+    """
+    One state of the 16-bit SPN under a key for every input, as in spn_encrypt_batch
+    :param key: master key as an integer
+    :param num_rounds: number of spn rounds
+    :param key_length: length of key in bits, defaults to 4 * num_rounds + 16
+    :param stop_round: round of the state, the ciphertext if None
+    :param stage: 'u', 'v' or 'w', see spn_encrypt_batch
+    :param sbox: s-box, P1.spn.s_box by default
+    :param perm: permutation, P1.spn.permutation_map by default
+    :param store: ArtifactStore, the default one if None
+    :return: memory-mapped numpy uint16 array, entry x being the state for input x
+    """
+    from P1.spn import s_box, permutation_map, build_spn_tables, spn_encrypt_batch
+    sbox = s_box if sbox is None else sbox
+    perm = permutation_map if perm is None else perm
+    config = spn_states_config(key, num_rounds, key_length, stop_round, stage, sbox, perm)
+    key_length, stop_round, stage = config['key_length'], config['stop_round'], config['stage']
+    return (store or ArtifactStore()).get_or_build(config, lambda: spn_encrypt_batch(
+        np.arange(2**16, dtype=np.uint16), key, num_rounds, key_length, build_spn_tables(sbox, perm),
+        stop_round=None if stop_round == num_rounds and stage == 'w' else stop_round, stage=stage))
+
+def spn_states_config(key: int, num_rounds=2, key_length=None, stop_round=None, stage='w', sbox=None, perm=None):
+    """
+    Configuration of the artifact of spn_states, for callers computing the states themselves
+    :return: configuration dictionary, with the defaults spelt out so that passing them
+             explicitly finds the same artifact
+    """
+    from P1.spn import s_box, permutation_map
+    sbox = s_box if sbox is None else sbox
+    perm = permutation_map if perm is None else perm
+    key_length = 4 * num_rounds + 16 if key_length is None else key_length
+    if stop_round is None:
+        stop_round, stage = num_rounds, 'w'
+    return spn_config('spn states', sbox, perm, num_rounds, key, key_length=key_length,
+                      stop_round=stop_round, stage=stage)
+
+def sbox_table(sbox, kind='lat', store=None):
+    """
+    The LAT (as in spn_NL_table.py) or DDT of an s-box
+    :param sbox: s-box dictionary or list
+    :param kind: 'lat' or 'ddt'
+    :param store: ArtifactStore, the default one if None
+    :return: memory-mapped 2-D numpy array, see P4.sbox_analysis.lat and ddt
+    """
+    from P1.spn import sbox_to_list
+    from P4.sbox_analysis import lat, ddt
+    if kind not in ('lat', 'ddt'):
+        raise ValueError("kind must be 'lat' or 'ddt'.")
+    entries = sbox_to_list(sbox) if isinstance(sbox, dict) else [int(x) for x in sbox]
+    config = {'kind': kind, 'sbox': entries}
+    return (store or ArtifactStore()).get_or_build(config, lambda: (lat if kind == 'lat' else ddt)(entries))
+
+def des_sp_tables(permute=True, store=None):
+    """
+    The combined S-box and P tables of EC.DES.sp_tables, for the DES constants of EC/DES_VALS.py
+    :param permute: set to False for the tables of the S-boxes alone
+    :param store: ArtifactStore, the default one if None
+    :return: memory-mapped numpy uint64 array of shape (8, 64)
+    """
+    import EC.DES_VALS as vals
+    from EC.DES import sp_tables
+    config = {'kind': 'des sp tables', 'sbox': vals.sbox_array, 'P': vals.P if permute else None}
+    return (store or ArtifactStore()).get_or_build(config, lambda: np.array(sp_tables(permute), dtype=np.uint64))
@@ -0,0 +1,117 @@
+import time
+
+# Tracing hooks for the round loops
+# The SPN and DES functions take an optional tracer: any callable taking (round, stage, value),
+# called after each stage of each round with the value it produced. The stage names are listed
+# with each function, e.g. 'u', 'v' and 'w' for the SPN or 'E', 'xor', 'S', 'f', 'L' and 'R' for
+# DES. Every traced operation starts with a (0, 'input', data) event. When no tracer is given the
+# functions take their untraced path, which is checked once per call, so tracing costs nothing
+# when detached.
+#
+# Recorder keeps the events, Printer prints them as they come and StageTimer adds up the time
+# spent in every stage; tee attaches several tracers at once.
+
+class Recorder:
+    """
+    Keeps every event, for inspection after the run
+    """
+    def __init__(self):
+        self.events = []
+
+    def __call__(self, round_number: int, stage: str, value):
+        self.events.append((round_number, stage, value))
+
+    def values(self, stage: str):
+        """
+        :param stage: stage name
+        :return: dictionary of round number to the value of that stage, the last one if repeated
+        """
+        return {round_number: value for round_number, s, value in self.events if s == stage}
+
+    def table(self, stage: str, size: int):
+        """
+        :param stage: stage name
+        :param size: length of the list
+        :return: list indexed by round number, None for the rounds without this stage
+        """
+        output = [None] * size
+        for round_number, value in self.values(stage).items():
+            output[round_number] = value
+        return output
+
+    def clear(self):
+        self.events = []
+
+class Printer:
+    """
+    Prints every event as it comes, e.g. 'u_1 = 0x1c4e'
+    """
+    def __init__(self, width=None, binary=False, file=None):
+        """
+        :param width: number of bits to print values with, None to print them as they are
+        :param binary: set to True to print in binary rather than hexadecimal
+        :param file: stream to print to, standard output by default
+        """
+        self.width = width
+        self.binary = binary
+        self.file = file
+
+    def __call__(self, round_number: int, stage: str, value):
+        if self.width is not None and isinstance(value, int):
+            if self.binary:
+                value = '0b' + format(value, '0%sb' % self.width)
+            else:
+                value = '0x' + format(value, '0%sx' % -(-self.width // 4))
+        print('%s_%s = %s' % (stage, round_number, value), file=self.file)
+
+class StageTimer:
+    """
+    Adds up the time between an event and the one before it under the stage of the event, i.e.
+    the time taken to compute each stage. An 'input' event starts the clock of a new operation.
+    """
+    def __init__(self, clock=time.perf_counter_ns):
+        """
+        :param clock: function returning the time in nanoseconds
+        """
+        self.clock = clock
+        self.totals = {}
+        self.counts = {}
+        self.last = None
+
+    def __call__(self, round_number: int, stage: str, value):
+        now = self.clock()
+        if stage != 'input' and self.last is not None:
+            self.totals[stage] = self.totals.get(stage, 0) + now - self.last
+            self.counts[stage] = self.counts.get(stage, 0) + 1
+        # read the clock again so the bookkeeping above is not charged to the next stage
+        self.last = self.clock()
+
+    def report(self):
+        """
+        :return: dictionary of stage to (number of events, total ns, mean ns), slowest stage first
+        """
+        stages = sorted(self.totals, key=self.totals.get, reverse=True)
+        return {stage: (self.counts[stage], self.totals[stage], self.totals[stage] / self.counts[stage])
+                for stage in stages}
+
+    def reset(self):
+        self.totals = {}
+        self.counts = {}
+        self.last = None
+
+def tee(*tracers):
+    """
+    Combine tracers into one, None entries are left out
+    :param tracers: tracers to call in turn
+    :return: tracer, or None if no tracer was given
+    """
+    tracers = [tracer for tracer in tracers if tracer is not None]
+    if not tracers:
+        return None
+    if len(tracers) == 1:
+        return tracers[0]
+
+    def tracer(round_number: int, stage: str, value):
+        for t in tracers:
+            t(round_number, stage, value)
+    return tracer
@@ -0,0 +1,68 @@
+import unittest
+import numpy as np
+from EC.DES import (BitArray, DES_encrypt, DES_encrypt_int, DES_decrypt_int, do_f_int, get_subkeys_int,
+                    key_schedule, DES_encrypt_batch, DES_decrypt_batch, bitslice, unbitslice,
+                    get_subkeys_array, DES_encrypt_keys, DES_decrypt_keys)
+
+# Known answers for the integer DES core: the worked example of
+# http://page.math.tu-berlin.de/~kant/teaching/hess/krypto-ws2006/des.htm and the example at
+# the end of EC/DES.py, then agreement with the BitArray implementation on random blocks. The
+# batch engines must give the same blocks as DES_encrypt_int.
+
+class IntegerCoreTest(unittest.TestCase):
+    def test_tu_berlin(self):
+        key = 0x133457799BBCDFF1
+        subkeys = get_subkeys_int(key)
+        self.assertEqual(subkeys[1], 0x1B02EFFC7072)
+        self.assertEqual(subkeys[16], 0xCB3D8B0E17F5)
+        self.assertEqual(do_f_int(0xF0AAF0AA, 0x1B02EFFC7072), 0x234AA9BB)
+        self.assertEqual(DES_encrypt_int(0x0123456789ABCDEF, key), 0x85E813540F0AB405)
+        self.assertEqual(DES_decrypt_int(0x85E813540F0AB405, key), 0x0123456789ABCDEF)
+        self.assertEqual(DES_encrypt_int(0x0123456789ABCDEF, key_schedule(key)), 0x85E813540F0AB405)
+
+    def test_script_example(self):
+        self.assertEqual(DES_encrypt_int(0x2567CDB3FDCE7E2A, 0xE567CDB3FDCE7F2A), 0x6039863C89412F73)
+
+    def test_matches_bitarray(self):
+        rng = np.random.default_rng(0)
+        for _ in range(20):
+            block, key = (int(x) for x in rng.integers(0, 2**64, 2, dtype=np.uint64))
+            expected = DES_encrypt(BitArray(uint=block, length=64), BitArray(uint=key, length=64)).uint
+            self.assertEqual(DES_encrypt_int(block, key), expected)
+
+class BitslicedTest(unittest.TestCase):
+    def test_bitslice_round_trip(self):
+        blocks = np.random.default_rng(1).integers(0, 2**64, 200, dtype=np.uint64)
+        self.assertEqual(unbitslice(bitslice(blocks), len(blocks)).tolist(), blocks.tolist())
+
+    def test_matches_scalar(self):
+        rng = np.random.default_rng(2)
+        key = 0x133457799BBCDFF1
+        # lengths around the 64 blocks of a word and a chunk boundary
+        for count in (1, 63, 64, 65, 300):
+            blocks = rng.integers(0, 2**64, count, dtype=np.uint64)
+            output = DES_encrypt_batch(blocks, key, chunk_size=128)
+            self.assertEqual(output.tolist(), [DES_encrypt_int(int(x), key) for x in blocks])
+            self.assertEqual(DES_decrypt_batch(output, key).tolist(), blocks.tolist())
+
+class KeyBatchedTest(unittest.TestCase):
+    def test_subkeys(self):
+        keys = np.random.default_rng(4).integers(0, 2**64, 50, dtype=np.uint64)
+        self.assertEqual(get_subkeys_array(keys).T.tolist(), [get_subkeys_int(int(k)) for k in keys])
+
+    def test_matches_scalar(self):
+        keys = np.random.default_rng(5).integers(0, 2**64, 300, dtype=np.uint64)
+        output = DES_encrypt_keys(0x0123456789ABCDEF, keys, chunk_size=128)
+        self.assertEqual(output.tolist(), [DES_encrypt_int(0x0123456789ABCDEF, int(k)) for k in keys])
+        self.assertEqual(DES_decrypt_keys(output, keys).tolist(), [0x0123456789ABCDEF] * len(keys))
+        self.assertEqual(int(DES_encrypt_keys(0x0123456789ABCDEF, [0x133457799BBCDFF1])[0]), 0x85E813540F0AB405)
+
+    def test_reduced_rounds(self):
+        keys = np.random.default_rng(6).integers(0, 2**64, 50, dtype=np.uint64)
+        for num_rounds in (1, 5):
+            output = DES_encrypt_keys(0x0123456789ABCDEF, keys, num_rounds=num_rounds)
+            self.assertEqual(output.tolist(), [DES_encrypt_int(0x0123456789ABCDEF, int(k), num_rounds=num_rounds)
+                                               for k in keys])
+
+if __name__ == '__main__':
+    unittest.main()
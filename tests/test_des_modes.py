@@ -0,0 +1,89 @@
+import io
+import os
+import tempfile
+import unittest
+from EC.DES_modes import encrypt_file, decrypt_file, encrypt_stream, pad, unpad, BLOCK_SIZE
+from EC.DES import DES_encrypt_int
+
+# Every mode must give back the plaintext through encrypt_file and decrypt_file, for lengths
+# around the block size and the chunk size: empty data, partial blocks, whole blocks (which get
+# a full block of padding) and several chunks.
+
+KEY = 0x133457799BBCDFF1
+TDES_KEY = (0x0123456789ABCDEF, 0x23456789ABCDEF01, 0x456789ABCDEF0123)
+CHUNK_SIZE = 64
+LENGTHS = (0, 1, 7, 8, 9, 63, 64, 65, 200)
+
+class FileModesTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+    def path(self, name: str):
+        return os.path.join(self.directory.name, name)
+
+    def round_trip(self, data: bytes, key, mode: str, iv=None):
+        with open(self.path('plain'), 'wb') as f:
+            f.write(data)
+        encrypt_file(self.path('plain'), self.path('cipher'), key, mode, iv, chunk_size=CHUNK_SIZE)
+        decrypt_file(self.path('cipher'), self.path('decrypted'), key, mode, iv, chunk_size=CHUNK_SIZE)
+        with open(self.path('cipher'), 'rb') as f:
+            ciphertext = f.read()
+        with open(self.path('decrypted'), 'rb') as f:
+            self.assertEqual(f.read(), data)
+        return ciphertext
+
+    def test_round_trip(self):
+        for key in (KEY, TDES_KEY, list(TDES_KEY)):
+            for mode in ('ECB', 'CBC', 'CTR'):
+                for length in LENGTHS:
+                    with self.subTest(key=key, mode=mode, length=length):
+                        data = os.urandom(length)
+                        ciphertext = self.round_trip(data, key, mode)
+                        header = 0 if mode == 'ECB' else BLOCK_SIZE
+                        if mode == 'CTR':
+                            self.assertEqual(len(ciphertext), header + length)
+                        else:
+                            # padding always adds 1 to 8 bytes
+                            self.assertEqual(len(ciphertext), header + length + BLOCK_SIZE - length % BLOCK_SIZE)
+
+    def test_given_iv(self):
+        data = os.urandom(100)
+        for mode in ('CBC', 'CTR'):
+            ciphertext = self.round_trip(data, KEY, mode, iv=0x0123456789ABCDEF)
+            # no header when the IV is given
+            self.assertEqual(len(ciphertext), 100 + (4 if mode == 'CBC' else 0))
+
+    def test_ecb_block(self):
+        # a whole block encrypts to the DES block followed by a block of padding
+        ciphertext = self.round_trip(bytes.fromhex('0123456789abcdef'), KEY, 'ECB')
+        self.assertEqual(ciphertext[:8].hex(), '85e813540f0ab405')
+        self.assertEqual(ciphertext[8:], DES_encrypt_int(int.from_bytes(b'\x08' * 8, 'big'), KEY).to_bytes(8, 'big'))
+
+    def test_stream_matches_file(self):
+        data = os.urandom(300)
+        with open(self.path('plain'), 'wb') as f:
+            f.write(data)
+        for mode in ('ECB', 'CBC', 'CTR'):
+            encrypt_file(self.path('plain'), self.path('cipher'), KEY, mode, iv=5, chunk_size=CHUNK_SIZE)
+            out = io.BytesIO()
+            encrypt_stream(io.BytesIO(data), out, KEY, mode, iv=5, chunk_size=CHUNK_SIZE)
+            with open(self.path('cipher'), 'rb') as f:
+                self.assertEqual(f.read(), out.getvalue())
+
+class PaddingTest(unittest.TestCase):
+    def test_pad(self):
+        self.assertEqual(pad(b''), b'\x08' * 8)
+        self.assertEqual(pad(b'abc'), b'abc' + b'\x05' * 5)
+        self.assertEqual(pad(b'abcdefgh'), b'abcdefgh' + b'\x08' * 8)
+        for length in range(0, 20):
+            data = os.urandom(length)
+            self.assertEqual(unpad(pad(data)), data)
+
+    def test_invalid_padding(self):
+        for data in (b'', b'abc', b'abcdefg\x00', b'abcdefg\x09', b'abcdef\x01\x02'):
+            with self.assertRaises(ValueError):
+                unpad(data)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,60 @@
+import json
+import os
+import tempfile
+import unittest
+from P1.spn import spn_process_int
+from P1.key_search import search_keys
+
+# An interrupted key search must resume from its checkpoint without redoing the finished
+# shards, and end with the same keys as a search run in one go.
+
+KEY = 0x3A94D63F
+NUM_ROUNDS = 4
+PAIRS = [(p, spn_process_int(p, KEY, NUM_ROUNDS)) for p in (0x26B7, 0x0123, 0xBEEF)]
+KEY_RANGE = (KEY - 2**15 + 77, KEY + 2**15)
+SHARD_SIZE = 2**12
+
+class Interrupted(Exception):
+    pass
+
+class ResumeTest(unittest.TestCase):
+    def search(self, **kwargs):
+        return search_keys(PAIRS, NUM_ROUNDS, workers=1, shard_size=SHARD_SIZE, key_range=KEY_RANGE, **kwargs)
+
+    def test_resume(self):
+        expected = self.search()
+        self.assertIn(KEY, expected)
+        num_shards = -(-(KEY_RANGE[1] - KEY_RANGE[0]) // SHARD_SIZE)
+        with tempfile.TemporaryDirectory() as directory:
+            checkpoint = os.path.join(directory, 'search.json')
+            calls = []
+
+            def interrupt(done, total, found):
+                calls.append(done)
+                if len(calls) == 5:
+                    raise Interrupted()
+            with self.assertRaises(Interrupted):
+                self.search(checkpoint=checkpoint, progress=interrupt)
+            with open(checkpoint) as f:
+                self.assertEqual(len(json.load(f)['done']), 5)
+            resumed = []
+            found = self.search(checkpoint=checkpoint, progress=lambda done, total, found: resumed.append(done))
+            self.assertEqual(found, expected)
+            # only the shards left are searched, and the progress counts the earlier ones
+            self.assertEqual(len(resumed), num_shards - 5)
+            self.assertEqual(resumed[-1], KEY_RANGE[1] - KEY_RANGE[0])
+            # a finished checkpoint gives the result without searching again
+            again = []
+            self.assertEqual(self.search(checkpoint=checkpoint, progress=lambda *args: again.append(args)), expected)
+            self.assertEqual(again, [])
+
+    def test_other_search(self):
+        with tempfile.TemporaryDirectory() as directory:
+            checkpoint = os.path.join(directory, 'search.json')
+            self.search(checkpoint=checkpoint)
+            with self.assertRaises(ValueError):
+                search_keys(PAIRS[:2], NUM_ROUNDS, workers=1, shard_size=SHARD_SIZE, key_range=KEY_RANGE,
+                            checkpoint=checkpoint)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,66 @@
+import asyncio
+import socket
+import struct
+import unittest
+import numpy as np
+from common.oracle import OracleServer, OracleClient, Target, REQUEST
+
+# The oracle must let go of a connection whose client disconnects with pipelined requests still
+# unanswered: the handler ends, its queue is drained and no task is left behind. Closing the
+# server with clients still connected must end their connections without hanging.
+
+class DisconnectTest(unittest.TestCase):
+    def test_disconnect_mid_pipeline(self):
+        asyncio.run(self.disconnect_mid_pipeline())
+
+    async def disconnect_mid_pipeline(self):
+        server = OracleServer({'des': Target('des', 0x133457799BBCDFF1)}, max_in_flight=4)
+        host, port = await server.start()
+        errors = []
+        asyncio.get_running_loop().set_exception_handler(lambda loop, context: errors.append(context))
+
+        def client():
+            sock = socket.create_connection((host, port))
+            blocks = np.arange(2**14, dtype='>u8').tobytes()
+            for _ in range(50):
+                sock.sendall(REQUEST.pack(b'E', 3, 2**14) + b'des' + blocks)
+            # reset the connection instead of closing it cleanly
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, struct.pack('ii', 1, 0))
+            sock.close()
+        await asyncio.get_running_loop().run_in_executor(None, client)
+        for _ in range(200):
+            if all(c['end'] is not None for c in server.clients.values()):
+                break
+            await asyncio.sleep(0.05)
+        self.assertTrue(server.clients)
+        self.assertTrue(all(c['end'] is not None for c in server.clients.values()))
+        # only the batching loops are left
+        batchers = set(b.task for b in server.batchers.values())
+        self.assertEqual(asyncio.all_tasks() - batchers, {asyncio.current_task()})
+        await server.close()
+        self.assertEqual(errors, [])
+
+class CloseTest(unittest.TestCase):
+    def test_close_with_client_connected(self):
+        errors = []
+        asyncio.run(self.close_with_client_connected(errors))
+        # also covers the loop teardown after the coroutine returns
+        self.assertEqual(errors, [])
+
+    async def close_with_client_connected(self, errors):
+        asyncio.get_running_loop().set_exception_handler(lambda loop, context: errors.append(context))
+        server = OracleServer({'des': Target('des', 0x133457799BBCDFF1)})
+        host, port = await server.start()
+        client = await OracleClient.connect(host=host, port=port)
+        output = await client.encrypt('des', np.array([0x0123456789abcdef], dtype=np.uint64))
+        self.assertEqual(int(output[0]), 0x85e813540f0ab405)
+        # the client stays connected and idle
+        await asyncio.wait_for(server.close(), 5)
+        self.assertFalse(server.connections)
+        self.assertTrue(all(c['end'] is not None for c in server.clients.values()))
+        with self.assertRaises(ConnectionError):
+            await client.encrypt('des', np.array([0], dtype=np.uint64))
+        await client.close()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,43 @@
+import unittest
+import numpy as np
+from P1.spn import BitArray, spn_process, spn_process_int, spn_encrypt_batch, build_spn_tables
+
+# The integer SPN engine must agree with the BitArray implementation of spn_process, on the
+# example of Stinson 3.2 and on random blocks and keys of several lengths, and the batch engine
+# with the integer one over the whole codebook.
+
+class IntegerEngineTest(unittest.TestCase):
+    def test_stinson_example(self):
+        self.assertEqual(spn_process_int(0xB33C, 0x8FA507), 0xF5B2)
+        self.assertEqual(spn_process_int(0xF5B2, 0x8FA507, encrypt=False), 0xB33C)
+
+    def test_matches_bitarray(self):
+        rng = np.random.default_rng(0)
+        for num_rounds, key_length in ((2, 24), (2, 32), (4, 32), (6, 40)):
+            for _ in range(20):
+                block = int(rng.integers(0, 2**16))
+                key = int(rng.integers(0, 2**key_length))
+                key_bits = BitArray(uint=key, length=key_length)
+                for encrypt in (True, False):
+                    expected = spn_process(BitArray(uint=block, length=16), key_bits, num_rounds, encrypt).uint
+                    self.assertEqual(spn_process_int(block, key, num_rounds, encrypt, key_length), expected)
+
+class BatchEngineTest(unittest.TestCase):
+    def check_codebook(self, key: int, num_rounds: int, key_length=None, tables=None):
+        kwargs = {} if tables is None else {'tables': tables}
+        codebook = np.arange(2**16, dtype=np.uint16)
+        output = spn_encrypt_batch(codebook, key, num_rounds, key_length, **kwargs)
+        self.assertEqual(output.dtype, np.uint16)
+        expected = [spn_process_int(x, key, num_rounds, True, key_length, **kwargs) for x in range(2**16)]
+        self.assertEqual(output.tolist(), expected)
+
+    def test_codebook(self):
+        self.check_codebook(0x8FA507, 2)
+        self.check_codebook(0x3A94D63F, 4)
+
+    def test_codebook_other_tables(self):
+        from P4.Observed_bias_4c import sub_dict_encrypt, perm_dict_encrypt
+        self.check_codebook(0x93E026DE, 4, 32, build_spn_tables(sub_dict_encrypt, perm_dict_encrypt))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,63 @@
+import unittest
+import numpy as np
+from P1.spn import spn_process_int, spn_encrypt_batch
+from P1.spn_cipher import stinson_spn, present_spn, presets
+
+# The configurable SPN against its two presets: the Stinson preset must be the cipher of
+# P1/spn.py for every number of rounds and key length, and the PRESENT preset must give the
+# published PRESENT-80 test vectors.
+
+class StinsonPresetTest(unittest.TestCase):
+    configurations = [(2, 24), (2, 32), (3, 28), (4, 32), (6, 40)]
+
+    def test_scalar(self):
+        rng = np.random.default_rng(3)
+        for num_rounds, key_length in self.configurations:
+            cipher = stinson_spn(num_rounds, key_length)
+            for key in rng.integers(0, 2**key_length, 4, dtype=np.uint64):
+                key = int(key)
+                for p in rng.integers(0, 2**16, 16):
+                    p = int(p)
+                    c = spn_process_int(p, key, num_rounds, key_length=key_length)
+                    self.assertEqual(cipher.encrypt(p, key), c, (num_rounds, key_length, key, p))
+                    self.assertEqual(cipher.decrypt(c, key), p)
+
+    def test_batch(self):
+        plaintexts = np.arange(2**16, dtype=np.uint16)
+        for num_rounds, key_length in self.configurations:
+            key = 0x3A94D63F5A17C0E2B & ((1 << key_length) - 1)
+            cipher = stinson_spn(num_rounds, key_length)
+            ciphertexts = cipher.encrypt_batch(plaintexts, key)
+            expected = spn_encrypt_batch(plaintexts, key, num_rounds, key_length)
+            np.testing.assert_array_equal(ciphertexts, expected)
+            np.testing.assert_array_equal(cipher.decrypt_batch(ciphertexts, key), plaintexts)
+
+    def test_default(self):
+        self.assertEqual(presets['stinson']().encrypt(0x26B7, 0x3A94D63F), spn_process_int(0x26B7, 0x3A94D63F, 4))
+
+class PresentTest(unittest.TestCase):
+    # (key, plaintext, ciphertext) from the PRESENT paper, Bogdanov et al., CHES 2007
+    vectors = [
+        (0x00000000000000000000, 0x0000000000000000, 0x5579C1387B228445),
+        (0xFFFFFFFFFFFFFFFFFFFF, 0x0000000000000000, 0xE72C46C0F5945049),
+        (0x00000000000000000000, 0xFFFFFFFFFFFFFFFF, 0xA112FFC72F68417B),
+        (0xFFFFFFFFFFFFFFFFFFFF, 0xFFFFFFFFFFFFFFFF, 0x3333DCD3213210D2),
+    ]
+
+    def test_vectors(self):
+        cipher = present_spn()
+        for key, p, c in self.vectors:
+            self.assertEqual(cipher.encrypt(p, key), c, hex(key))
+            self.assertEqual(cipher.decrypt(c, key), p)
+
+    def test_batch(self):
+        cipher = present_spn()
+        for key in (0, (1 << 80) - 1):
+            vectors = [(p, c) for k, p, c in self.vectors if k == key]
+            ciphertexts = cipher.encrypt_batch(np.array([p for p, _ in vectors], dtype=np.uint64), key)
+            self.assertEqual([int(c) for c in ciphertexts], [c for _, c in vectors])
+            plaintexts = cipher.decrypt_batch(ciphertexts, key)
+            self.assertEqual([int(p) for p in plaintexts], [p for p, _ in vectors])
+
+if __name__ == '__main__':
+    unittest.main()
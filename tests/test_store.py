@@ -0,0 +1,90 @@
+import os
+import tempfile
+import unittest
+import numpy as np
+from common.store import ArtifactStore, config_digest, spn_states
+from P1.spn import spn_encrypt_batch
+
+# The artifact store in a temporary directory: arrays come back as they were stored, equal
+# configurations find the same artifact, and the least recently used artifacts are evicted to
+# keep the store under its size cap.
+
+def config(i):
+    return {'kind': 'test', 'index': i}
+
+class StoreTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.store = ArtifactStore(self.directory.name, max_bytes=4096)
+
+    def test_round_trip(self):
+        array = np.arange(100, dtype=np.uint16).reshape(10, 10)
+        self.assertIsNone(self.store.get(config(0)))
+        self.store.put(config(0), array)
+        stored = self.store.get(config(0))
+        self.assertIsInstance(stored, np.memmap)
+        self.assertEqual(stored.dtype, array.dtype)
+        np.testing.assert_array_equal(stored, array)
+        with self.assertRaises(ValueError):
+            stored[0, 0] = 1
+        self.assertEqual(self.store.size(), array.nbytes)
+        self.assertEqual([meta['digest'] for meta in self.store.entries()], [config_digest(config(0))])
+
+    def test_digest(self):
+        digest = config_digest({'kind': 'test', 'sbox': [1, 2, 3], 'rounds': 4})
+        self.assertEqual(len(digest), 64)
+        # same configuration in another order or with other sequence types
+        self.assertEqual(config_digest({'rounds': 4, 'sbox': (1, 2, 3), 'kind': 'test'}), digest)
+        self.assertEqual(config_digest({'rounds': np.int64(4), 'sbox': np.array([1, 2, 3]), 'kind': 'test'}),
+                         digest)
+        self.assertNotEqual(config_digest({'kind': 'test', 'sbox': [1, 2, 3], 'rounds': 5}), digest)
+        self.assertNotEqual(config_digest({'kind': 'test', 'sbox': [1, 3, 2], 'rounds': 4}), digest)
+
+    def test_get_or_build(self):
+        calls = []
+
+        def build():
+            calls.append(1)
+            return np.ones(8, dtype=np.uint8)
+        for _ in range(3):
+            np.testing.assert_array_equal(self.store.get_or_build(config(0), build), np.ones(8))
+        self.assertEqual(len(calls), 1)
+        # another store on the same directory sees the artifact
+        ArtifactStore(self.directory.name).get_or_build(config(0), build)
+        self.assertEqual(len(calls), 1)
+
+    def test_eviction(self):
+        # four artifacts of 1024 bytes fill the store, used in the order 0, 1, 2, 3
+        for i in range(4):
+            self.store.put(config(i), np.full(1024, i, dtype=np.uint8))
+            _, meta_path = self.store.paths(config_digest(config(i)))
+            os.utime(meta_path, (1000 + i, 1000 + i))
+        self.assertEqual(self.store.size(), 4096)
+        # using 0 makes 1 the least recently used
+        self.assertIsNotNone(self.store.get(config(0)))
+        self.store.put(config(4), np.full(2048, 4, dtype=np.uint8))
+        self.assertIsNone(self.store.get(config(1)))
+        self.assertIsNone(self.store.get(config(2)))
+        for i in (0, 3, 4):
+            self.assertEqual(int(self.store.get(config(i))[0]), i)
+        self.assertLessEqual(self.store.size(), self.store.max_bytes)
+
+    def test_too_large(self):
+        self.store.put(config(0), np.zeros(1024, dtype=np.uint8))
+        with self.assertRaises(ValueError):
+            self.store.put(config(1), np.zeros(4097, dtype=np.uint8))
+        # nothing was evicted for it
+        self.assertIsNotNone(self.store.get(config(0)))
+
+    def test_spn_states(self):
+        store = ArtifactStore(self.directory.name)
+        key = 0x8FA507
+        states = spn_states(key, 2, store=store)
+        np.testing.assert_array_equal(states, spn_encrypt_batch(np.arange(2**16, dtype=np.uint16), key, 2))
+        # the default key length spelt out finds the same artifact
+        spn_states(key, 2, key_length=24, stop_round=2, stage='w', store=store)
+        self.assertEqual(len(store.entries()), 1)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,44 @@
+import unittest
+import numpy as np
+from EC.TDES import (BitArray, TDES_encrypt, TDES_encrypt_int, TDES_decrypt_int, TDES_encrypt_batch,
+                     TDES_decrypt_batch, tdes_key_schedule)
+
+# NIST vectors: the TDEA example of SP 800-67 (ECB, three keys), and the variable plaintext and
+# variable key known answers of SP 800-20, where K1 = K2 = K3 makes 3DES a single DES.
+
+SP800_67_KEYS = (0x0123456789ABCDEF, 0x23456789ABCDEF01, 0x456789ABCDEF0123)
+SP800_67 = [
+    (0x5468652071756663, 0xA826FD8CE53B855F),
+    (0x6B2062726F776E20, 0xCCE21C8112256FE6),
+    (0x666F78206A756D70, 0x68D5C05DD9B6B900),
+]
+# (key, plaintext, ciphertext)
+SP800_20 = [
+    (0x0101010101010101, 0x8000000000000000, 0x95F8A5E5DD31D900),
+    (0x0101010101010101, 0x4000000000000000, 0xDD7F121CA5015619),
+    (0x8001010101010101, 0x0000000000000000, 0x95A8D72813DAA94D),
+]
+
+class NistVectorTest(unittest.TestCase):
+    def test_sp800_67(self):
+        schedule = tdes_key_schedule(SP800_67_KEYS)
+        for plaintext, ciphertext in SP800_67:
+            self.assertEqual(TDES_encrypt_int(plaintext, SP800_67_KEYS), ciphertext)
+            self.assertEqual(TDES_decrypt_int(ciphertext, schedule), plaintext)
+        key = bytes.fromhex('0123456789ABCDEF23456789ABCDEF01456789ABCDEF0123')
+        self.assertEqual(TDES_encrypt(BitArray('0x5468652071756663'), key).uint, 0xA826FD8CE53B855F)
+
+    def test_sp800_20(self):
+        for key, plaintext, ciphertext in SP800_20:
+            self.assertEqual(TDES_encrypt_int(plaintext, (key, key, key)), ciphertext)
+            # two-key 3DES with K1 = K2 is single DES as well
+            self.assertEqual(TDES_encrypt_int(plaintext, (key, key)), ciphertext)
+
+    def test_batch(self):
+        blocks = np.array([p for p, _ in SP800_67], dtype=np.uint64)
+        output = TDES_encrypt_batch(blocks, SP800_67_KEYS)
+        self.assertEqual(output.tolist(), [c for _, c in SP800_67])
+        self.assertEqual(TDES_decrypt_batch(output, SP800_67_KEYS).tolist(), blocks.tolist())
+
+if __name__ == '__main__':
+    unittest.main()